@@ -0,0 +1,359 @@
+#######################################
+##
+## Bulk loaders that write report chunks to an existing table with the fastest
+## method each database offers, instead of the parameterized INSERTs that pandas'
+## to_sql() generates:
+##
+## - PostgreSQL: COPY FROM STDIN (psycopg2)
+## - MySQL and MariaDB: LOAD DATA LOCAL INFILE from a temporary file; the server
+##   must have local_infile enabled and dbURL must pass ?local_infile=1
+## - SQLite: a single executemany() in a single transaction
+## - Others: to_sql() with multi-row INSERTs
+##
+## Values are converted to text or Python objects only once per distinct value of
+## each column. Loaders write inside the caller's transaction, so many of them can
+## write concurrently and be committed in order. Tables are created by
+## GAAPItoDB.prepareTable() or, for tables not managed by GAAPItoDB, by pandas on
+## the first write.
+##
+
+
+
+import logging
+import contextlib
+import tempfile
+import os
+import numpy as np
+import pandas as pd
+import sqlalchemy
+
+
+
+module_logger = logging.getLogger(__name__)
+
+
+
+def distinctValues(column):
+    """
+    Return codes of each row of `column` and the Index of its distinct non-missing
+    values. Missing values have code -1.
+    """
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return column.cat.codes.to_numpy(), column.cat.categories
+
+    codes, uniques = pd.factorize(column)
+
+    return codes, pd.Index(uniques)
+
+
+
+def isIntegral(values):
+    # Float values without decimals, as int columns with missing values become
+    return pd.api.types.is_float_dtype(values.dtype) and bool(np.all(np.mod(values.to_numpy(), 1) == 0))
+
+
+
+class GABulkLoader(object):
+    # Parameters in a single multi-row INSERT. Some databases take no more than 2100.
+    maxParameters = 2000
+
+
+
+    def __init__(self, engine, table):
+        """
+        Write DataFrames to `table` through SQLAlchemy `engine`.
+        """
+        self.logger=logging.getLogger('{a}.{b}'.format(a=__name__, b=type(self).__name__))
+
+        self.engine=engine
+        self.table=table
+
+        self.quote=self.engine.dialect.identifier_preparer.quote
+
+        # Unknown until first write
+        self.tableReady=None
+
+
+
+    def load(self, df, ifexists='append', connection=None):
+        """
+        Write all columns of `df`, but not its index, to the table. If `ifexists`
+        is 'replace' or the table doesn't exist yet, pandas creates it.
+
+        Data is written in the transaction of SQLAlchemy `connection`, which the
+        caller commits, or in a transaction of its own if not passed.
+        """
+        if connection is None:
+            with self.engine.begin() as connection:
+                return self.load(df, ifexists, connection)
+
+        if self.creates(ifexists, connection):
+            # Let pandas create the table with types guessed from data
+            df.to_sql(
+                self.table,
+                if_exists=ifexists,
+                index=False,
+                con=connection
+            )
+            self.tableReady=True
+        else:
+            self.bulkLoad(df, connection)
+
+
+
+    def creates(self, ifexists='append', connection=None):
+        """
+        Tell if load() with `ifexists` will create the table.
+        """
+        if self.tableReady is None:
+            if connection is None:
+                with self.engine.connect() as c:
+                    self.tableReady=self.engine.dialect.has_table(c, self.table)
+            else:
+                self.tableReady=self.engine.dialect.has_table(connection, self.table)
+
+        return ifexists == 'replace' or not self.tableReady
+
+
+
+    def insert(self, df, connection):
+        # Multi-row INSERTs, as few as the limit of parameters allows
+        df.to_sql(
+            self.table,
+            if_exists='append',
+            index=False,
+            con=connection,
+            method='multi',
+            chunksize=max(1, self.maxParameters // max(1, df.shape[1]))
+        )
+
+
+
+    def bulkLoad(self, df, connection):
+        """
+        Write `df` to the existing table in the transaction of `connection`.
+        Override in subclasses.
+        """
+        self.insert(df, connection)
+
+
+
+    @contextlib.contextmanager
+    def rawConnection(self, statement, connection):
+        """
+        The DBAPI connection of SQLAlchemy `connection`, in its transaction. DBAPI
+        errors are raised as SQLAlchemy's, as pandas would raise them.
+        """
+        dbapi=self.engine.dialect.dbapi
+
+        try:
+            yield connection.connection
+        except dbapi.Error as e:
+            raise sqlalchemy.exc.DBAPIError.instance(statement, None, e, dbapi.Error)
+
+
+
+    def columnList(self, df):
+        return ', '.join([self.quote(c) for c in df.columns])
+
+
+
+class GASQLiteLoader(GABulkLoader):
+    """
+    Insert all rows with a single executemany() in a single transaction, with values
+    as SQLAlchemy stores them in SQLite.
+    """
+
+    def pythonColumn(self, column):
+        """
+        List of Python values of `column`, with None for missing values.
+        """
+        codes, uniques = distinctValues(column)
+
+        if pd.api.types.is_datetime64_any_dtype(uniques.dtype):
+            # Same text SQLAlchemy's DateTime stores
+            uniques = uniques.strftime('%Y-%m-%d %H:%M:%S.%f')
+        elif isIntegral(uniques):
+            uniques = uniques.astype(np.int64)
+
+        values = np.empty(len(uniques) + 1, dtype=object)
+        values[:-1] = uniques.tolist()
+        values[-1] = None
+
+        return values[codes].tolist()
+
+
+
+    def bulkLoad(self, df, connection):
+        statement='INSERT INTO {table} ({columns}) VALUES ({parameters})'.format(
+            table=self.quote(self.table),
+            columns=self.columnList(df),
+            parameters=', '.join(['?'] * df.shape[1])
+        )
+
+        rows=zip(*[self.pythonColumn(df[c]) for c in df.columns])
+
+        with self.rawConnection(statement, connection) as dbapiConnection:
+            dbapiConnection.cursor().executemany(statement, rows)
+
+
+
+class GATextLoader(GABulkLoader):
+    """
+    Base for loaders that stream rows in the tab separated text format that both
+    PostgreSQL's COPY and MySQL's LOAD DATA read by default, with \\N for NULL.
+    """
+
+    # Rows formatted at once when writing text
+    blockRows = 10000
+
+    # Bytes of text kept in RAM before spooling to a temporary file
+    spoolSize = 64*1024**2
+
+
+
+    def escape(value):
+        return (str(value)
+            .replace('\\', '\\\\')
+            .replace('\t', '\\t')
+            .replace('\n', '\\n')
+            .replace('\r', '\\r')
+        )
+
+
+
+    def binaryText(self, value):
+        """
+        Text of a bytes `value`. Override in subclasses.
+        """
+        return value.hex()
+
+
+
+    def textColumn(self, column):
+        """
+        Array of text of each row of `column`, with \\N for missing values.
+        """
+        codes, uniques = distinctValues(column)
+
+        if pd.api.types.is_datetime64_any_dtype(uniques.dtype):
+            texts = list(uniques.strftime('%Y-%m-%d %H:%M:%S.%f'))
+        elif pd.api.types.is_bool_dtype(uniques.dtype):
+            texts = ['1' if v else '0' for v in uniques]
+        elif isIntegral(uniques):
+            texts = list(uniques.astype(np.int64).astype(str))
+        elif pd.api.types.is_numeric_dtype(uniques.dtype):
+            texts = list(uniques.astype(str))
+        else:
+            texts = [
+                self.binaryText(v) if isinstance(v, bytes) else GATextLoader.escape(v)
+                for v in uniques
+            ]
+
+        text = np.empty(len(uniques) + 1, dtype=object)
+        text[:-1] = texts
+        text[-1] = '\\N'
+
+        return text[codes]
+
+
+
+    def writeText(self, df, file):
+        """
+        Write rows of `df` to text `file`, a block of rows at a time.
+        """
+        columns=[self.textColumn(df[c]) for c in df.columns]
+
+        for start in range(0, df.shape[0], self.blockRows):
+            lines=columns[0][start:start + self.blockRows]
+            for c in columns[1:]:
+                lines=lines + '\t' + c[start:start + self.blockRows]
+
+            file.write('\n'.join(lines))
+            file.write('\n')
+
+
+
+class GAPostgreSQLLoader(GATextLoader):
+    """
+    Stream rows with COPY FROM STDIN. Requires psycopg2.
+    """
+
+    def binaryText(self, value):
+        # bytea hex input, with its backslash escaped for COPY
+        return '\\\\x' + value.hex()
+
+
+
+    def bulkLoad(self, df, connection):
+        statement='COPY {table} ({columns}) FROM STDIN'.format(
+            table=self.quote(self.table),
+            columns=self.columnList(df)
+        )
+
+        with self.rawConnection(statement, connection) as dbapiConnection:
+            cursor=dbapiConnection.cursor()
+
+            if not hasattr(cursor, 'copy_expert'):
+                self.logger.debug(f'Driver {self.engine.dialect.driver} has no copy_expert(); using INSERTs')
+                cursor.close()
+                return self.insert(df, connection)
+
+            with tempfile.SpooledTemporaryFile(max_size=self.spoolSize, mode='w+', encoding='UTF-8', newline='') as file:
+                self.writeText(df, file)
+                file.seek(0)
+
+                cursor.copy_expert(statement, file)
+
+
+
+class GAMySQLLoader(GATextLoader):
+    """
+    Write rows to a temporary file and load it with LOAD DATA LOCAL INFILE. Binary
+    columns, as `__row_id` of managed tables, go as hex text converted by UNHEX().
+    """
+
+    def bulkLoad(self, df, connection):
+        columns=[]
+        conversions=[]
+
+        for i, c in enumerate(df.columns):
+            first=df[c].first_valid_index()
+
+            if df[c].dtype == object and first is not None and isinstance(df[c][first], bytes):
+                columns.append(f'@v{i}')
+                conversions.append(f'{self.quote(c)}=UNHEX(@v{i})')
+            else:
+                columns.append(self.quote(c))
+
+        statement=(
+            "LOAD DATA LOCAL INFILE %s INTO TABLE {table} CHARACTER SET utf8mb4 "
+            "FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' "
+            "({columns}){conversions}"
+        ).format(
+            table=self.quote(self.table),
+            columns=', '.join(columns),
+            conversions=(' SET ' + ', '.join(conversions)) if conversions else ''
+        )
+
+        fd, path=tempfile.mkstemp(suffix='.tsv')
+
+        try:
+            with os.fdopen(fd, 'w', encoding='UTF-8', newline='') as file:
+                self.writeText(df, file)
+
+            with self.rawConnection(statement, connection) as dbapiConnection:
+                dbapiConnection.cursor().execute(statement, (path,))
+        finally:
+            os.remove(path)
+
+
+
+# Loaders by SQLAlchemy dialect name, or by name passed as `bulkLoader`
+loaders = {
+    'to_sql':     GABulkLoader,
+    'sqlite':     GASQLiteLoader,
+    'postgresql': GAPostgreSQLLoader,
+    'mysql':      GAMySQLLoader,
+    'mariadb':    GAMySQLLoader
+}
@@ -0,0 +1,280 @@
+#######################################
+##
+## A small table that keeps track of each time partition synced by GAAPItoDB,
+## keyed by processor, GA View and target table: its status, number of rows
+## written and the last page token read from GA for each of its subreports.
+##
+## A partition is marked committed in the same order and right after all its
+## chunks were committed to the target table, so the end of the last committed
+## partition is where the next run resumes, found with a single lookup on the
+## primary key instead of a scan of the target table for max(synccursor).
+## Partitions not committed tell exactly what a crashed run was doing.
+##
+## Optionally, pages read from GA for partitions not yet committed are spooled to
+## disk, so a crashed run resumes in the middle of a partition without reading
+## again the pages it already had.
+##
+
+
+
+import logging
+import threading
+import datetime
+import shutil
+import json
+import os
+import pandas as pd
+import sqlalchemy
+
+from .GAResponseCache import GAResponseCache
+
+
+
+module_logger = logging.getLogger(__name__)
+
+
+
+class GACheckpoint(object):
+    def __init__(self, engine, table, processor, view, targetTable, spoolDirectory=None):
+        """
+        Checkpoints of `processor` syncing GA View `view` to `targetTable`, stored
+        in `table` through SQLAlchemy `engine`. Many processors can share the same
+        checkpoint table.
+
+        If `spoolDirectory` is set, GA pages of partitions not yet committed are
+        kept there, and deleted as soon as their partition is committed.
+        """
+        self.logger=logging.getLogger('{a}.{b}'.format(a=__name__, b=type(self).__name__))
+
+        self.engine=engine
+        self.processor=processor
+        self.view=view
+        self.targetTable=targetTable
+        self.spoolDirectory=spoolDirectory
+
+        self.table=sqlalchemy.Table(
+            table,
+            sqlalchemy.MetaData(),
+            sqlalchemy.Column('processor',        sqlalchemy.String(255), primary_key=True),
+            sqlalchemy.Column('view',             sqlalchemy.String(32),  primary_key=True),
+            sqlalchemy.Column('target_table',     sqlalchemy.String(255), primary_key=True),
+            sqlalchemy.Column('partition_start',  sqlalchemy.DateTime,    primary_key=True),
+            sqlalchemy.Column('partition_end',    sqlalchemy.DateTime),
+            sqlalchemy.Column('status',           sqlalchemy.String(16)),
+            sqlalchemy.Column('rows',             sqlalchemy.BigInteger),
+            sqlalchemy.Column('page_tokens',      sqlalchemy.Text),
+            sqlalchemy.Column('updated',          sqlalchemy.DateTime)
+        )
+
+        # {partition start: {subreport: last page token}} of partitions being fetched
+        self.tokens={}
+        self.lock=threading.Lock()
+
+
+
+    def utc(t):
+        # Times are stored as naive UTC, as in target tables
+        return pd.Timestamp(t).tz_convert('UTC').tz_localize(None).to_pydatetime()
+
+
+
+    def key(self):
+        """
+        Where clause of rows of this processor, view and target table.
+        """
+        return sqlalchemy.and_(
+            self.table.c.processor == self.processor,
+            self.table.c.view == self.view,
+            self.table.c.target_table == self.targetTable
+        )
+
+
+
+    def create(self):
+        self.table.create(self.engine, checkfirst=True)
+
+
+
+    def resumePoint(self):
+        """
+        Return the end of the last committed partition as a naive UTC datetime, or
+        None, and a list of dicts of partitions after it that were not committed,
+        in a single lookup.
+        """
+        with self.engine.connect() as connection:
+            if not self.engine.dialect.has_table(connection, self.table.name):
+                return (None, [])
+
+            lastCommitted=(
+                sqlalchemy.select(sqlalchemy.func.max(self.table.c.partition_end))
+                .where(self.key())
+                .where(self.table.c.status == 'committed')
+                .scalar_subquery()
+            )
+
+            rows=connection.execute(
+                sqlalchemy.select(self.table)
+                .where(self.key())
+                .where(sqlalchemy.or_(
+                    self.table.c.partition_end == lastCommitted,
+                    self.table.c.partition_start > sqlalchemy.func.coalesce(lastCommitted, datetime.datetime(1970, 1, 1))
+                ))
+                .order_by(self.table.c.partition_start)
+            ).mappings().all()
+
+        committed=[r for r in rows if r['status'] == 'committed']
+        inflight=[dict(r) for r in rows if r['status'] != 'committed']
+
+        end=committed[-1]['partition_end'] if len(committed) > 0 else None
+        if isinstance(end, str):
+            # SQLite may return text
+            end=pd.Timestamp(end).to_pydatetime()
+
+        return (end, inflight)
+
+
+
+    def reset(self, after=None):
+        """
+        Delete checkpoints of partitions not committed that start after naive UTC
+        `after`, or all checkpoints and spooled pages if `after` is None.
+        """
+        statement=self.table.delete().where(self.key())
+
+        if after is not None:
+            statement=(statement
+                .where(self.table.c.status != 'committed')
+                .where(self.table.c.partition_start >= after)
+            )
+
+        with self.engine.begin() as connection:
+            deleted=connection.execute(statement).rowcount
+
+        if after is None and self.spoolDirectory is not None:
+            shutil.rmtree(self.spoolPath(), ignore_errors=True)
+
+        self.logger.debug(f'Deleted {deleted} checkpoints of {self.processor}')
+
+
+
+    def save(self, p, connection=None, **values):
+        """
+        Update or insert the checkpoint of partition `p` with column `values`, in
+        the transaction of `connection` or in a transaction of its own.
+        """
+        if connection is None:
+            with self.engine.begin() as connection:
+                return self.save(p, connection, **values)
+
+        start=GACheckpoint.utc(p[0])
+
+        values['partition_end']=GACheckpoint.utc(p[1])
+        values['updated']=datetime.datetime.utcnow()
+
+        updated=connection.execute(
+            self.table.update()
+            .where(self.key())
+            .where(self.table.c.partition_start == start)
+            .values(**values)
+        ).rowcount
+
+        if updated == 0:
+            connection.execute(
+                self.table.insert().values(
+                    processor=self.processor,
+                    view=self.view,
+                    target_table=self.targetTable,
+                    partition_start=start,
+                    **values
+                )
+            )
+
+
+
+    def progress(self, p, **values):
+        """
+        Save progress of partition `p` that was not yet written. Only committed()
+        must never fail, so a busy database, as SQLite while a chunk is being
+        written, just delays progress to the next save.
+        """
+        try:
+            self.save(p, **values)
+        except sqlalchemy.exc.OperationalError as e:
+            self.logger.warning(f'Can’t save progress of partition starting at {p[0]}: {e}')
+
+
+
+    def begin(self, p):
+        """
+        Partition `p` was dispatched to GA fetchers.
+        """
+        with self.lock:
+            self.tokens[GACheckpoint.utc(p[0])]={}
+
+        self.progress(p, status='fetching', rows=None, page_tokens='{}')
+
+
+
+    def page(self, p, subreport, token):
+        """
+        A page of `subreport` of partition `p` was read and `token` is the one for
+        its next page, or None if it was the last one.
+        """
+        with self.lock:
+            tokens=self.tokens.setdefault(GACheckpoint.utc(p[0]), {})
+            tokens[str(subreport)]=token
+            text=json.dumps(tokens, sort_keys=True)
+
+        self.progress(p, page_tokens=text)
+
+
+
+    def queued(self, p, rows):
+        """
+        All pages of partition `p` were read and its `rows` are waiting to be written.
+        """
+        with self.lock:
+            self.tokens.pop(GACheckpoint.utc(p[0]), None)
+
+        self.progress(p, status='queued', rows=rows)
+
+
+
+    def committed(self, p, rows, connection):
+        """
+        All `rows` of partition `p` were written; saved in the transaction of
+        `connection`, which the caller commits.
+        """
+        self.save(p, connection, status='committed', rows=rows)
+
+
+
+    def spoolPath(self, p=None):
+        path=os.path.join(
+            self.spoolDirectory,
+            '{}-{}-{}'.format(self.processor, self.view, self.targetTable)
+        )
+
+        if p is not None:
+            path=os.path.join(path, GACheckpoint.utc(p[0]).strftime('%Y%m%dT%H%M%S'))
+
+        return path
+
+
+
+    def spool(self, p):
+        """
+        A GAResponseCache with pages read for partition `p`, or None if there is no
+        `spoolDirectory`.
+        """
+        if self.spoolDirectory is None:
+            return None
+
+        # Pages are needed until committed, no matter how many or how recent
+        return GAResponseCache(self.spoolPath(p), maxSize=float('inf'))
+
+
+
+    def discardSpool(self, p):
+        if self.spoolDirectory is not None:
+            shutil.rmtree(self.spoolPath(p), ignore_errors=True)
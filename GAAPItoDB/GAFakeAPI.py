@@ -0,0 +1,546 @@
+#######################################
+##
+## Local stand-ins for Google Analytics Reporting API v4 and Management API v3, so
+## GAAPItoDB can be tested and benchmarked offline, at any scale.
+##
+## - GASyntheticData generates realistic, seeded and reproducible hits for a list of
+##   GAAPItoDB dimensions, one day at a time.
+## - GAFakeAPI serves those hits through objects that behave like the ones built by
+##   googleapiclient: reports().batchGet() with paging, sampling metadata, API
+##   limits and quota errors, plus management().profiles().get().
+## - GACassette records real GA responses to local disk and replays them later.
+##
+## All of them are callables that can be passed as `gaServiceFactory` to GAAPItoDB.
+##
+
+
+
+from apiclient.discovery import build
+from apiclient.errors import HttpError
+import httplib2
+import logging
+import threading
+import functools
+import datetime
+import random
+import time
+import json
+import numpy as np
+import pandas as pd
+
+from .GAResponseCache import GAResponseCache
+
+
+
+module_logger = logging.getLogger(__name__)
+
+
+
+class GASyntheticData(object):
+    # Kinds of dimension values this generator knows how to produce
+    kinds = ['dateHourMinute', 'dateHour', 'date', 'hit', 'session', 'sequence', 'category', 'int', 'list']
+
+
+
+    def __init__(self, dimensions, seed=0, hitsPerDay=10000, hitsPerSession=8, profile=None, cacheDays=8):
+        """
+        Generate hits with all GA `dimensions`, a list as passed to GAAPItoDB.
+
+        The kind of values of each dimension is guessed from its structure, and can be
+        overwritten in `profile`, a dict of dimension name or title → spec as:
+
+        {
+            'ga:dimension3':    {'kind': 'category', 'cardinality': 12},
+            'sucursal_apolice': {'kind': 'list', 'cardinality': 5000, 'maxItems': 4, 'presence': 0.3},
+            'client_id':        {'kind': 'session'}
+        }
+
+        - `kind`: one of `kinds`
+        - `cardinality`: number of distinct values of category, int and list kinds
+        - `maxItems`: maximum number of comma separated items of list kind, as "123-456,123-789"
+        - `presence`: probability of the dimension being set on a hit. GA omits rows
+          where any requested dimension is not set.
+        - `per`: 'hit' or 'session', for category, int and list kinds
+
+        Each day of data is generated from `seed` and the date, so any day can be
+        reproduced alone. Last `cacheDays` generated days are kept in memory.
+        """
+        self.logger=logging.getLogger('{a}.{b}'.format(a=__name__, b=type(self).__name__))
+
+        self.seed=seed
+        self.hitsPerDay=hitsPerDay
+        self.hitsPerSession=hitsPerSession
+
+        if profile is None:
+            profile={}
+
+        self.specs={}
+        for d in dimensions:
+            spec=self.guessSpec(d)
+            spec.update(profile.get(d['name'], {}))
+            spec.update(profile.get(d['title'], {}))
+            self.specs[d['name']]=spec
+
+        self.day=functools.lru_cache(maxsize=cacheDays)(self.generateDay)
+
+
+
+    def guessSpec(self, dimension):
+        name=dimension['name']
+
+        if name in ['ga:dateHourMinute', 'ga:dateHour', 'ga:date']:
+            return {'kind': name.split(':')[1]}
+
+        if 'transformspawncolumns' in dimension and dimension['transformspawncolumns']:
+            # Something that will be exploded and split, as "123-456,123-789"
+            return {'kind': 'list', 'cardinality': 5000, 'maxItems': 3, 'per': 'session'}
+
+        if 'key' in dimension and dimension['key']:
+            if 'sequence' in dimension['title']:
+                return {'kind': 'sequence'}
+            if 'hit' in dimension['title']:
+                return {'kind': 'hit'}
+            return {'kind': 'session'}
+
+        if 'type' in dimension and dimension['type'] == 'int':
+            return {'kind': 'int', 'cardinality': 500, 'per': 'session'}
+
+        return {'kind': 'category', 'cardinality': 30}
+
+
+
+    def generateDay(self, date):
+        """
+        Return a DataFrame with all hits of `date`, one column per GA dimension name,
+        values as strings as GA returns them or None if not set.
+        """
+        ordinal=date.toordinal()
+        rng=np.random.default_rng([self.seed, ordinal])
+
+        n=int(rng.poisson(self.hitsPerDay))
+
+        # More hits during the day than during the night
+        weights=0.2 + np.sin(np.pi * np.arange(1440) / 1440)**2
+        minutes=np.sort(rng.choice(1440, size=n, p=weights/weights.sum()))
+
+        sessionCount=max(1, n // self.hitsPerSession)
+        sessions=rng.integers(sessionCount, size=n)
+
+        day=date.strftime('%Y%m%d')
+        columns={}
+
+        for position, (name, spec) in enumerate(self.specs.items()):
+            # Each dimension has its own random stream, so adding one doesn't change others
+            drng=np.random.default_rng([self.seed, ordinal, position])
+            kind=spec['kind']
+
+            if kind == 'dateHourMinute':
+                table=np.array([f'{day}{m//60:02d}{m%60:02d}' for m in range(1440)], dtype=object)
+                values=table.take(minutes)
+            elif kind == 'dateHour':
+                table=np.array([f'{day}{h:02d}' for h in range(24)], dtype=object)
+                values=table.take(minutes // 60)
+            elif kind == 'date':
+                values=np.full(n, day, dtype=object)
+            elif kind == 'hit':
+                values=np.array([f'{x:016x}' for x in drng.integers(0, 2**62, size=n)], dtype=object)
+            elif kind == 'session':
+                table=np.array([f'{x:016x}' for x in drng.integers(0, 2**62, size=sessionCount)], dtype=object)
+                values=table.take(sessions)
+            elif kind == 'sequence':
+                epoch=int(datetime.datetime.combine(date, datetime.time()).timestamp() * 1000)
+                values=np.array([str(x) for x in epoch + minutes*60000 + drng.integers(60000, size=n)], dtype=object)
+            else:
+                cardinality=spec.get('cardinality', 30)
+
+                if kind == 'int':
+                    table=np.array([str(x) for x in drng.integers(1, 10**6, size=cardinality)], dtype=object)
+                elif kind == 'list':
+                    table=np.array([f'{x//10**7:03d}-{x%10**7:07d}' for x in drng.integers(0, 10**10, size=cardinality)], dtype=object)
+                else:
+                    table=np.array([f'{name.split(":")[1]} {k}' for k in range(cardinality)], dtype=object)
+
+                # Few values are very popular, most are rare
+                popularity=1/np.arange(1, cardinality+1)
+                popularity/=popularity.sum()
+
+                perSession=(spec.get('per', 'hit') == 'session')
+                size=sessionCount if perSession else n
+
+                if kind == 'list':
+                    items=drng.integers(1, spec.get('maxItems', 3)+1, size=size)
+                    picks=drng.choice(cardinality, size=items.sum(), p=popularity)
+                    bounds=np.cumsum(items)
+                    values=np.array([','.join(table.take(x)) for x in np.split(picks, bounds[:-1])], dtype=object)
+                else:
+                    values=table.take(drng.choice(cardinality, size=size, p=popularity))
+
+                if perSession:
+                    values=values.take(sessions)
+
+            if spec.get('presence', 1) < 1:
+                values=values.copy()
+                values[drng.random(n) >= spec['presence']]=None
+
+            columns[name]=values
+
+        return pd.DataFrame(columns)
+
+
+
+
+
+class GAFakeRequest(object):
+    # Mimics googleapiclient.http.HttpRequest
+    def __init__(self, function, *args, **kwargs):
+        self.function=function
+        self.args=args
+        self.kwargs=kwargs
+
+    def execute(self):
+        return self.function(*self.args, **self.kwargs)
+
+
+
+class GAFakeService(object):
+    # Mimics objects built by googleapiclient.discovery.build() for both GA APIs
+    def __init__(self, api):
+        self.api=api
+
+    def reports(self):
+        return self
+
+    def batchGet(self, body, quotaUser=None):
+        return GAFakeRequest(self.api.batchGet, body, quotaUser)
+
+    def management(self):
+        return self
+
+    def profiles(self):
+        return self
+
+    def get(self, accountId=None, webPropertyId=None, profileId=None):
+        return GAFakeRequest(self.api.profile, accountId, webPropertyId, profileId)
+
+
+
+
+
+class GAFakeAPI(object):
+    # Limits of the real API
+    maxReportRequests = 5
+    maxDimensions = 9
+    maxPageSize = 100000
+
+
+
+    def __init__(
+                        self,
+                        data,
+                        timezone='Etc/GMT',
+                        samplingThreshold=None,
+                        quota=None,
+                        errorRate=0,
+                        latency=0,
+                        seed=0
+        ):
+        """
+        A local stand-in for GA APIs serving hits generated by `data`, a GASyntheticData.
+
+        - `timezone`: returned as the View's time zone by the Management API
+        - `samplingThreshold`: if a report covers more hits than this, only this many
+          are used and the response carries sampling metadata, as GA does
+        - `quota`: maximum number of batchGet() calls per 100 seconds; more than
+          that gets a 429 RESOURCE_EXHAUSTED error
+        - `errorRate`: probability of a call failing with a 503 error
+        - `latency`: seconds each call takes, to simulate network round trips
+
+        Pass it as `gaServiceFactory` to GAAPItoDB. It is thread-safe. Since `data`
+        usually depends on the dimensions of the GAAPItoDB object, it may be set
+        after the object was created, but before sync().
+        """
+        self.logger=logging.getLogger('{a}.{b}'.format(a=__name__, b=type(self).__name__))
+
+        self.data=data
+        self.timezone=timezone
+        self.samplingThreshold=samplingThreshold
+        self.quota=quota
+        self.errorRate=errorRate
+        self.latency=latency
+        self.seed=seed
+
+        self.lock=threading.Lock()
+        self.random=random.Random(seed)
+        self.callTimes=[]
+
+        # Statistics
+        self.calls=0
+        self.rows=0
+        self.errors=0
+
+
+
+    def __call__(self, serviceName, version, credentials=None):
+        return GAFakeService(self)
+
+
+
+    def httpError(self, status, reason, message):
+        resp=httplib2.Response({'status': status})
+        resp.reason=message
+
+        content=json.dumps({
+            'error': {
+                'code': status,
+                'message': message,
+                'status': reason,
+                'errors': [{'reason': reason, 'message': message}]
+            }
+        }).encode('UTF-8')
+
+        with self.lock:
+            self.errors+=1
+
+        return HttpError(resp, content)
+
+
+
+    def profile(self, accountId, webPropertyId, profileId):
+        return {
+            'id': f'{profileId}',
+            'accountId': f'{accountId}',
+            'webPropertyId': f'{webPropertyId}',
+            'name': 'Fake view',
+            'timezone': self.timezone
+        }
+
+
+
+    def batchGet(self, body, quotaUser=None):
+        with self.lock:
+            now=time.monotonic()
+
+            exhausted=False
+            if self.quota:
+                self.callTimes=[t for t in self.callTimes if t > now - 100]
+                exhausted=len(self.callTimes) >= self.quota
+
+            if not exhausted:
+                self.callTimes.append(now)
+                self.calls+=1
+
+                fail=self.random.random() < self.errorRate
+
+        # Raised out of the lock, which httpError() takes to count errors
+        if exhausted:
+            raise self.httpError(429, 'RESOURCE_EXHAUSTED', 'Quota exceeded for quota metric requests per 100 seconds')
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        if fail:
+            raise self.httpError(503, 'backendError', 'The service is currently unavailable.')
+
+        requests=body.get('reportRequests', [])
+
+        if len(requests) == 0 or len(requests) > self.maxReportRequests:
+            raise self.httpError(400, 'badRequest', f'There must be 1 to {self.maxReportRequests} requests.')
+
+        if any([r.get('dateRanges') != requests[0].get('dateRanges') for r in requests]):
+            raise self.httpError(400, 'badRequest', 'All requests should have the same dateRanges.')
+
+        reports=[self.report(r) for r in requests]
+
+        with self.lock:
+            self.rows+=sum([len(r['data'].get('rows', [])) for r in reports])
+
+        return {'reports': reports}
+
+
+
+    def report(self, request):
+        dimensions=[d['name'] for d in request.get('dimensions', [])]
+
+        if len(dimensions) == 0 or len(dimensions) > self.maxDimensions:
+            raise self.httpError(400, 'badRequest', f'Requested {len(dimensions)} dimensions; only {self.maxDimensions} are allowed.')
+
+        for d in dimensions:
+            if d not in self.data.specs:
+                raise self.httpError(400, 'badRequest', f'Unknown dimension(s): {d}')
+
+        clauses=request.get('dimensionFilterClauses', [])
+        columns=list(dict.fromkeys(dimensions + [f['dimensionName'] for c in clauses for f in c['filters']]))
+
+        dateRange=request['dateRanges'][0]
+        days=pd.date_range(dateRange['startDate'], dateRange['endDate'], freq='D')
+
+        hits=pd.concat([self.data.day(d.date())[columns] for d in days], ignore_index=True)
+
+        for c in clauses:
+            masks=[self.filterMask(hits, f) for f in c['filters']]
+
+            if c.get('operator', 'OR') == 'AND':
+                mask=np.logical_and.reduce(masks)
+            else:
+                mask=np.logical_or.reduce(masks)
+
+            hits=hits[mask]
+
+        samplesRead=None
+        samplingSpace=len(hits)
+        if self.samplingThreshold and samplingSpace > self.samplingThreshold:
+            samplesRead=self.samplingThreshold
+            hits=hits.sample(n=samplesRead, random_state=self.seed)
+
+        # GA omits rows where any requested dimension is not set, and aggregates equal rows
+        table=hits[dimensions].dropna().groupby(dimensions, sort=False).size().reset_index(name='__count')
+        del hits
+
+        for o in reversed(request.get('orderBys', [])):
+            table.sort_values(
+                by=o['fieldName'],
+                ascending=(o.get('sortOrder', 'ASCENDING') == 'ASCENDING'),
+                kind='stable',
+                inplace=True
+            )
+
+        pageSize=min(int(request.get('pageSize', 1000)), self.maxPageSize)
+        offset=int(request.get('pageToken') or 0)
+
+        report={
+            'columnHeader': {
+                'dimensions': dimensions,
+                'metricHeader': {'metricHeaderEntries': [{'name': 'ga:uniqueEvents', 'type': 'INTEGER'}]}
+            },
+            'data': {}
+        }
+
+        if table.shape[0] > 0:
+            page=table.iloc[offset:offset+pageSize]
+
+            report['data']['rows']=[
+                {
+                    'dimensions': list(row[:-1]),
+                    'metrics': [{'values': [str(row[-1])]}]
+                }
+                for row in page.itertuples(index=False, name=None)
+            ]
+            report['data']['rowCount']=int(table.shape[0])
+
+            if offset + pageSize < table.shape[0]:
+                report['nextPageToken']=str(offset + pageSize)
+
+        if samplesRead:
+            report['data']['samplesReadCounts']=[str(samplesRead)]
+            report['data']['samplingSpaceSizes']=[str(samplingSpace)]
+
+        return report
+
+
+
+    def filterMask(self, hits, f):
+        column=hits[f['dimensionName']]
+        expression=f['expressions'][0]
+        operator=f.get('operator', 'REGEXP')
+
+        if operator.startswith('NUMERIC_'):
+            column=pd.to_numeric(column, errors='coerce')
+            expression=float(expression)
+
+        if operator == 'NUMERIC_GREATER_THAN':
+            mask=column > expression
+        elif operator == 'NUMERIC_LESS_THAN':
+            mask=column < expression
+        elif operator in ['NUMERIC_EQUAL', 'EXACT']:
+            mask=column == expression
+        elif operator == 'IN_LIST':
+            mask=column.isin(f['expressions'])
+        elif operator == 'REGEXP':
+            mask=column.str.contains(expression, regex=True, na=False)
+        else:
+            raise self.httpError(400, 'badRequest', f'Unsupported operator {operator}')
+
+        if f.get('not', False):
+            mask=~mask
+
+        return mask.to_numpy()
+
+
+
+
+
+class GACassetteService(object):
+    # Same interface as GAFakeService, but records and replays real GA responses
+    def __init__(self, cassette, real):
+        self.cassette=cassette
+        self.real=real
+
+    def reports(self):
+        return self
+
+    def batchGet(self, body, quotaUser=None):
+        return GAFakeRequest(
+            self.cassette.play,
+            {'api': 'reports.batchGet', 'body': body},
+            lambda: self.real.reports().batchGet(body=body, quotaUser=quotaUser).execute()
+        )
+
+    def management(self):
+        return self
+
+    def profiles(self):
+        return self
+
+    def get(self, accountId=None, webPropertyId=None, profileId=None):
+        return GAFakeRequest(
+            self.cassette.play,
+            {'api': 'management.profiles.get', 'accountId': accountId, 'webPropertyId': webPropertyId, 'profileId': profileId},
+            lambda: self.real.management().profiles().get(accountId=accountId, webPropertyId=webPropertyId, profileId=profileId).execute()
+        )
+
+
+
+
+
+class GACassette(object):
+    def __init__(self, directory, mode='replay'):
+        """
+        Record GA responses into `directory` and replay them later, offline.
+
+        `mode` is 'record' to always call GA and store responses, 'replay' to only
+        use stored responses, failing on requests never recorded, or 'auto' to replay
+        what was recorded and record what wasn't.
+
+        Pass it as `gaServiceFactory` to GAAPItoDB.
+        """
+        self.logger=logging.getLogger('{a}.{b}'.format(a=__name__, b=type(self).__name__))
+
+        self.mode=mode
+        self.store=GAResponseCache(directory, maxSize=float('inf'))
+
+
+
+    def __call__(self, serviceName, version, credentials=None):
+        real=None
+
+        if self.mode != 'replay':
+            real=build(serviceName, version, credentials=credentials)
+
+        return GACassetteService(self, real)
+
+
+
+    def play(self, request, call):
+        if self.mode != 'record':
+            response=self.store.get(request)
+
+            if response is not None:
+                return response
+
+            if self.mode == 'replay':
+                raise LookupError(f'Request not recorded in cassette {self.store.directory}: {json.dumps(request)}')
+
+        response=call()
+        self.store.put(request, response)
+
+        return response
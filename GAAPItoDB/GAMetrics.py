@@ -0,0 +1,323 @@
+#######################################
+##
+## Counters and histograms of each stage of a sync: GA API latency, quota waits,
+## rows fetched, sampling, join, transformations, row ID hashing and DB writes.
+##
+## Metrics are exposed in Prometheus text format or OpenMetrics, as a textfile for
+## node_exporter's textfile collector or by a tiny HTTP endpoint, and as a JSON
+## summary of the run. A single GAMetrics object can be shared by many GAAPItoDB
+## objects and threads; samples are labeled with the name of their processor.
+##
+
+
+
+import logging
+import threading
+import http.server
+import contextlib
+import datetime
+import tempfile
+import bisect
+import json
+import time
+import os
+
+
+
+module_logger = logging.getLogger(__name__)
+
+
+
+class GAMetrics(object):
+    # Metric names, types and descriptions
+    definitions = {
+        'api_call_seconds':       ('histogram', 'Latency of successful GA API calls'),
+        'api_errors':             ('counter',   'GA API errors by kind, as classified by GARetryPolicy'),
+        'api_cache_hits':         ('counter',   'GA API calls served by GAResponseCache'),
+        'quota_wait_seconds':     ('histogram', 'Time waiting for the rate limiter before GA API calls'),
+        'rows_fetched':           ('counter',   'Rows of subreports read from GA pages'),
+        'sampling_ratio':         ('histogram', 'Fraction of sample space read by GA for each page, 1 for unsampled data'),
+        'join_seconds':           ('histogram', 'Time joining subreports of a time partition'),
+        'transform_seconds':      ('histogram', 'Time transforming a dimension of a time partition'),
+        'hash_seconds':           ('histogram', 'Time hashing row IDs of a time partition'),
+        'db_write_seconds':       ('histogram', 'Time writing and committing a chunk of a time partition to DB'),
+        'db_write_rows':          ('counter',   'Rows written to DB'),
+        'db_write_bytes':         ('counter',   'Bytes of RAM used by reports written to DB, as of memory_usage(deep=True)'),
+        'correction_rows':        ('counter',   'Rows fetched again in correction window, by kind: inserted, changed or unchanged'),
+    }
+
+    # Upper bounds of histogram buckets, in seconds
+    timeBuckets = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+    ratioBuckets = (0.01, 0.05, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99, 1)
+
+
+
+    def __init__(self, prefix='gaapitodb', textfile=None, summaryFile=None, port=None, address=''):
+        """
+        Collect metrics named as `prefix`_name.
+
+        When export() is called by GAAPItoDB.sync(), metrics are written to
+        `textfile` in Prometheus text format, to be picked by node_exporter, and a
+        JSON summary of the run to `summaryFile`.
+
+        If `port` is set, metrics are also served on http://`address`:`port`/metrics
+        for as long as the process runs.
+        """
+        self.logger=logging.getLogger('{a}.{b}'.format(a=__name__, b=type(self).__name__))
+
+        self.prefix=prefix
+        self.textfile=textfile
+        self.summaryFile=summaryFile
+
+        self.lock=threading.Lock()
+
+        # {(name, ((label, value), ...)): value} for counters
+        self.counters={}
+
+        # {(name, ((label, value), ...)): [bucket counts..., sum, count]} for histograms
+        self.histograms={}
+
+        self.started=datetime.datetime.now(datetime.timezone.utc)
+
+        self.server=None
+        if port is not None:
+            self.serve(port, address)
+
+
+
+    def key(self, name, labels):
+        if name not in self.definitions:
+            raise ValueError(f'Unknown metric {name}')
+
+        return (name, tuple(sorted(labels.items())))
+
+
+
+    def inc(self, name, value=1, **labels):
+        """
+        Add `value` to counter `name` with `labels`.
+        """
+        k=self.key(name, labels)
+
+        with self.lock:
+            self.counters[k]=self.counters.get(k, 0) + value
+
+
+
+    def observe(self, name, value, **labels):
+        """
+        Count `value` in histogram `name` with `labels`.
+        """
+        k=self.key(name, labels)
+        buckets=self.buckets(name)
+
+        with self.lock:
+            if k not in self.histograms:
+                self.histograms[k]=[0] * (len(buckets) + 2)
+
+            h=self.histograms[k]
+
+            # Buckets are counted cumulatively when exposed; values over the
+            # last bound are only in the +Inf bucket, which is the count
+            i=bisect.bisect_left(buckets, value)
+            if i < len(buckets):
+                h[i] += 1
+            h[-2] += value
+            h[-1] += 1
+
+
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        """
+        Context manager that observes its elapsed time in histogram `name`.
+        """
+        began=time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - began, **labels)
+
+
+
+    def buckets(self, name):
+        return self.ratioBuckets if name.endswith('_ratio') else self.timeBuckets
+
+
+
+    def labelText(labels, extra=None):
+        """
+        Render `labels`, a tuple of (label, value), as {label="value",...}.
+        """
+        labels=list(labels) + ([extra] if extra else [])
+
+        if len(labels) == 0:
+            return ''
+
+        def escape(v):
+            return str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+        return '{' + ','.join([f'{l}="{escape(v)}"' for l, v in labels]) + '}'
+
+
+
+    def exposition(self, openMetrics=False):
+        """
+        Return all metrics as text in Prometheus exposition format, or in
+        OpenMetrics format if `openMetrics` is True.
+        """
+        with self.lock:
+            counters=dict(self.counters)
+            histograms={k: list(v) for k, v in self.histograms.items()}
+
+        lines=[]
+
+        for name, (kind, description) in self.definitions.items():
+            family=f'{self.prefix}_{name}'
+
+            if kind == 'counter':
+                samples=[(labels, v) for (n, labels), v in sorted(counters.items()) if n == name]
+
+                if len(samples) == 0:
+                    continue
+
+                # Prometheus text format names counter families with their suffix
+                familyName=family if openMetrics else family + '_total'
+
+                lines.append(f'# HELP {familyName} {description}.')
+                lines.append(f'# TYPE {familyName} counter')
+
+                for labels, v in samples:
+                    lines.append(f'{family}_total{GAMetrics.labelText(labels)} {v}')
+            else:
+                samples=[(labels, h) for (n, labels), h in sorted(histograms.items()) if n == name]
+
+                if len(samples) == 0:
+                    continue
+
+                lines.append(f'# HELP {family} {description}.')
+                lines.append(f'# TYPE {family} histogram')
+
+                for labels, h in samples:
+                    cumulative=0
+                    for bound, count in zip(self.buckets(name), h):
+                        cumulative += count
+                        lines.append(f'{family}_bucket{GAMetrics.labelText(labels, ("le", bound))} {cumulative}')
+
+                    lines.append(f'{family}_bucket{GAMetrics.labelText(labels, ("le", "+Inf"))} {h[-1]}')
+                    lines.append(f'{family}_sum{GAMetrics.labelText(labels)} {h[-2]}')
+                    lines.append(f'{family}_count{GAMetrics.labelText(labels)} {h[-1]}')
+
+        if openMetrics:
+            lines.append('# EOF')
+
+        return '\n'.join(lines) + '\n'
+
+
+
+    def summary(self):
+        """
+        Return a dict with totals of all metrics, ready to be dumped as JSON:
+
+        {
+            'started': '2020-06-01T10:00:00+00:00',
+            'elapsed': 12.3,
+            'metrics': {
+                'rows_fetched': [{'labels': {'processor': 'P'}, 'total': 508708}],
+                'join_seconds': [{'labels': {'processor': 'P'}, 'count': 7, 'sum': 3.1, 'mean': 0.44}]
+            }
+        }
+        """
+        with self.lock:
+            counters=dict(self.counters)
+            histograms={k: list(v) for k, v in self.histograms.items()}
+
+        metrics={}
+
+        for (name, labels), v in sorted(counters.items()):
+            metrics.setdefault(name, []).append({
+                'labels': dict(labels),
+                'total':  v
+            })
+
+        for (name, labels), h in sorted(histograms.items()):
+            metrics.setdefault(name, []).append({
+                'labels': dict(labels),
+                'count':  h[-1],
+                'sum':    h[-2],
+                'mean':   h[-2]/h[-1] if h[-1] else None
+            })
+
+        return {
+            'started': self.started.isoformat(),
+            'elapsed': (datetime.datetime.now(datetime.timezone.utc) - self.started).total_seconds(),
+            'metrics': metrics
+        }
+
+
+
+    def export(self):
+        """
+        Write `textfile` and `summaryFile`, if configured.
+        """
+        if self.textfile is not None:
+            GAMetrics.writeAtomically(self.textfile, self.exposition())
+            self.logger.debug(f'Wrote metrics to {self.textfile}')
+
+        if self.summaryFile is not None:
+            GAMetrics.writeAtomically(self.summaryFile, json.dumps(self.summary(), indent=4))
+            self.logger.debug(f'Wrote run summary to {self.summaryFile}')
+
+
+
+    def writeAtomically(path, text):
+        # Readers as node_exporter must never see a partially written file
+        fd, temp=tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+
+        os.replace(temp, path)
+
+
+
+    def serve(self, port, address=''):
+        """
+        Serve metrics on http://`address`:`port`/metrics in a daemon thread, in
+        OpenMetrics format if the scraper accepts it.
+        """
+        metrics=self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+
+                openMetrics='application/openmetrics-text' in self.headers.get('Accept', '')
+
+                body=metrics.exposition(openMetrics).encode('UTF-8')
+
+                self.send_response(200)
+                if openMetrics:
+                    self.send_header('Content-Type', 'application/openmetrics-text; version=1.0.0; charset=utf-8')
+                else:
+                    self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                metrics.logger.debug(format % args)
+
+        self.server=http.server.HTTPServer((address, port), Handler)
+
+        threading.Thread(
+            target=self.server.serve_forever,
+            name='GAMetrics-http',
+            daemon=True
+        ).start()
+
+        self.logger.info(f'Serving metrics on http://{address or "0.0.0.0"}:{self.server.server_address[1]}/metrics')
@@ -0,0 +1,125 @@
+#######################################
+##
+## Decode pages of GA Reporting API responses straight into dictionary-encoded
+## columns, so a subreport of millions of rows doesn't need to keep millions of
+## small Python lists and repeated strings alive until it becomes a DataFrame.
+##
+
+
+
+import logging
+import numpy as np
+import pandas as pd
+
+
+
+module_logger = logging.getLogger(__name__)
+
+
+
+class GAPageDecoder(object):
+    def __init__(self, columns, categorical=(), categoricalRatio=None, candidates=None):
+        """
+        Accumulate rows of GA report pages for a subreport with dimension `columns`.
+
+        Each column is kept as a dictionary of its distinct values plus one chunk of
+        integer codes per page. Pages can be freed right after addPage().
+
+        Columns listed in `categorical` are delivered by dataFrame() as pandas
+        categoricals, straight from codes and dictionary. So are columns listed in
+        `candidates` (default all) with less distinct values than `categoricalRatio`
+        times the number of rows.
+        """
+        self.columns=columns
+        self.categorical=categorical
+        self.categoricalRatio=categoricalRatio
+        self.candidates=columns if candidates is None else candidates
+
+        # Per column: value → code, and list of code arrays, one per page
+        self.dictionaries=[{} for c in columns]
+        self.codes=[[] for c in columns]
+
+        self.rowCount=0
+
+
+
+    def addPage(self, rows):
+        """
+        Decode `rows`, as in report['data']['rows'] of a GA response, into columns.
+        """
+        if not rows:
+            return
+
+        # Transpose rows into columns in a single pass
+        columns=list(zip(*[r['dimensions'] for r in rows]))
+
+        for i in range(len(self.columns)):
+            # Page-local codes and distinct values, computed in C
+            pageCodes, pageUniques=pd.factorize(np.array(columns[i], dtype=object))
+
+            # Translate page-local codes into codes of the subreport-wide dictionary
+            dictionary=self.dictionaries[i]
+            translate=np.array(
+                [dictionary.setdefault(u, len(dictionary)) for u in pageUniques],
+                dtype=np.int32
+            )
+
+            self.codes[i].append(translate[pageCodes])
+
+            # Free the page column as soon as possible
+            columns[i]=None
+
+        self.rowCount+=len(rows)
+
+
+
+    def isCategorical(self, i):
+        """
+        Tell if column `i` should be delivered as a pandas categorical.
+        """
+        if self.columns[i] in self.categorical:
+            return True
+
+        if self.categoricalRatio is None or self.columns[i] not in self.candidates:
+            return False
+
+        return len(self.dictionaries[i]) < self.categoricalRatio * self.rowCount
+
+
+
+    def column(self, i):
+        """
+        Return column `i` with all rows decoded so far, as a categorical if
+        isCategorical(i), otherwise as an object array where repeated values share
+        the same string object.
+        """
+        if len(self.codes[i]) > 0:
+            codes=np.concatenate(self.codes[i])
+        else:
+            codes=np.array([], dtype=np.int32)
+
+        categories=np.empty(len(self.dictionaries[i]), dtype=object)
+        categories[:]=list(self.dictionaries[i].keys())
+
+        if self.isCategorical(i):
+            # Codes are already compact, pandas picks the smallest int type for them
+            return pd.Categorical.from_codes(codes, categories=categories)
+
+        return categories.take(codes)
+
+
+
+    def dataFrame(self):
+        """
+        Build the subreport DataFrame, releasing decoder memory column by column.
+        """
+        data={}
+
+        for i in range(len(self.columns)):
+            data[self.columns[i]]=self.column(i)
+
+            # Free codes of this column before decoding the next one
+            self.codes[i]=None
+            self.dictionaries[i]=None
+
+        return pd.DataFrame(data, columns=self.columns)
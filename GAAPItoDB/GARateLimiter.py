@@ -0,0 +1,150 @@
+#######################################
+##
+## Token bucket rate limiters to keep one or many GAAPItoDB objects, threads and
+## processes inside the Google Analytics Reporting API quotas.
+##
+## A single GARateLimiter object can be passed to any number of GAAPItoDB objects
+## that share the same Google Cloud project. It is thread-safe and, since its state
+## lives in shared memory, also works across processes forked after its creation.
+##
+
+
+
+import logging
+import multiprocessing
+import threading
+import time
+
+
+
+module_logger = logging.getLogger(__name__)
+
+
+
+class TokenBucket(object):
+    def __init__(self, rate, period=100, burst=None):
+        """
+        A bucket that is refilled with `rate` tokens every `period` seconds, smoothly.
+
+        `burst` is the capacity of the bucket, the number of calls that can be done
+        at once without any wait. Defaults to 1 second worth of tokens, so calls are
+        spread evenly along the period instead of fired in bursts followed by long
+        stalls.
+        """
+        self.rate = rate / period   # tokens per second
+
+        if burst is None:
+            burst = max(1.0, self.rate)
+
+        self.capacity = float(burst)
+
+        # State lives in shared memory so forked processes share the same bucket
+        self.lock = multiprocessing.Lock()
+        self.tokens = multiprocessing.RawValue('d', self.capacity)
+        self.lastRefill = multiprocessing.RawValue('d', time.monotonic())
+
+
+
+    def reserve(self, tokens=1):
+        """
+        Take `tokens` from the bucket, even if it goes into debt, and return how many
+        seconds the caller must wait before actually using them.
+
+        Going into debt makes concurrent callers queue up in arrival order, each one
+        waiting exactly the time needed for the bucket to refill its share.
+        """
+        with self.lock:
+            now = time.monotonic()
+
+            self.tokens.value = min(
+                self.capacity,
+                self.tokens.value + (now - self.lastRefill.value) * self.rate
+            )
+            self.lastRefill.value = now
+
+            self.tokens.value -= tokens
+
+            if self.tokens.value >= 0:
+                return 0.0
+
+            return -self.tokens.value / self.rate
+
+
+
+    def acquire(self, tokens=1):
+        """
+        Block until `tokens` are available. Returns seconds waited.
+        """
+        wait = self.reserve(tokens)
+
+        if wait > 0:
+            time.sleep(wait)
+
+        return wait
+
+
+
+
+
+class GARateLimiter(object):
+    def __init__(self, projectQuota=2000, viewQuota=None, period=100, burst=None, views=None):
+        """
+        Rate limiter for GA Reporting API calls.
+
+        `projectQuota` is the number of calls per `period` seconds allowed for the
+        whole Google Cloud project (2000 per 100 seconds by default on Reporting API v4).
+
+        `viewQuota`, if set, is the number of calls per `period` seconds allowed for
+        each GA View.
+
+        Per-view buckets are created on demand. To share them across processes, list
+        all view IDs in `views` so their buckets get created before forking.
+        """
+        self.logger=logging.getLogger('{a}.{b}'.format(a=__name__, b=type(self).__name__))
+
+        self.period = period
+        self.burst = burst
+        self.viewQuota = viewQuota
+
+        self.project = None
+        if projectQuota:
+            self.project = TokenBucket(projectQuota, period=period, burst=burst)
+
+        self.views = {}
+        self.viewsLock = threading.Lock()
+
+        if views:
+            for v in views:
+                self.viewBucket(v)
+
+
+
+    def viewBucket(self, view):
+        if not self.viewQuota:
+            return None
+
+        view = f'{view}' # force conversion to string
+
+        with self.viewsLock:
+            if view not in self.views:
+                self.views[view] = TokenBucket(self.viewQuota, period=self.period, burst=self.burst)
+
+            return self.views[view]
+
+
+
+    def acquire(self, view=None, tokens=1):
+        """
+        Block until a GA API call for `view` is allowed by all quotas.
+        Returns seconds waited.
+        """
+        wait = 0.0
+
+        for bucket in [self.project, self.viewBucket(view)]:
+            if bucket is not None:
+                wait = max(wait, bucket.reserve(tokens))
+
+        if wait > 0:
+            time.sleep(wait)
+
+        return wait
@@ -0,0 +1,191 @@
+#######################################
+##
+## An on-disk cache of GA Reporting API responses, addressed by a hash of the
+## request body. Pages of historic data never change, so backfills, re-runs after
+## failures and development of new transformations don't need to download them again.
+##
+## Pages are stored compressed, one file per page, and least recently used files
+## are evicted when the cache grows over its size limit.
+##
+
+
+
+import logging
+import threading
+import datetime
+import hashlib
+import json
+import gzip
+import copy
+import os
+import tempfile
+
+
+
+module_logger = logging.getLogger(__name__)
+
+
+
+class GAResponseCache(object):
+    # Bump when the format of cached files changes so old entries are ignored
+    version = 1
+
+    # Request fields that don't change the data returned by GA
+    volatileFields = ['useResourceQuotas']
+
+
+
+    def __init__(self, directory, maxSize=2*1024**3, safetyMargin=datetime.timedelta(days=1)):
+        """
+        Cache GA responses in `directory`, using up to `maxSize` bytes of disk.
+
+        Only data older than GAAPItoDB's `endLag` plus `safetyMargin` is cached,
+        because GA keeps processing hits for a while and recent pages may change.
+
+        The same object can be shared by many GAAPItoDB objects and threads.
+        """
+        self.logger=logging.getLogger('{a}.{b}'.format(a=__name__, b=type(self).__name__))
+
+        self.directory=directory
+        self.maxSize=maxSize
+        self.safetyMargin=safetyMargin
+
+        self.lock=threading.Lock()
+
+        self.hits=0
+        self.misses=0
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        # Current size of cache, to decide when to evict
+        self.size=0
+        for path, size, mtime in self.entries():
+            self.size+=size
+
+
+
+    def key(self, body):
+        """
+        Canonical hash of a request body, ignoring volatile fields.
+        """
+        canonical=copy.deepcopy(body)
+
+        for f in self.volatileFields:
+            canonical.pop(f, None)
+
+        canonical['__cache_version']=self.version
+
+        return hashlib.sha256(
+            json.dumps(canonical, sort_keys=True, separators=(',',':')).encode('UTF-8')
+        ).hexdigest()
+
+
+
+    def path(self, key):
+        # Spread files in 256 subdirectories
+        return os.path.join(self.directory, key[:2], key + '.json.gz')
+
+
+
+    def entries(self):
+        """
+        List of (path, size, mtime) of all cached files.
+        """
+        entries=[]
+
+        for root, dirs, files in os.walk(self.directory):
+            for f in files:
+                if f.endswith('.json.gz'):
+                    path=os.path.join(root, f)
+                    try:
+                        stat=os.stat(path)
+                        entries.append((path, stat.st_size, stat.st_mtime))
+                    except FileNotFoundError:
+                        # Evicted by someone else meanwhile
+                        pass
+
+        return entries
+
+
+
+    def get(self, body):
+        """
+        Return the cached response for request `body` or None.
+        """
+        path=self.path(self.key(body))
+
+        try:
+            with open(path, 'rb') as f:
+                response=json.loads(gzip.decompress(f.read()).decode('UTF-8'))
+
+            # Mark as recently used
+            os.utime(path)
+        except (FileNotFoundError, OSError, ValueError):
+            with self.lock:
+                self.misses+=1
+            return None
+
+        with self.lock:
+            self.hits+=1
+
+        self.logger.debug(f'Cache hit: {path}')
+
+        return response
+
+
+
+    def put(self, body, response):
+        """
+        Store `response` for request `body`.
+        """
+        path=self.path(self.key(body))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        data=gzip.compress(json.dumps(response, separators=(',',':')).encode('UTF-8'))
+
+        # Write to a temporary file and rename, so readers never see partial files
+        fd, temp=tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+
+        with self.lock:
+            # An entry written again replaces its old file, and its size
+            try:
+                previous=os.path.getsize(path)
+            except FileNotFoundError:
+                previous=0
+
+            os.replace(temp, path)
+
+            self.size+=len(data) - previous
+            overflow=self.size > self.maxSize
+
+        if overflow:
+            self.evict()
+
+
+
+    def evict(self):
+        """
+        Delete least recently used files until cache is 90% of `maxSize`.
+        """
+        with self.lock:
+            entries=sorted(self.entries(), key=lambda e: e[2])
+
+            self.size=sum([e[1] for e in entries])
+            target=0.9*self.maxSize
+
+            evicted=0
+            for path, size, mtime in entries:
+                if self.size <= target:
+                    break
+
+                try:
+                    os.remove(path)
+                    evicted+=1
+                except FileNotFoundError:
+                    pass
+
+                self.size-=size
+
+        self.logger.debug(f'Evicted {evicted} pages from cache, size now is {self.size} bytes')
@@ -0,0 +1,212 @@
+#######################################
+##
+## Classify errors of GA API calls and decide if, and for how long, to wait before
+## retrying them. Implements exponential backoff with full jitter, a maximum
+## elapsed time per call and a circuit breaker shared by all threads that use the
+## same GARetryPolicy object.
+##
+
+
+
+from apiclient.errors import HttpError
+import logging
+import threading
+import random
+import socket
+import time
+import json
+
+
+
+module_logger = logging.getLogger(__name__)
+
+
+
+class GARetryExhausted(Exception):
+    """
+    Raised when a GA API call kept failing for longer than the retry policy allows.
+    """
+    pass
+
+
+
+class GARetryPolicy(object):
+    # Error classes
+    RETRYABLE = 'retryable'
+    QUOTA     = 'quota'
+    FATAL     = 'fatal'
+
+    # HTTP statuses that are worth trying again
+    retryableStatuses = [500, 502, 503, 504]
+
+    # Reasons GA puts in 403 and 429 errors when a quota was exhausted
+    quotaReasons = [
+        'rateLimitExceeded',
+        'userRateLimitExceeded',
+        'quotaExceeded',
+        'dailyLimitExceeded',
+        'RESOURCE_EXHAUSTED'
+    ]
+
+
+
+    def __init__(
+                        self,
+                        baseWait=1,
+                        maxWait=64,
+                        maxElapsed=30*60,
+                        quotaWait=100,
+                        breakerThreshold=5,
+                        breakerCooldown=60
+        ):
+        """
+        Retry policy for GA API calls.
+
+        - `baseWait`, `maxWait`: retry N waits a random time between 0 and
+          min(`maxWait`, `baseWait`×2ᴺ) seconds (exponential backoff with full jitter).
+        - `maxElapsed`: give up and raise GARetryExhausted if a single call keeps
+          failing for more than this number of seconds.
+        - `quotaWait`: minimum wait after a quota exhausted error. GA quotas are
+          measured in periods of 100 seconds.
+        - `breakerThreshold`, `breakerCooldown`: after this number of consecutive
+          failures, across all threads, stop calling GA for `breakerCooldown` seconds.
+
+        The same object can be shared by many GAAPItoDB objects. Statistics are kept
+        per processor name in `stats`.
+        """
+        self.logger=logging.getLogger('{a}.{b}'.format(a=__name__, b=type(self).__name__))
+
+        self.baseWait=baseWait
+        self.maxWait=maxWait
+        self.maxElapsed=maxElapsed
+        self.quotaWait=quotaWait
+        self.breakerThreshold=breakerThreshold
+        self.breakerCooldown=breakerCooldown
+
+        self.lock=threading.Lock()
+        self.consecutiveFailures=0
+        self.openUntil=0        # time.monotonic() until when circuit is open
+
+        self.stats={}
+
+
+
+    def classify(self, error):
+        """
+        Return RETRYABLE, QUOTA or FATAL for the `error` exception raised by a GA API call.
+        """
+        if isinstance(error, HttpError):
+            status = int(error.resp.status)
+
+            reasons = []
+            try:
+                content = json.loads(error.content.decode('utf-8'))['error']
+                reasons.extend([e['reason'] for e in content.get('errors',[]) if 'reason' in e])
+                if 'status' in content:
+                    reasons.append(content['status'])
+            except Exception:
+                pass
+
+            if status == 429 or (status == 403 and set(reasons) & set(self.quotaReasons)):
+                return self.QUOTA
+
+            if status in self.retryableStatuses:
+                return self.RETRYABLE
+
+            # 400 bad request, 401, other 403 and 404 won't get better by trying again
+            return self.FATAL
+
+        # Only network errors; other OSErrors, as a missing credentials file, are fatal.
+        # BrokenPipeError and ConnectionResetError are ConnectionErrors.
+        if isinstance(error, (socket.timeout, TimeoutError, ConnectionError)):
+            return self.RETRYABLE
+
+        # Transport errors from httplib2 and friends don't share a common base class
+        if type(error).__module__.split('.')[0] in ['httplib2', 'http', 'ssl', 'urllib3']:
+            return self.RETRYABLE
+
+        return self.FATAL
+
+
+
+    def processorStats(self, processor):
+        # Call with self.lock held
+        if processor not in self.stats:
+            self.stats[processor] = {
+                'calls': 0,
+                'retries': 0,
+                'wait': 0.0,
+                'errors': {
+                    self.RETRYABLE: 0,
+                    self.QUOTA: 0,
+                    self.FATAL: 0
+                }
+            }
+
+        return self.stats[processor]
+
+
+
+    def waitCircuit(self, processor=None):
+        """
+        Block while the circuit breaker is open. Returns seconds waited.
+        """
+        with self.lock:
+            wait = self.openUntil - time.monotonic()
+
+            if wait > 0:
+                self.processorStats(processor)['wait'] += wait
+
+        if wait > 0:
+            self.logger.warning(f'Circuit breaker is open, waiting {wait:.1f}s before calling GA again.')
+            time.sleep(wait)
+            return wait
+
+        return 0
+
+
+
+    def success(self, processor=None):
+        with self.lock:
+            self.consecutiveFailures = 0
+            self.processorStats(processor)['calls'] += 1
+
+
+
+    def failure(self, error, attempt, started, processor=None):
+        """
+        Account a failed call and return how many seconds to wait before the next
+        attempt. Re-raises `error` if it is fatal and raises GARetryExhausted if the
+        call is failing for more than `maxElapsed` seconds.
+
+        `attempt` is the number of failed attempts before this one and `started` is
+        the time.monotonic() of the first attempt.
+        """
+        kind = self.classify(error)
+
+        with self.lock:
+            stats = self.processorStats(processor)
+            stats['errors'][kind] += 1
+
+            if kind == self.FATAL:
+                raise error
+
+            wait = random.uniform(0, min(self.maxWait, self.baseWait * 2**attempt))
+
+            if kind == self.QUOTA:
+                wait = max(wait, self.quotaWait * random.uniform(1, 1.1))
+
+            if time.monotonic() + wait - started > self.maxElapsed:
+                raise GARetryExhausted(f'GA call failing for more than {self.maxElapsed}s. Last error: {error}') from error
+
+            self.consecutiveFailures += 1
+
+            if kind == self.QUOTA or self.consecutiveFailures >= self.breakerThreshold:
+                # Make all other threads sharing this policy wait too
+                cooldown = wait if kind == self.QUOTA else self.breakerCooldown
+                self.openUntil = max(self.openUntil, time.monotonic() + cooldown)
+
+            stats['retries'] += 1
+            stats['wait'] += wait
+
+        return wait
@@ -0,0 +1,241 @@
+#######################################
+##
+## Built-in transformations for dimensions, declared by name in the dimension
+## structure, as 'transform': 'regexreplace', instead of a custom function.
+##
+## Each transformation is compiled once per sync, with its regular expressions
+## ready to use, and works only over distinct values of a column, which are then
+## mapped back to all rows by their codes. Categorical columns stay categorical.
+##
+
+
+
+import logging
+import abc
+import re
+import numpy as np
+import pandas as pd
+
+
+
+module_logger = logging.getLogger(__name__)
+
+
+
+def mapDistinct(column, function):
+    """
+    Apply `function` to the list of distinct non-missing values of `column` and
+    spread its results, one per distinct value, back over all rows. Missing values
+    stay missing.
+
+    Returns a categorical if `column` is categorical, otherwise an object array.
+    """
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        codes = column.cat.codes.to_numpy()
+        uniques = column.cat.categories.to_numpy()
+    else:
+        codes, uniques = pd.factorize(column)
+
+    results = np.empty(len(uniques) + 1, dtype=object)
+    results[:-1] = function(list(uniques))
+
+    # Code -1, of missing values, picks the last one
+    results[-1] = np.nan
+
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        # Results may merge categories or be missing
+        newCodes, newCategories = pd.factorize(results[:-1])
+        return pd.Categorical.from_codes(
+            np.append(newCodes, -1)[codes],
+            categories=newCategories
+        )
+
+    return results[codes]
+
+
+
+class GATransform(abc.ABC):
+    def __init__(self, dimension, processor):
+        """
+        Transformation of the column of `dimension`, configured by its
+        `transformparams`. `processor` is the GAAPItoDB object that uses it.
+        """
+        self.logger=logging.getLogger('{a}.{b}'.format(a=__name__, b=type(self).__name__))
+
+        self.dimension=dimension
+        self.processor=processor
+        self.params=dimension.get('transformparams', {})
+
+        self.compile()
+
+
+
+    def compile(self):
+        """
+        Prepare everything that doesn't depend on data. Override in subclasses.
+        """
+        pass
+
+
+
+    def __call__(self, df, dimension=None):
+        """
+        Transform `df` and return it, with the same signature of custom transform
+        functions.
+        """
+        title = self.dimension['title']
+
+        if 'keeporiginal' in self.dimension:
+            # Keep original data in a new column with suffix "__org"
+            df[title + '__org'] = df[title]
+
+        self.logger.debug(f'Transforming {title}')
+
+        return self.transform(df, title)
+
+
+
+    @abc.abstractmethod
+    def transform(self, df, title):
+        """
+        Transform column `title` of `df` and return `df`, or a new DataFrame if rows
+        change. Every subclass implements it.
+        """
+        pass
+
+
+
+class GARegexReplace(GATransform):
+    """
+    `transformparams` is a dict of regular expressions and their replacements,
+    applied in order. A text replacement substitutes the matched text, as in
+    re.sub(), and any other replacement, as None, substitutes the entire value
+    if the regular expression is found in it, same as pandas' replace(regex=).
+    """
+
+    def compile(self):
+        self.rules = [(re.compile(pattern), replacement) for pattern, replacement in self.params.items()]
+
+
+
+    def replace(self, value):
+        for pattern, replacement in self.rules:
+            if not isinstance(value, str):
+                break
+
+            if isinstance(replacement, str):
+                value = pattern.sub(replacement, value)
+            elif pattern.search(value):
+                value = replacement
+
+        return value
+
+
+
+    def transform(self, df, title):
+        df[title] = mapDistinct(df[title], lambda values: [self.replace(v) for v in values])
+
+        return df
+
+
+
+class GAExplodeAndSplit(GATransform):
+    """
+    Values as "a-1,b-2;c-3" become one row per item found between any of the
+    `transformparams['explodeseparators']` (here “,” and “;”). Each item is then
+    split on `transformparams['splitseparators'][0]` (here “-”) into the
+    `transformspawncolumns` of the dimension, the last one keeping the rest of
+    the text. Separators are plain text.
+
+    Spawn columns are converted in memory to `transformspawncolumnstype` ('int' or
+    'datetime'), the same key the explode and split function of previous examples
+    honored. Converting changes the text row IDs are hashed from, as “0516” becomes
+    516, so SQL types of managed tables are set apart by `transformspawncolumnstypes`.
+    """
+
+    def compile(self):
+        self.explode = None
+        if self.params.get('explodeseparators'):
+            self.explode = re.compile('|'.join([re.escape(s) for s in self.params['explodeseparators']]))
+
+        self.spawn = self.dimension.get('transformspawncolumns', [])
+        self.types = self.dimension.get('transformspawncolumnstype', [None] * len(self.spawn))
+
+        self.split = None
+        if self.params.get('splitseparators'):
+            self.split = self.params['splitseparators'][0]
+
+
+
+    def transform(self, df, title):
+        if self.explode is not None:
+            df = self.explodeRows(df, title)
+
+        if self.split is not None and len(self.spawn) > 0:
+            self.splitColumns(df, title)
+
+        return df
+
+
+
+    def explodeRows(self, df, title):
+        """
+        Repeat each row of `df` once per item of its `title` value, as
+        DataFrame.explode() does after str.split(), but splitting only distinct values.
+        """
+        codes, uniques = pd.factorize(df[title])
+
+        # Items of all distinct values in a flat array, plus the missing value as a single item
+        items = [self.explode.split(v) if isinstance(v, str) else [v] for v in uniques]
+        items.append([np.nan])
+
+        counts = np.array([len(i) for i in items], dtype=np.int64)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+        flat = np.empty(counts.sum(), dtype=object)
+        flat[:] = [v for i in items for v in i]
+
+        # Row and item of each row of the result
+        repeats = counts[codes]
+        rows = np.repeat(np.arange(len(codes)), repeats)
+        nth = np.arange(len(rows)) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+
+        exploded = df.take(rows)
+        exploded[title] = flat[starts[codes][rows] + nth]
+
+        return exploded
+
+
+
+    def splitColumns(self, df, title):
+        """
+        Split `title` into spawn columns of `df`, converting their types.
+        """
+        codes, uniques = pd.factorize(df[title])
+
+        # Pieces of each distinct value, padded with None
+        pieces = np.full((len(uniques), len(self.spawn)), None, dtype=object)
+        for u in range(len(uniques)):
+            if isinstance(uniques[u], str):
+                parts = uniques[u].split(self.split, len(self.spawn) - 1)
+                pieces[u, :len(parts)] = parts
+
+        for i in range(len(self.spawn)):
+            values = pd.Series(pieces[:, i])
+
+            if self.types[i] == 'int':
+                values = pd.to_numeric(values, errors='raise')
+            elif self.types[i] == 'datetime':
+                values = self.processor.timeToUTC(values)
+
+            # Code -1, of missing values, becomes missing without changing the
+            # type of converted values, as “516” must stay 516 and not 516.0
+            df[self.spawn[i]] = values.reindex(codes).array
+
+
+
+# Built-in transformations by name, to be used in `transform` of dimensions
+transforms = {
+    'regexreplace':    GARegexReplace,
+    'explodeandsplit': GAExplodeAndSplit
+}
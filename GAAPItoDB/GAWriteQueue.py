@@ -0,0 +1,243 @@
+#######################################
+##
+## A queue of reports waiting to be written to DB, bounded by the memory their
+## DataFrames use instead of by number of items.
+##
+## When the DB is slower than GA, joined time partitions would pile up in RAM until
+## the machine runs out of memory on long backfills. Producers putting a report in
+## a full queue either wait for the DB writer to catch up or, if a spill directory
+## is set, get their report written to a local Parquet file that the writer reads
+## back when its turn comes. Order of reports is kept either way.
+##
+## Reports can also be Arrow tables, which are spilled as Arrow IPC files.
+##
+
+
+
+import logging
+import threading
+import importlib
+import tempfile
+import queue
+import time
+import os
+import pandas as pd
+
+
+
+module_logger = logging.getLogger(__name__)
+
+
+
+class GAWriteQueue(queue.Queue):
+    def __init__(self, budget=None, spillDirectory=None):
+        """
+        Queue of (name, report) items whose reports use up to `budget` bytes of RAM,
+        as measured by memory_usage(deep=True). None means unbounded.
+
+        A report is always accepted into an empty queue, even if bigger than
+        `budget`, otherwise the writer would wait for it forever.
+
+        If `spillDirectory` is set, reports that don't fit the budget are written
+        to files in that directory instead of blocking producers. Parquet is used
+        if pyarrow or fastparquet is installed, pickle otherwise.
+
+        get() returns (name, report, size) items, or the None end of work signal.
+        The writer must call release(size) when it is done with a report.
+        """
+        super().__init__()
+
+        self.logger=logging.getLogger('{a}.{b}'.format(a=__name__, b=type(self).__name__))
+
+        self.budget=budget
+        self.spillDirectory=spillDirectory
+
+        # Guards accounting of bytes, separately from the queue's own lock
+        self.budgetCondition=threading.Condition()
+
+        self.queuedBytes=0
+        self.peakBytes=0
+        self.blockedTime=0.0
+        self.spilled=0
+
+        self.spillEngine=None
+        if self.spillDirectory is not None:
+            os.makedirs(self.spillDirectory, exist_ok=True)
+            self.spillEngine=GAWriteQueue.parquetEngine()
+
+            if self.spillEngine is None:
+                self.logger.warning('Neither pyarrow nor fastparquet are installed; reports over the write queue budget will be spilled as pickle files')
+
+
+
+    @staticmethod
+    def parquetEngine():
+        """
+        Name of the first Parquet engine available to pandas, or None.
+        """
+        for engine in ['pyarrow', 'fastparquet']:
+            try:
+                importlib.import_module(engine)
+                return engine
+            except ImportError:
+                pass
+
+        return None
+
+
+
+    @staticmethod
+    def reportSize(report):
+        """
+        Bytes of RAM used by `report`, including Python strings of object columns,
+        or buffers of an Arrow table.
+        """
+        if not isinstance(report, pd.DataFrame):
+            return report.nbytes
+
+        return int(report.memory_usage(index=True, deep=True).sum())
+
+
+
+    def overBudget(self, size):
+        # Must be called with budgetCondition held
+        return (
+            self.budget is not None and
+            self.queuedBytes > 0 and
+            self.queuedBytes + size > self.budget
+        )
+
+
+
+    def put(self, item, block=True, timeout=None):
+        """
+        Add (name, report) `item` to the queue, waiting while the queue is over
+        budget or spilling `report` to disk. `block` and `timeout` apply only to
+        the queue's own lock, since the queue has no limit of items.
+        """
+        if item is None:
+            # End of work signal
+            return super().put(item, block, timeout)
+
+        name, report = item
+        size = GAWriteQueue.reportSize(report)
+
+        with self.budgetCondition:
+            spill = self.spillDirectory is not None and self.overBudget(size)
+
+            if not spill:
+                if self.overBudget(size):
+                    self.logger.debug('Write queue has {q:.1f} MiB of {b:.1f} MiB; waiting to queue {name} of {s:.1f} MiB'.format(
+                            q=self.queuedBytes/1024**2,
+                            b=self.budget/1024**2,
+                            name=name,
+                            s=size/1024**2
+                        )
+                    )
+
+                    began=time.monotonic()
+                    self.budgetCondition.wait_for(lambda: not self.overBudget(size))
+                    self.blockedTime += time.monotonic() - began
+
+                self.queuedBytes += size
+                self.peakBytes = max(self.peakBytes, self.queuedBytes)
+
+        if spill:
+            # Spill outside the lock so the writer can release bytes meanwhile
+            report = self.spill(name, report)
+
+        super().put((name, report, size), block, timeout)
+
+
+
+    def get(self, block=True, timeout=None):
+        """
+        Next (name, report, size) item, with spilled reports read back into RAM,
+        or None.
+        """
+        item = super().get(block, timeout)
+
+        if item is None or not isinstance(item[1], str):
+            return item
+
+        name, path, size = item
+
+        with self.budgetCondition:
+            # Back in RAM, held by the writer until released
+            self.queuedBytes += size
+            self.peakBytes = max(self.peakBytes, self.queuedBytes)
+
+        return (name, self.load(path), size)
+
+
+
+    def release(self, size):
+        """
+        Called by the writer when a report of `size` bytes was written and freed.
+        """
+        with self.budgetCondition:
+            self.queuedBytes -= size
+            self.budgetCondition.notify_all()
+
+
+
+    def spill(self, name, report):
+        """
+        Write `report` to a file in spillDirectory and return its path.
+        """
+        began=time.monotonic()
+
+        fd, path=tempfile.mkstemp(dir=self.spillDirectory, prefix='report-')
+        os.close(fd)
+
+        suffix=None
+        if not isinstance(report, pd.DataFrame):
+            # Arrow table, written as is
+            import pyarrow.feather
+            pyarrow.feather.write_feather(report, path, compression='uncompressed')
+            suffix='.arrow'
+        elif self.spillEngine is not None:
+            try:
+                report.to_parquet(path, engine=self.spillEngine)
+                suffix='.parquet'
+            except (ValueError, TypeError) as e:
+                # Columns of mixed object types can't be represented in Parquet
+                self.logger.debug(f'Can’t spill {name} as Parquet ({e}); using pickle')
+
+        if suffix is None:
+            report.to_pickle(path, compression=None)
+            suffix='.pickle'
+
+        os.replace(path, path + suffix)
+        path += suffix
+
+        self.spilled += 1
+
+        self.logger.debug('Spilled {name} with {rows} rows to {path} in {t:.1f}s'.format(
+                name=name,
+                rows=report.shape[0],
+                path=path,
+                t=time.monotonic() - began
+            )
+        )
+
+        return path
+
+
+
+    def load(self, path):
+        """
+        Read back a report spilled to `path` and remove its file.
+        """
+        if path.endswith('.arrow'):
+            import pyarrow.feather
+            # Not memory mapped, since the file is removed right away
+            report=pyarrow.feather.read_table(path, memory_map=False)
+        elif path.endswith('.parquet'):
+            report=pd.read_parquet(path, engine=self.spillEngine)
+        else:
+            report=pd.read_pickle(path, compression=None)
+
+        os.remove(path)
+
+        return report
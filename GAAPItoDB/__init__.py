@@ -17,21 +17,75 @@ import datetime
 import dateutil.parser
 import copy
 import pandas as pd
+import numpy as np
 import io
 import hashlib
 import sqlalchemy
 import time
 import json
-import queue
 import threading
-import gc # Garbage Collector
 import socket
-
-__version__ = '0.6.0'
+import sys
+import os
+import collections
+import concurrent.futures
+
+try:
+    # Optional, for arrow=True
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+from .GARateLimiter import GARateLimiter, TokenBucket
+from .GARetryPolicy import GARetryPolicy, GARetryExhausted
+from .GAResponseCache import GAResponseCache
+from .GAPageDecoder import GAPageDecoder
+from .GAFakeAPI import GAFakeAPI, GASyntheticData, GACassette
+from .GATransforms import GATransform, GARegexReplace, GAExplodeAndSplit
+from .GAWriteQueue import GAWriteQueue
+from .GACheckpoint import GACheckpoint
+from .GAMetrics import GAMetrics
+from .GABulkLoaders import GABulkLoader, GASQLiteLoader, GAPostgreSQLLoader, GAMySQLLoader
+from . import GABulkLoaders
+from . import GATransforms
+
+__version__ = '0.7.0'
 
 module_logger = logging.getLogger(__name__)
 
+
+
+class GASampledData(Exception):
+    """
+    Raised by fetcher workers when GA returns sampled data for a time partition that
+    can still be split in smaller ones.
+    """
+    pass
+
+
+
 class GAAPItoDB(object):
+    # Limits for adaptive time partitions
+    minPartitionSize = pd.Timedelta(hours=1)
+    maxPartitionSize = pd.Timedelta(days=31)
+    
+    # Formats of GA time dimensions, to parse them without guessing
+    timeFormats = {
+        'ga:dateHourMinute': '%Y%m%d%H%M',
+        'ga:dateHour':       '%Y%m%d%H',
+        'ga:date':           '%Y%m%d',
+        'ga:yearMonth':      '%Y%m',
+        'ga:year':           '%Y'
+    }
+    
+    # SQL types of columns of managed tables, by dimension `type`
+    columnTypes = {
+        'int':      sqlalchemy.BigInteger,
+        'datetime': sqlalchemy.DateTime,
+        None:       sqlalchemy.Text
+    }
+
+
     def __init__(
                         self,
                         gaView,
@@ -53,7 +107,34 @@ class GAAPItoDB(object):
                         targetTable=None,
                         update=True,
                         processorName=None,
-                        restart=False
+                        restart=False,
+                        fetchWorkers=1,  # number of parallel threads fetching subreports from GA
+                        rateLimiter=None,  # a GARateLimiter shared with other objects using same GA project
+                        subreportsPerCall=5,  # number of subreports packed in a single batchGet call, up to 5
+                        dimensionStats=None,  # dict as returned by measureDimensionStats() or 'measure'
+                        retryPolicy=None,  # a GARetryPolicy, possibly shared with other objects
+                        adaptivePartitions=False,  # split sampled time partitions and merge small ones
+                        mergeRowTarget=None,  # grow time partitions while they have less rows than this
+                        cache=None,  # a GAResponseCache to keep historic GA pages on disk
+                        pageWorkers=1,  # threads fetching pages of same subreports in parallel
+                        gaServiceFactory=None,  # callable(serviceName, version, credentials) returning GA service objects
+                        rowIDHash='shake_256',  # or 'siphash' for vectorized 64 bit row IDs
+                        manageTable=True,  # create target table with primary key, types and indexes
+                        dstAmbiguous=False,  # tz_localize() policy for repeated local times
+                        dstNonexistent='shift_forward',  # tz_localize() policy for skipped local times
+                        categoricalRatio=None,  # make categorical columns with less distinct values than this fraction of rows
+                        dbWriteQueueBudget=1024**3,  # bytes of RAM used by reports waiting to be written to DB
+                        dbWriteQueueSpill=None,  # directory to spill reports over dbWriteQueueBudget as Parquet files
+                        runMetrics=None,  # a GAMetrics collecting timings, possibly shared with other objects
+                        arrow=False,  # queue and write final reports as Arrow tables
+                        bulkLoader=None,  # loader name or GABulkLoader subclass; None picks one by dialect
+                        dbWriters=1,  # threads writing chunks to DB in parallel, committed in order
+                        upsert=False,  # merge chunks into target table on __row_id through a staging table
+                        checkpointTable='gaapitodb_checkpoints',  # table of committed time partitions and page tokens, or None
+                        checkpointSpool=None,  # directory to keep GA pages of time partitions not yet committed
+                        dbWriteChunkRows=None,  # rows written to DB per transaction
+                        dbWriteChunkBytes=None,  # bytes of RAM of report rows written to DB per transaction
+                        correctionWindow=None  # timedelta of synced data to fetch again and correct
         ):
         """
         Get report data between `start` and `end` times.
@@ -62,6 +143,50 @@ class GAAPItoDB(object):
         
         If `restart` is True, ignore `incremental` and use `start` date.
         
+        Up to `fetchWorkers` subreports and time partitions are fetched from GA in parallel, all sharing the same `apiQuota`.
+        
+        Up to `subreportsPerCall` (max 5) subreports of the same time partition are requested in a single API call.
+        
+        Non-key dimensions with `'packable': True`, or found to have exactly one value per row in `dimensionStats`, are packed together in subreports up to the 9 dimensions GA limit. Pass `dimensionStats='measure'` to measure them on the first time partition.
+        
+        If `adaptivePartitions` is True, `dateRangePartitionSize` is just the initial size of time partitions. A partition that comes back sampled is split in halves, down to 1 hour, and refetched. While partitions have less than `mergeRowTarget` rows, next ones are made twice as big.
+        
+        If `pageWorkers` is bigger than 1, after the first page of a subreport tells its total number of rows, the remaining pages are fetched in parallel by up to `pageWorkers` threads per fetcher, falling back to sequential paging if they don't look consistent.
+        
+        Rows get a `__row_id` primary key hashed from their key columns. With `rowIDHash='shake_256'` it is the 16 hex chars ID GAAPItoDB always made, so tables written by previous versions stay joinable. With `rowIDHash='siphash'` it is a 64 bits integer computed in a single vectorized pass, a lot faster.
+        
+        If `manageTable` is True, GAAPItoDB creates `targetTable` itself, with `__row_id` as primary key (BINARY(8) for 'shake_256' IDs, BIGINT for 'siphash'), column types from dimensions' `type` and an index on the `synccursor` column. Rows repeated by transformations are written only once. Tables created by previous versions keep working as they are; convert them with migrateTable().
+        
+        Dimensions of `'type': 'datetime'` are in GA View's time zone and converted to UTC. Local times that happen twice or never when daylight saving time starts or ends are handled as `dstAmbiguous` and `dstNonexistent` say, as in pandas' tz_localize(). The defaults take repeated times as standard time and move skipped times forward.
+        
+        Dimensions with `'categorical': True` are kept as pandas categoricals, as compact integer codes plus a dictionary of distinct values, from page decoding until written to DB. If `categoricalRatio` is set, so are non-key dimensions without `type` or `transform` that have less distinct values than this fraction of rows in a subreport.
+        
+        Reports waiting to be written to DB can use up to `dbWriteQueueBudget` bytes of RAM, as measured by pandas' memory_usage(deep=True). When the budget is reached, fetching and joining of time partitions waits for the DB to catch up, unless `dbWriteQueueSpill` names a directory where reports are written as Parquet files until the DB writer gets to them. Pass None for an unbounded queue.
+        
+        Timings and throughput of each stage (GA API calls, quota waits, rows fetched, sampling, join, transformations, hashing and DB writes) are collected in `runMetrics`, a `GAMetrics` object that may be shared with other objects and exports them in Prometheus or OpenMetrics format and as a JSON run summary.
+        
+        If `arrow` is True, final reports are converted to Arrow tables (requires pyarrow) before being queued for the DB writer, which writes them in zero-copy slices. Reports waiting in the queue use a lot less memory and are spilled to disk as Arrow IPC files. Custom transformations still get pandas DataFrames.
+        
+        Data is written to DB by a bulk loader chosen from the dialect of `dbURL`: COPY FROM STDIN for PostgreSQL, LOAD DATA LOCAL INFILE for MySQL and MariaDB (pass `?local_infile=1` in `dbURL`), a single executemany() for SQLite and multi-row INSERTs for others. Pass a loader name or a `GABulkLoader` subclass as `bulkLoader` to choose another, as 'to_sql' for multi-row INSERTs.
+        
+        Reports of time partitions are written to DB in chunks of `dbWriteChunkRows` rows, or of about `dbWriteChunkBytes` bytes of RAM, so transactions have a predictable size no matter how busy a day was. If neither is set, each report is cut in `dbWritePartitions` chunks of the same number of rows. Chunks are contiguous slices of rows sorted by `synccursor`, cut at the first row of a time.
+        
+        Chunks of reports are written to DB by `dbWriters` threads in parallel, each in its own transaction, but committed in order of their `synccursor` values, so a crash never leaves later data in the table without earlier data. SQLite always has a single writer.
+        
+        If `upsert` is True, chunks are bulk loaded into a temporary staging table and merged into a managed `targetTable` on `__row_id`, replacing rows that are already there, with INSERT … ON CONFLICT for PostgreSQL and SQLite or INSERT … ON DUPLICATE KEY UPDATE for MySQL and MariaDB. Syncing a period again, after a crash or with `incremental=False`, then costs a merge instead of deleting rows or a `restart`.
+        
+        Each time partition is checkpointed in `checkpointTable`, shared by all processors, with its status, number of rows written and last page token read for each subreport. It is marked as committed right after its data, in order, so incremental syncs resume from the end of the last committed partition with a single indexed lookup, instead of scanning `targetTable` for the newest `synccursor`, and rows of partitions left unfinished by a crashed run are deleted before they are synced again. If `checkpointSpool` names a directory, GA pages of partitions not yet committed are kept there, so a crashed run resumes in the middle of a partition without fetching again pages it already had. Pass None as `checkpointTable` to work without checkpoints.
+        
+        GA keeps processing hits for a few hours, so `endLag` must be large to get complete data. Instead, set `correctionWindow` to a timedelta and each incremental sync fetches again that much data it had already synced, compares rows with what is stored and merges into `targetTable` only new and changed ones, with a small `endLag`. Requires a managed table and a database supported by `upsert`.
+        
+        Pass a `GAFakeAPI` or `GACassette` object as `gaServiceFactory` to talk to a local stand-in of GA APIs instead of Google, for tests and benchmarks.
+        
+        Pass a `GAResponseCache` object as `cache` to keep pages of historic data on local disk and avoid downloading them again in backfills and re-runs.
+        
+        Failed GA API calls are retried according to `retryPolicy`, a `GARetryPolicy` object that may be shared with other objects.
+        
+        Pass the same `GARateLimiter` object as `rateLimiter` to all objects that use the same GA project, so they all share its quota. If not passed, a private one is created from `apiQuota`.
+        
         Sync data to database from GA up to `end` date minus `endLag`. If not set, `endLag` will be 30 minutes. The `endLag` is important so you won't get too hot and unprocessed data from GA.
         """
         # Setup logging
@@ -82,15 +207,82 @@ class GAAPItoDB(object):
         self.targetTable=targetTable
         self.dateRangePartitionSize=dateRangePartitionSize
         self.dbWritePartitions=dbWritePartitions
-        self.quotaControl={}
+        self.dbWriteChunkRows=dbWriteChunkRows
+        self.dbWriteChunkBytes=dbWriteChunkBytes
+        self.correctionWindow=correctionWindow
+        self.correctionUntil=None   # Set by effectiveStartDate() if data in correctionWindow will be fetched again
+        self.correcting=False       # Set by DB writer while it writes a time partition of correctionWindow
+        self.apiCallCount=0
+        self.apiCallCountLock=threading.Lock()  # fetcher workers share the counter
         self.restart=restart
         self.update=update
         self.apiQuota=apiQuota
+        self.fetchWorkers=max(1,fetchWorkers)
+        self.subreportsPerCall=min(5,max(1,subreportsPerCall))  # GA API accepts up to 5 reportRequests
+        self.dimensionStats=dimensionStats
+
+        self.adaptivePartitions=adaptivePartitions
+        self.partitionSize=pd.Timedelta(days=dateRangePartitionSize if dateRangePartitionSize else 1)
+        if mergeRowTarget is None:
+            # Grow time partitions while subreports fit in half a page
+            mergeRowTarget=50000
+        self.mergeRowTarget=mergeRowTarget
+
+        self.pageWorkers=max(1,pageWorkers)
+
+        # An optional GAResponseCache, possibly shared with other objects
+        self.cache=cache
+
+        if retryPolicy is not None:
+            # Shared with other objects to open the circuit breaker for all of them
+            self.retryPolicy=retryPolicy
+        else:
+            self.retryPolicy=GARetryPolicy()
+
+        if rateLimiter is not None:
+            # Shared with other objects, threads or processes using the same GA project
+            self.rateLimiter=rateLimiter
+        elif apiQuota > 0:
+            self.rateLimiter=GARateLimiter(projectQuota=apiQuota)
+        else:
+            self.rateLimiter=None
 
         self.incremental=incremental
         self.endLag=endLag
         
         self.ga=None
+        self.gaThreadLocal=threading.local()
+        self.gaServiceFactory=gaServiceFactory
+        self.rowIDHash=rowIDHash
+        self.manageTable=manageTable
+        self.dstAmbiguous=dstAmbiguous
+        self.dstNonexistent=dstNonexistent
+        self.categoricalRatio=categoricalRatio
+        self.managedTable=False     # Set by prepareTable() if targetTable has our layout
+        
+        if arrow and pyarrow is None:
+            raise ImportError('arrow=True requires pyarrow')
+        self.arrow=arrow
+        self.bulkLoader=bulkLoader
+        self.dbWriters=max(1,dbWriters)
+        self.upsert=upsert
+        self.checkpointTable=checkpointTable
+        self.checkpointSpool=checkpointSpool
+        self.checkpoint=None        # Set by sync() if checkpointTable is set
+        self.inflight=[]            # Partitions not committed by last run, set by effectiveStartDate()
+        self.queuedPartitions={}    # Time partitions by name, from queuing to commit
+        self.chunkWriter=None
+        self.chunkFutures=[]
+        self.chunkSequence=0
+        self.commitTurn=0
+        self.commitCondition=threading.Condition()
+        self.partitionRows=0
+        
+        if runMetrics is not None:
+            # Shared with other objects to export metrics of all of them together
+            self.runMetrics=runMetrics
+        else:
+            self.runMetrics=GAMetrics()
         
         self.ga=self.getGA()  # Use credentials to get a Google Aalytics object
         
@@ -156,8 +348,9 @@ class GAAPItoDB(object):
         }
 
         
-        # Create a queue that contains DataFrames ready to be written to DB
-        self.dbWriteQueue = queue.Queue()
+        # Create a queue that contains DataFrames ready to be written to DB,
+        # blocking or spilling to disk when they use more than dbWriteQueueBudget bytes
+        self.dbWriteQueue = GAWriteQueue(budget=dbWriteQueueBudget, spillDirectory=dbWriteQueueSpill)
 
         
             
@@ -166,22 +359,50 @@ class GAAPItoDB(object):
         # Create an object to call Google Analytics
         
         if self.ga is None:
-            credentials = ServiceAccountCredentials.from_json_keyfile_name(
-                self.credentialsFile,
-                ['https://www.googleapis.com/auth/analytics.readonly']
-            )
+            self.gaCredentials = None
+            
+            if self.credentialsFile is not None:
+                self.gaCredentials = ServiceAccountCredentials.from_json_keyfile_name(
+                    self.credentialsFile,
+                    ['https://www.googleapis.com/auth/analytics.readonly']
+                )
 
             # Build the service object.
-            self.ga = build('analyticsreporting', 'v4', credentials=credentials)
+            self.ga = self.buildGAService('analyticsreporting', 'v4')
             
             
             # Management API is here: https://stackoverflow.com/questions/43050514/google-analytics-api-service-object-no-management-attribute
-            self.gaManagement = build('analytics', 'v3', credentials=credentials)
+            self.gaManagement = self.buildGAService('analytics', 'v3')
         
         return self.ga
 
 
 
+    def buildGAService(self, serviceName, version):
+        # Use googleapiclient unless a factory was passed in `gaServiceFactory`, as
+        # GAFakeAPI to work offline or GACassette to record and replay GA responses.
+        
+        if self.gaServiceFactory is not None:
+            return self.gaServiceFactory(serviceName, version, self.gaCredentials)
+        
+        return build(serviceName, version, credentials=self.gaCredentials)
+
+
+
+    def getThreadGA(self):
+        # The HTTP transport under GA service objects is not thread-safe, so each
+        # fetcher worker gets its own service object built from same credentials.
+        
+        if threading.current_thread() is threading.main_thread():
+            return self.getGA()
+        
+        if getattr(self.gaThreadLocal, 'ga', None) is None:
+            self.gaThreadLocal.ga = self.buildGAService('analyticsreporting', 'v4')
+        
+        return self.gaThreadLocal.ga
+
+
+
     def getGAViewObject(self):
             self.gaViewObject = self.gaManagement.management().profiles().get(
               accountId=self.gaAccount,
@@ -287,11 +508,20 @@ class GAAPItoDB(object):
             return None
 
 
-    def filterTimeStartToEnd(self):
+    def filterTimeStartToEnd(self, start=None, end=None):
         """
         Return of this method should go into query['dimensionFilterClauses']
+        
+        Filters the `synccursor` dimension to be after `start` and before `end`,
+        both exclusive, with minute precision. Defaults to the entire period of sync.
         """
         
+        if start is None:
+            start = self.effectiveStart
+        
+        if end is None:
+            end = self.end
+        
         dimensionItemsList=[]
         
         for i in range(len(self.dimensions)):
@@ -302,12 +532,12 @@ class GAAPItoDB(object):
                         {
                             "dimensionName": self.dimensions[i]['name'],
                             "operator": "NUMERIC_GREATER_THAN",
-                            "expressions": [self.effectiveStart.strftime('%Y%m%d%H%M')]
+                            "expressions": [start.strftime('%Y%m%d%H%M')]
                         },
                         {
                             "dimensionName": self.dimensions[i]['name'],
                             "operator": "NUMERIC_LESS_THAN",
-                            "expressions": [self.end.strftime('%Y%m%d%H%M')]
+                            "expressions": [end.strftime('%Y%m%d%H%M')]
                         }
                     ]
                 })
@@ -331,14 +561,23 @@ class GAAPItoDB(object):
 
         Later those subreports will be joined togheter using the key columns to form the final report.
         
+        GA only returns rows where all requested dimensions have a value, so by default
+        each subreport gets only 1 non-key dimension, to avoid loosing data of a dimension
+        because another one in same subreport is not set. Dimensions that are known to
+        always have a value for each combination of keys (see isPackable()) are packed
+        together in the same subreports, up to the 9 dimensions limit.
+        
         This method returns a list of partitions. Each partition contains the index of the dimension to include.
         Something like this:
         [
             [0,1,   2,3,4,5,6,7,8],
-            [0,1,   9,10,11],
+            [0,1,   9],
+            [0,1,   10],
+            [0,1,   11],
         ]
         
-        So you initialy you wanted 12 dimensions with dimension 0 and 1 having key=True. Thats why they apprear in both partitions.
+        So you initialy you wanted 12 dimensions with dimension 0 and 1 having key=True. Thats why they apprear in all partitions.
+        Dimensions 2 to 8 are packable and 9 to 11 aren't.
         """
         GAMaxReportSize = 9 # Google Analytics API limit for number of dimensions
         subreportAdditionalDimensions = 1
@@ -352,8 +591,7 @@ class GAAPItoDB(object):
                 
         maxSize=min(GAMaxReportSize,subreportAdditionalDimensions+len(subreportKeys))
 
-        subreport=0
-        subreports.append(copy.deepcopy(subreportKeys))
+        packed=[]
         
         for i in range(len(self.dimensions)):
             # Iterate over each dimension and decide in which subreport to put it
@@ -362,14 +600,153 @@ class GAAPItoDB(object):
                 # Skip key dimension because we already have them on subreportKeys
                 continue
             
-            if len(subreports[subreport]) >= maxSize:
-                # If current subreport is too big, spawn a new one
-                subreport += 1
-                subreports.append(copy.deepcopy(subreportKeys))
+            if self.isPackable(self.dimensions[i]):
+                # Fill up subreports of packable dimensions to the API limit
+                if len(packed)==0 or len(packed[-1]) >= GAMaxReportSize:
+                    packed.append(copy.deepcopy(subreportKeys))
+                
+                packed[-1].append(i)
+            else:
+                if len(subreports)==0 or len(subreports[-1]) >= maxSize:
+                    # If current subreport is too big, spawn a new one
+                    subreports.append(copy.deepcopy(subreportKeys))
 
-            subreports[subreport].append(i)
+                subreports[-1].append(i)
+        
+        subreports = packed + subreports
+        
+        if len(subreports)==0:
+            # Only key dimensions
+            subreports.append(copy.deepcopy(subreportKeys))
             
         return subreports
+
+
+
+    def categoricalColumns(self, candidates=False):
+        """
+        Titles of dimensions declared with `'categorical': True`, or, if `candidates`
+        is True, of dimensions that may become categorical by `categoricalRatio`:
+        non-key ones without `type` or `transform`, which could expect plain text.
+        """
+        if candidates:
+            return [
+                d['title']
+                for d in self.dimensions
+                if not d.get('key') and 'type' not in d and 'transform' not in d
+            ]
+        
+        return [
+            d['title']
+            for d in self.dimensions
+            if d.get('categorical') and 'type' not in d
+        ]
+
+
+
+
+    def isPackable(self, dimension):
+        """
+        Decide if a non-key dimension can share a subreport with other non-key dimensions.
+        
+        An explicit `'packable': True|False` in the dimension structure has precedence.
+        Otherwise use cardinality statistics passed in `dimensionStats` or measured by
+        measureDimensionStats(): the dimension is packable if its subreport had exactly
+        as many rows as the subreport with only key dimensions, meaning it has exactly one
+        value for each row.
+        """
+        if 'packable' in dimension:
+            return dimension['packable']
+        
+        if isinstance(self.dimensionStats, dict) and dimension['title'] in self.dimensionStats:
+            stats = self.dimensionStats[dimension['title']]
+            return (stats['keyRows'] > 0 and stats['rows'] == stats['keyRows'])
+        
+        return False
+
+
+
+    def measureDimensionStats(self, p=None):
+        """
+        Fetch each non-key dimension alone with key dimensions for time partition `p`
+        (the first one if not passed) and compare its number of rows with the number
+        of rows of key dimensions alone.
+        
+        Returns and sets `self.dimensionStats` as a dict that can be saved and passed
+        in the `dimensionStats` class parameter in future runs to avoid measuring again:
+        
+        {
+            'product': {'rows': 1532, 'keyRows': 1532, 'distinct': 12},
+            'referer': {'rows': 1290, 'keyRows': 1532, 'distinct': 201},
+        }
+        """
+        if p is None:
+            p = self.getDateRangePartitions()[0]
+        
+        keys = self.getReportKeys()
+        keyIndexes = [i for i in range(len(self.dimensions)) if 'key' in self.dimensions[i] and self.dimensions[i]['key']]
+        
+        subreports = [keyIndexes]
+        for i in range(len(self.dimensions)):
+            if i not in keyIndexes:
+                subreports.append(keyIndexes + [i])
+        
+        self.logger.info(f'Measuring cardinality of {len(subreports)-1} dimensions on {self.timePartitionName(p)}...')
+        
+        dfs = []
+        for b in self.subreportBatches(subreports):
+            dfs.extend(self.getSubreports(p, subreports, b, len(subreports)))
+        
+        keyRows = dfs[0].shape[0]
+        
+        self.dimensionStats = {}
+        for i in range(1, len(subreports)):
+            title = self.dimensions[subreports[i][-1]]['title']
+            self.dimensionStats[title] = {
+                'rows': dfs[i].shape[0],
+                'keyRows': keyRows,
+                'distinct': int(dfs[i][title].nunique())
+            }
+        
+        self.logger.debug(f'Dimension statistics: {self.dimensionStats}')
+        
+        return self.dimensionStats
+
+
+
+    def planReport(self):
+        """
+        Log and return the plan of subreports and the minimum number of API calls
+        (one per batch of subreports per time partition, plus one per extra page)
+        required to sync the whole period.
+        """
+        subreports = self.subreportDimensions()
+        batches = self.subreportBatches(subreports)
+        
+        if self.adaptivePartitions:
+            # Just an estimate, partitions will be resized along the way
+            timepartitions = list(self.adaptiveDateRangePartitions())
+        else:
+            timepartitions = self.getDateRangePartitions()
+        
+        plan = {
+            'subreports': len(subreports),
+            'dimensionsPerSubreport': [len(s) for s in subreports],
+            'callsPerTimePartition': len(batches),
+            'timePartitions': len(timepartitions),
+            'calls': len(batches) * len(timepartitions)
+        }
+        
+        self.logger.info('Plan: {subreports} subreports with {dims} dimensions each, in {cpp} API calls per time partition; {calls} API calls for {parts} time partitions, plus extra pages.'.format(
+                subreports=plan['subreports'],
+                dims=plan['dimensionsPerSubreport'],
+                cpp=plan['callsPerTimePartition'],
+                calls=plan['calls'],
+                parts=plan['timePartitions']
+            )
+        )
+        
+        return plan
     
 
     
@@ -377,7 +754,8 @@ class GAAPItoDB(object):
     
     
     def getDateRangePartitions(self):
-        periods=list(pd.period_range(start=self.effectiveStart, end=self.end, freq=f'{self.dateRangePartitionSize}d'))
+        # Data is fetched from the minute after effectiveStart, as in filterTimeStartToEnd()
+        periods=list(pd.period_range(start=self.effectiveStart + datetime.timedelta(minutes=1), end=self.end, freq=f'{self.dateRangePartitionSize}d'))
         
         ranges=[]
         
@@ -396,43 +774,76 @@ class GAAPItoDB(object):
     
     
     
-    def callGA(self, body):
-        # Some quota contol
+    def callGA(self, body, cacheable=False, spool=None):
+        # Historic data never changes, so serve it from the cache if available
+        if cacheable:
+            report = self.cache.get(body)
+            if report is not None:
+                self.runMetrics.inc('api_cache_hits', processor=self.processor)
+                return report
         
-        if 'lastStart' not in self.quotaControl:
-            self.quotaControl['lastStart'] = datetime.datetime.now()
-            self.quotaControl['count'] = 0
+        # Pages read by a run that crashed before committing their time partition
+        if spool is not None:
+            report = spool.get(body)
+            if report is not None:
+                self.runMetrics.inc('api_cache_hits', processor=self.processor)
+                return report
         
-        if (self.apiQuota > 0) and (self.quotaControl['count'] > self.apiQuota):
-            # What time it will be 100 seconds after lastStart?
-            wait = (self.quotaControl['lastStart'] + datetime.timedelta(seconds=100)) - datetime.datetime.now()
-            
-            if wait.total_seconds()>0:
-                # Wait until then
-                self.logger.debug("Wait {}s, until {}, to avoid GA quota limits.".format(
-                        wait.total_seconds(),
-                        self.quotaControl['lastStart']+wait
-                    )
-                )
-                time.sleep(wait.total_seconds())
-            
-            self.quotaControl['lastStart'] = datetime.datetime.now()
-            self.quotaControl['count'] = 0
-            
+        # Some debug messages, rendered only if they will be logged
         
-        # Some debug messages
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("Query for GA: {}".format(json.dumps(body)))
+        
+        # Finaly call Google Analytics API. Errors are classified by the retry policy:
+        # timeouts, broken pipes and 5xx are retried with exponential backoff, quota
+        # errors wait for the next quota period and all others are raised.
+        
+        started = time.monotonic()
+        attempt = 0
         
-        self.logger.debug("Query for GA: {}".format(json.dumps(body)))
-                
-        # Finaly call Google Analytics API; retry ad infinitum if we get timeout exceptions.
         while True:
+            # Don't hammer GA if other threads sharing the retry policy are failing
+            self.retryPolicy.waitCircuit(self.processor)
+            
+            # Some quota contol. The rate limiter spreads calls evenly along the quota
+            # period and may be shared with other threads, objects and processes.
+            if self.rateLimiter is not None:
+                wait = self.rateLimiter.acquire(self.gaView)
+                self.runMetrics.observe('quota_wait_seconds', wait, processor=self.processor)
+                
+                if wait > 0:
+                    self.logger.debug("Waited {:.3f}s to avoid GA quota limits.".format(wait))
+            
             try:
-                self.logger.debug("GA call count since {}: {}".format(self.quotaControl['lastStart'], self.quotaControl['count']))
-                self.quotaControl['count'] += 1
-                report = self.ga.reports().batchGet(body=body, quotaUser=self.processor).execute()
+                with self.apiCallCountLock:
+                    self.apiCallCount += 1
+                    self.logger.debug("GA call count: {}".format(self.apiCallCount))
+                with self.runMetrics.timer('api_call_seconds', processor=self.processor):
+                    report = self.getThreadGA().reports().batchGet(body=body, quotaUser=self.processor).execute()
+                self.retryPolicy.success(self.processor)
                 break
             except Exception as e:
-                self.logger.warning("GA timed out, broken pipe or other error; retrying…")
+                self.runMetrics.inc('api_errors', kind=self.retryPolicy.classify(e), processor=self.processor)
+                
+                # Raises fatal errors and errors for too long
+                wait = self.retryPolicy.failure(e, attempt, started, self.processor)
+                
+                self.logger.warning("GA error ({kind}) on attempt {attempt}: {e}; retrying in {wait:.1f}s…".format(
+                        kind=self.retryPolicy.classify(e),
+                        attempt=attempt+1,
+                        e=e,
+                        wait=wait
+                    )
+                )
+                
+                time.sleep(wait)
+                attempt += 1
+
+        if cacheable:
+            self.cache.put(body, report)
+        
+        if spool is not None:
+            spool.put(body, report)
 
         return report
 
@@ -448,334 +859,1333 @@ class GAAPItoDB(object):
         1. Prepare a GA object to talk to
         2. Prepare list of subreports (that will be joined later)
         3. Prepare list of time partitions to cover all period requested by user
-        4. Iterate over list of subreports to get data
-            4.1. For each subreport, iterate over list of time partitions
-                4.1.1 For each subreport and time partiton, iterate over list of returned data pages
-        5. Join subreports on key columns
+        4. Dispatch each (time partition, batch of up to 5 subreports) pair to a pool of `fetchWorkers` threads
+            4.1. Each worker iterates over list of returned data pages of its subreports, fetching one page of each subreport per API call
+        5. Collect time partitions in time order and join its subreports on key columns
         6. Perform simple data conversion for optimization (mostly string to datetime or to number)
         7. Perform more advanced data conversion with custom functions
         8. Calculate unique ID for each row
         
+        Time partitions are handed to the DB writer strictly in time order, no matter
+        in which order their subreports were fetched, so the `synccursor` column in
+        the database never gets ahead of data not yet written.
         """
         
         subreports = self.subreportDimensions()
-        timepartitions = self.getDateRangePartitions()
-        keys = self.getReportKeys()
+        batches = self.subreportBatches(subreports)
+        
+        self.compileTransforms()
+        
+        if self.adaptivePartitions:
+            # Time partitions are generated on the fly, sized by what was learned from previous ones
+            timepartitions = self.adaptiveDateRangePartitions()
+        else:
+            timepartitions = self.getDateRangePartitions()
+            self.logger.debug(f'Time partitions to cover entire period requested: {timepartitions}')
 
         self.logger.debug(f'Subreport indexes: {subreports}')
-        self.logger.debug(f'Time partitions to cover entire period requested: {timepartitions}')
+        self.logger.debug(f'Subreports fetched together in same API calls: {batches}')
+        self.logger.debug(f'Fetching subreports with {self.fetchWorkers} parallel workers')
 
         self.subreports = []
 
-        for p in timepartitions:
-            try:
-                # Delete the previous query (if defined)
-                del query
-            except NameError:
-                pass            
-            
-            query=copy.deepcopy(self.query)
-
-            query['dateRanges'] = [{
-                'startDate': p[0].date().isoformat(),
-                'endDate':   p[1].date().isoformat()
-            }]
-            
-            # For debugging:
-            timePartitionName = '[{}]➔[{}]'.format(p[0].date().isoformat(),p[1].date().isoformat())
-            
-            
-            # Fine tune time range as passed to object's `start` and `end` parameters
-            timeLimits = self.filterTimeStartToEnd()
-            if timeLimits:
-                query['dimensionFilterClauses'] = timeLimits
-
+        with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.fetchWorkers,
+                    thread_name_prefix=f'{self.processor}-fetcher'
+                ) as self.fetcher, concurrent.futures.ThreadPoolExecutor(
+                    # Separate pool for pages, so fetchers waiting for their pages never starve it
+                    max_workers=self.pageWorkers * self.fetchWorkers,
+                    thread_name_prefix=f'{self.processor}-pages'
+                ) as self.pageFetcher:
             
+            # Time partitions already dispatched to fetchers but not yet joined
+            inflight = collections.deque()
             
-            # Set order as passed by Dimensions structure
-            order = self.dimensionItemsToOrderBys()
-            if order:
-                query['orderBys'] = order
+            for p in timepartitions:
+                inflight.append((p, self.submitTimePartition(p, subreports, batches)))
+                
+                # Don't let fetchers get too far ahead of the joiner, otherwise raw
+                # subreports of many time partitions will pile up in RAM
+                while len(inflight) > self.fetchWorkers:
+                    self.processTimePartition(*inflight.popleft())
 
+            while len(inflight) > 0:
+                self.processTimePartition(*inflight.popleft())
+        
+        # At this point, there is no more time partitions to process. Thats the end of the work.
+        
+        self.logger.debug("Sending end of work signal for DB writer")
+        self.dbWriteQueue.put(None) # Tell DB writting thread that's the end of work.
 
 
-            for i in range(len(subreports)):
-                # For one time partition, iterate over all possible reports that consists of
-                # key dimension with one additional dimension (a.k.a. subreport)
-                
-                query['dimensions'] = self.dimensionItemsToList(item='name', asDict=True, filter=subreports[i])
 
-                
-                # For debugging:
-                dimTitles = self.dimensionItemsToList(item='title', asDict=False, filter=subreports[i])
 
-                # Store report data here:
-                result=[]
-            
-                if 'pageToken' in query: del query['pageToken']
+    def submitTimePartition(self, p, subreports=None, batches=None):
+        """
+        Dispatch all subreport batches of time partition `p` to fetcher workers.
+        Returns the list of futures.
+        """
+        if subreports is None:
+            subreports = self.subreportDimensions()
+            batches = self.subreportBatches(subreports)
+        
+        if self.checkpoint is not None:
+            self.checkpoint.begin(p)
+        
+        return [
+            self.fetcher.submit(self.getSubreports, p, subreports, b, len(subreports))
+            for b in batches
+        ]
 
-                
-                pageiteration=0
-                nextPageToken=None
-                sampling=None
 
-                cont = True       # will be recalculated after each iteration
 
-                while cont:
-                    # Iterate over subreport pages of about 100000 rows
 
-                    s = max(p[0],self.effectiveStart)
-                    e = min(p[1],self.end)
+    def adaptiveDateRangePartitions(self):
+        """
+        Generate time partitions from `effectiveStart` to `end`, with size of
+        `self.partitionSize`, which is continuously adapted by processTimePartition():
+        doubled while partitions have few rows, and shrunk when one had to be split
+        because GA returned sampled data.
+        """
+        # Data is fetched from the minute after effectiveStart, as in filterTimeStartToEnd()
+        cursor = (pd.Timestamp(self.effectiveStart) + pd.Timedelta(minutes=1)).floor('h')
+        end = pd.Timestamp(self.end)
+        
+        while cursor < end:
+            e = min(cursor + self.partitionSize, end)
+            
+            yield [
+                cursor.to_pydatetime(),
+                (e - pd.Timedelta(microseconds=1)).to_pydatetime()
+            ]
+            
+            cursor = e
 
-                    self.logger.debug('Working on subreport for {focus}+{keys} ({pos} of {tot}), page {page}, time range of {start} ➔ {end}'.format(
-                            focus=list(set(dimTitles).difference(keys)),
-                            keys=keys,
-                            pos=i+1,
-                            tot=len(subreports),
-                            page=pageiteration,
-                            start=s,
-                            end=e
-                        )
-                    )
-                    
-#                     self.logger.debug("Working on subreport {} of {}: 【{}】 【{}】 【{}】…".format(i+1,len(subreports),timePartitionName,dimTitles,pageiteration))
-                    
-                    if pageiteration>0:
-                        query['pageToken'] = nextPageToken
-
-                    try:
-                        # Free big objects in RAM
-                        del report
-                    except NameError:
-                        pass
-                    
-                    report = self.callGA(
-                        body={
-                            'reportRequests': [query],
-                            'useResourceQuotas': True
-                        }
-                    )
 
-                    if 'rowCount' in report['reports'][0]['data']:
-                        # If report has data
-                    
-                        rowCount=report['reports'][0]['data']['rowCount']
 
-                        nextPageToken=None
-                        samplesReadCount=None
-                        samplingSpaceSize=None
 
-                        if 'nextPageToken' in report['reports'][0]:
-                            nextPageToken=report['reports'][0]['nextPageToken']
+    def splitTimePartition(self, p):
+        """
+        Split time partition `p` in 2 halves aligned to the hour, or return None if
+        it is already as small as `minPartitionSize`.
+        """
+        start = pd.Timestamp(p[0])
+        end = pd.Timestamp(p[1]) + pd.Timedelta(microseconds=1)
+        
+        if end - start <= self.minPartitionSize:
+            return None
+        
+        middle = max(start + self.minPartitionSize, (start + (end - start)/2).floor('h'))
+        
+        return [
+            [start.to_pydatetime(), (middle - pd.Timedelta(microseconds=1)).to_pydatetime()],
+            [middle.to_pydatetime(), p[1]]
+        ]
 
-                        if 'samplesReadCounts' in report['reports'][0]['data']:
-                            samplesReadCount=int(report['reports'][0]['data']['samplesReadCounts'][0])
 
-                        if 'samplingSpaceSizes' in report['reports'][0]['data']:
-                            samplingSpaceSize=int(report['reports'][0]['data']['samplingSpaceSizes'][0])
 
 
+    def timePartitionName(self, p):
+        # For debugging
+        if self.adaptivePartitions:
+            return '[{}]➔[{}]'.format(p[0].isoformat(timespec='minutes'),p[1].isoformat(timespec='minutes'))
+        
+        return '[{}]➔[{}]'.format(p[0].date().isoformat(),p[1].date().isoformat())
 
-                        for r in report['reports'][0]['data']['rows']:
-                            result.append(r['dimensions'])
 
-                        pageiteration += 1
 
-                        self.logger.debug("Subreport page size has {} rows.".format(len(report['reports'][0]['data']['rows'])))
 
-                        if samplesReadCount:
-                            self.logger.warning("Sample space size: {}. Samples read: {}. Read {}% of sample space.".format(samplingSpaceSize,samplesReadCount,100*samplesReadCount/samplingSpaceSize))
-                        else:
-                            self.logger.debug("Data is complete and not sampled !")
+    def timePartitionQuery(self, p):
+        """
+        Return a GA query object for the time partition `p`, without dimensions.
+        """
+        query=copy.deepcopy(self.query)
 
-                        self.logger.debug("Token for next page: {}.".format(nextPageToken))
-                    else:
-                        self.logger.debug("Dimension has no data for this time partition.")
-                        
-                    cont = (nextPageToken is not None)
-                    
-                    # At this point, a single page of a subreport was read containing 100.000 rows max. Continue to next page of same subreport.
+        query['dateRanges'] = [{
+            'startDate': p[0].date().isoformat(),
+            'endDate':   p[1].date().isoformat()
+        }]
+        
+        # Fine tune time range as passed to object's `start` and `end` parameters,
+        # and to the time partition boundaries, which might be smaller than a day
+        timeLimits = self.filterTimeStartToEnd(
+            start = max(p[0] - datetime.timedelta(minutes=1), self.effectiveStart),
+            end   = min(p[1] + datetime.timedelta(microseconds=1), self.end)
+        )
+        if timeLimits:
+            query['dimensionFilterClauses'] = timeLimits
 
-                    
-                # Even if there's no data (len(result)==0), I need an empty dataframe with all columns in the right place to later join them correctly.
-                self.subreports.append(pd.DataFrame(
-                    columns=self.dimensionItemsToList('title', filter=subreports[i]),
-                    data=result
-                ))
-                self.logger.debug("Subreport shape size is {}×{}".format(
-                    self.subreports[-1].shape[0],
-                    self.subreports[-1].shape[1])
-                )
+        # Set order as passed by Dimensions structure
+        order = self.dimensionItemsToOrderBys()
+        if order:
+            query['orderBys'] = order
 
-                # Calculate a wanna-be-unique hash for each line based on key columns/dimensions
-                self.subreports[-1] = GAAPItoDB.makePrimaryKey(self.subreports[-1],keys)
+        return query
 
 
-#                 buffer = io.StringIO()
-#                 self.subreports[-1].info(verbose=True, buf=buffer)
-#                 self.logger.debug("Subreport memory profile:\n{}".format(buffer.getvalue()))
-                
-                # Free some RAM
-                del result
-                
 
-                # At this point all pages of a subreport inside a time partition were read and stored in a subreport DataFrame.
-                # Continue to next subreport for same time partition.
 
-                
-            # At this point, all pages of all subreports inside a single time partition were read.
-            # Now join and process data and set it ready to store in the database.
+    def subreportBatches(self, subreports):
+        """
+        Group subreports in batches of up to `subreportsPerCall` (5 is the GA API
+        limit), so each batch will be fetched with a single batchGet() call per page.
         
-            if len(self.subreports) > 0:
-                
-                self.logger.debug("Joining {} subreports...".format(len(self.subreports)))
-                
-                self.report=self.subreports[0]
+        Returns a list of lists of subreport positions, as [[0,1,2,3,4],[5,6]].
+        """
+        size = self.subreportsPerCall
+        return [
+            list(range(i, min(i+size, len(subreports))))
+            for i in range(0, len(subreports), size)
+        ]
 
-                # Start from second report family
-                for i in range(1, len(self.subreports)):
-                    # Join 2 reports by index, which is calculated as a hash from all reports common columns.
-                    self.report=self.report.join(
-                                other=self.subreports[i],
-                                how='outer',
-                                rsuffix=f"__{i}",
-                                sort=False
-                    )
 
-                    # Coalesce values of key columns so the non-“__{i}” ones will have the data
-                    for k in keys:
-                        self.report[k]=self.report[k].combine_first(self.report[f'{k}__{i}'])
-                    
-                    # Delete overlapping columns
-                    cols=self.report.columns
-                    todrop=[]
-                    for c in cols:
-                        if f"__{i}" in c:
-                            todrop.append(c)
-                    self.report.drop(todrop, axis=1, inplace=True)
-#                     del cols, todrop, c
-                    
-                    # Delete dataframe that was already joined and merged into self.report
-                    destroyer=self.subreports[i]
-                    self.subreports[i]=None
-                    del destroyer
-                    
-                    # Force garbage collector
-                    gc.collect()
-                    
-                    buffer = io.StringIO()
-                    self.report.info(verbose=True, buf=buffer)
-                    self.logger.debug("Report memory profile so far:\n{}".format(buffer.getvalue()))
-                    
 
 
+    def readReportPage(self, report, decoder):
+        """
+        Decode rows of a single report page returned by GA into the `decoder`, a
+        GAPageDecoder, and free them right away.
+        
+        Returns a tuple with the token for the next page, or None if this was the
+        last page, and a boolean telling if data is sampled.
+        """
+        nextPageToken=None
+        samplesReadCount=None
 
+        if 'rowCount' in report['data']:
+            # If report has data
+        
+            rowCount=report['data']['rowCount']
 
-                # First Stage data conversion - operate over columns
+            samplesReadCount=None
+            samplingSpaceSize=None
 
-                self.logger.debug("Optimizing data types on {} dimensions...".format(len(self.dimensions)))
-                for d in self.dimensions:
-                    if 'type' in d:
-                        orgname=d['title']
-                        if 'keeporiginal' in d:
-                            # Keep original data in a new column with suffix "__org"
-                            orgname=d['title'] + "__org"
-                            self.report[orgname]=self.report[d['title']]
+            if 'nextPageToken' in report:
+                nextPageToken=report['nextPageToken']
 
-                        if d['type'] == 'int':
-                            self.report[d['title']]=pd.to_numeric(self.report[orgname],errors='raise')
-                        if d['type'] == 'datetime':
-                            # Convert to date and time
-                            self.report[d['title']]=pd.to_datetime(self.report[orgname])
-                            
-                            # Add GA View's time zone just to convert time to UTC right away
-                            self.report[d['title']]=self.report[d['title']].apply(lambda x: x.tz_localize(self.gaTimezone).tz_convert(None))
+            if 'samplesReadCounts' in report['data']:
+                samplesReadCount=int(report['data']['samplesReadCounts'][0])
 
-                buffer = io.StringIO()
-                self.report.info(verbose=True, buf=buffer)
-                self.logger.debug("Report memory profile after data type optimization:\n{}".format(buffer.getvalue()))
+            if 'samplingSpaceSizes' in report['data']:
+                samplingSpaceSize=int(report['data']['samplingSpaceSizes'][0])
 
-                if self.report.shape[0]>0:
-                    # Second Stage data conversion - operate over entire dataframe
-                    for d in self.dimensions:
-                        if 'transform' in d:
-                            self.logger.debug(f"Doing more complex data transformations for {d['title']}...")
 
-                            # There is a second stage transformation declared for column.
-                            # Call custom function with parameters
-                            self.report = d['transform'](self.report,d)
 
+            rows=report['data'].get('rows',[])
+            self.logger.debug("Subreport page size has {} rows.".format(len(rows)))
 
-                    # Sort report by dimension that has synccursor=True
-                    for k in self.dimensions:
-                        if 'synccursor' in k and k['synccursor']==True:
-                            break
-                    self.report.sort_values(by=k['title'], inplace=True)
+            decoder.addPage(rows)
+            self.runMetrics.inc('rows_fetched', len(rows), processor=self.processor)
+            
+            # Free raw page as soon as possible
+            del rows
+            report['data'].pop('rows', None)
+
+            self.runMetrics.observe(
+                'sampling_ratio',
+                samplesReadCount/samplingSpaceSize if samplesReadCount and samplingSpaceSize else 1,
+                processor=self.processor
+            )
+
+            if samplesReadCount:
+                self.logger.warning("Sample space size: {}. Samples read: {}. Read {}% of sample space.".format(samplingSpaceSize,samplesReadCount,100*samplesReadCount/samplingSpaceSize))
+            else:
+                self.logger.debug("Data is complete and not sampled !")
 
+            self.logger.debug("Token for next page: {}.".format(nextPageToken))
+        else:
+            self.logger.debug("Dimension has no data for this time partition.")
 
-                    # Calculate unique IDs for rows
-                    self.logger.debug("Generate wanna-be unique IDs for rows...")
-                    self.report = GAAPItoDB.makePrimaryKey(self.report, self.getFinalReportColumns(onlykeys=True))
+        return (nextPageToken, bool(samplesReadCount))
 
-                    # At this point we have a complete report for a time partition.
-                    # Add it to the database writer queue.
 
-                    self.logger.debug(f"Dispatching report of size {self.report.shape[0]}×{self.report.shape[1]} for DB writting...")
-                    self.dbWriteQueue.put((timePartitionName, self.report))
 
 
-                # Clean the way for more data
-                destroyer = self.report
-                self.report = None
-                del destroyer
-                self.subreports.clear()
-            
+    def getSubreports(self, p, subreports, positions, total=1):
+        """
+        Get all pages of a batch of subreports for the time partition `p`.
         
-        # At this point, there is no more time partitions to process. Thats the end of the work.
+        `subreports` is the list of dimension indexes, as returned by subreportDimensions(),
+        and `positions` is the list of subreports in this batch, as returned by
+        subreportBatches().
         
-        self.logger.debug("Sending end of work signal for DB writer")
-        self.dbWriteQueue.put(None) # Tell DB writting thread that's the end of work.
-
+        All subreports of the batch share the same date range, so they are requested
+        together in a single batchGet() call. Each one has its own `nextPageToken`,
+        so pages are tracked independently and a subreport leaves the batch as soon
+        as its last page was read.
         
-
-
-
-    def makePrimaryKey(df,listOfKeys):
-        subreportPrimaryKeyName = '__row_id'
+        Returns a list of DataFrames indexed by the row hash of the key columns, in
+        the same order as `positions`. This method is thread-safe and is executed by
+        the fetcher workers.
+        """
+        keys = self.getReportKeys()
+        
+        s = max(p[0],self.effectiveStart)
+        e = min(p[1],self.end)
         
-        # Initialize column
-        df[subreportPrimaryKeyName]=""
+        # Only data old enough to be completely processed by GA can be cached
+        cacheable = (self.cache is not None) and (e < self.end - self.cache.safetyMargin)
         
-        for k in listOfKeys:
-            df[subreportPrimaryKeyName] += df[k].astype(str)
+        # Pages kept on disk until this time partition is committed, if checkpointSpool is set
+        spool = self.checkpoint.spool(p) if self.checkpoint is not None else None
 
-        df[subreportPrimaryKeyName] = df[subreportPrimaryKeyName].apply(GAAPItoDB.makeID)
+        queries = []
+        results = []
+        pageiterations = []
         
-        df.set_index(subreportPrimaryKeyName, inplace=True)
+        for i in positions:
+            query = self.timePartitionQuery(p)
+            query['dimensions'] = self.dimensionItemsToList(item='name', asDict=True, filter=subreports[i])
+            
+            queries.append(query)
+            
+            # Store report data here, decoded in compact columns:
+            results.append(GAPageDecoder(
+                self.dimensionItemsToList('title', filter=subreports[i]),
+                categorical=self.categoricalColumns(),
+                categoricalRatio=self.categoricalRatio,
+                candidates=self.categoricalColumns(candidates=True)
+            ))
+            pageiterations.append(0)
+
+        # Subreports of this batch that still have pages to read
+        pending = list(range(len(positions)))
         
-        return df
+        # Summary of last page read of each subreport
+        summaries = [None] * len(positions)
 
+        while len(pending) > 0:
+            # Iterate over pages of about 100000 rows of all pending subreports
+            
+            if self.logger.isEnabledFor(logging.DEBUG):
+                for j in pending:
+                    # For debugging:
+                    dimTitles = self.dimensionItemsToList(item='title', asDict=False, filter=subreports[positions[j]])
 
+                    self.logger.debug('Working on subreport for {focus}+{keys} ({pos} of {tot}), page {page}, time range of {start} ➔ {end}'.format(
+                            focus=list(set(dimTitles).difference(keys)),
+                            keys=keys,
+                            pos=positions[j]+1,
+                            tot=total,
+                            page=pageiterations[j],
+                            start=s,
+                            end=e
+                        )
+                    )
 
+            try:
+                # Free big objects in RAM
+                del report
+            except NameError:
+                pass
+            
+            report = self.callGA(
+                body={
+                    'reportRequests': [queries[j] for j in pending],
+                    'useResourceQuotas': True
+                },
+                cacheable=cacheable,
+                spool=spool
+            )
 
-    def makeID(text):
-        # Calculate a Shake 256 hash of 8 bytes for the text argument, use its hexdigest (textual) version
-        
-        idCalc=hashlib.new('shake_256')
-        idCalc.update(text.encode('UTF-8'))
-        return idCalc.hexdigest(8)
+            # GA returns reports in the same order they were requested
+            stillPending = []
+            for j, r in zip(pending, report['reports']):
+                # Keep what is needed to check consistency of pages fetched in parallel
+                summaries[j] = self.pageSummary(r, queries[j])
+                
+                nextPageToken, sampled = self.readReportPage(r, results[j])
+                pageiterations[j] += 1
+                
+                if self.checkpoint is not None:
+                    self.checkpoint.page(p, positions[j], nextPageToken)
+                
+                if sampled and self.adaptivePartitions and self.splitTimePartition(p) is not None:
+                    # Don't waste calls on remaining pages, this time partition will be split
+                    raise GASampledData(p)
+                
+                if nextPageToken is not None:
+                    queries[j]['pageToken'] = nextPageToken
+                    stillPending.append(j)
+            
+            pending = stillPending
+            
+            # At this point, a single page of each subreport was read containing 100.000 rows max. Continue to next pages.
+            
+            if self.pageWorkers > 1 and len(pending) > 0 and max([pageiterations[j] for j in pending]) == 1:
+                # First pages told us how many rows each subreport has, so get all
+                # other pages at once. Returns subreports that still need sequential paging.
+                pending = self.getPagesInParallel(queries, results, pending, summaries, cacheable, p, positions, spool)
+
+        dfs = []
+        for j in range(len(positions)):
+            # Even if there's no data, I need an empty dataframe with all columns in the right place to later join them correctly.
+            df = results[j].dataFrame()
+            self.logger.debug("Subreport shape size is {}×{}".format(
+                df.shape[0],
+                df.shape[1])
+            )
 
+            # Free some RAM
+            results[j] = None
 
-    def connectDB(self):
-        # DB Connect
-        self.logger.debug(f"Connecting to DB {self.dbURL}")
+            # Calculate a wanna-be-unique hash for each line based on key columns/dimensions.
+            # It is used only to join subreports, so the fastest hash is fine.
+            dfs.append(GAAPItoDB.makePrimaryKey(df,keys,'siphash'))
 
-        try:
-            self.db=sqlalchemy.create_engine(self.dbURL, encoding='utf8')
+        return dfs
+
+
+
+
+    def pageSummary(self, report, query):
+        """
+        Return a dict with the total row count, number of rows, next page token and
+        value of first sorting dimension on first and last rows of a report page.
+        """
+        rows = report['data'].get('rows',[])
+        
+        # Position of first sorting dimension in this query
+        sortIndex = None
+        if 'orderBys' in query:
+            names = [d['name'] for d in query['dimensions']]
+            if query['orderBys'][0]['fieldName'] in names:
+                sortIndex = names.index(query['orderBys'][0]['fieldName'])
+        
+        return {
+            'rowCount': int(report['data'].get('rowCount',0)),
+            'rows':     len(rows),
+            'token':    report.get('nextPageToken'),
+            'first':    rows[0]['dimensions'][sortIndex] if sortIndex is not None and len(rows) > 0 else None,
+            'last':     rows[-1]['dimensions'][sortIndex] if sortIndex is not None and len(rows) > 0 else None
+        }
+
+
+
+
+    def getPagesInParallel(self, queries, decoders, pending, summaries, cacheable=False, p=None, positions=None, spool=None):
+        """
+        In Reporting API v4, a `nextPageToken` is just the offset of the next row. So
+        after reading the first page of each subreport, the tokens of all remaining
+        pages are known and they can be fetched in parallel by `pageWorkers` threads.
+        
+        Pages are fetched in waves of `pageWorkers` page numbers, each call getting
+        the same page number of all pending subreports. Each wave is checked for
+        consistency (same total row count, expected number of rows and next token,
+        ascending order of the sorting dimension) before being decoded in order.
+        
+        If a wave is inconsistent, it is discarded and this method returns the list of
+        subreports that still have pages, with `pageToken` pointing to the first page
+        not decoded, so the caller continues with sequential paging. Returns an empty
+        list if all pages were read.
+        
+        Pages read are checkpointed as those of time partition `p` and subreports
+        `positions`, and kept in `spool` until committed.
+        """
+        
+        for j in pending:
+            token = summaries[j]['token']
+            
+            if not (isinstance(token, str) and token.isdigit() and int(token) == summaries[j]['rows']):
+                # Not an offset, don't know how to synthesize next tokens
+                self.logger.debug(f'Page token «{token}» is not a row offset, paging sequentially.')
+                return pending
+        
+        pageSize = {j: summaries[j]['rows'] for j in pending}
+        pages = {j: -(-summaries[j]['rowCount'] // pageSize[j]) for j in pending}  # ceil
+        
+        self.logger.debug(f'Fetching {sum(pages.values())-len(pending)} remaining pages of {len(pending)} subreports in parallel.')
+        
+        page = 1
+        while page < max(pages.values()):
+            wave = list(range(page, min(page + self.pageWorkers, max(pages.values()))))
+            
+            # For each page number, the subreports that have it
+            waveSubreports = {k: [j for j in pending if pages[j] > k] for k in wave}
+            
+            futures = {}
+            for k in wave:
+                requests = []
+                for j in waveSubreports[k]:
+                    query = copy.deepcopy(queries[j])
+                    query['pageToken'] = str(k * pageSize[j])
+                    requests.append(query)
+                
+                futures[k] = self.pageFetcher.submit(
+                    self.callGA,
+                    body={
+                        'reportRequests': requests,
+                        'useResourceQuotas': True
+                    },
+                    cacheable=cacheable,
+                    spool=spool
+                )
+            
+            reports = {k: futures[k].result()['reports'] for k in wave}
+            
+            # Check consistency of entire wave before decoding any page
+            consistent = True
+            last = {j: summaries[j]['last'] for j in pending}
+            for k in wave:
+                for j, r in zip(waveSubreports[k], reports[k]):
+                    summary = self.pageSummary(r, queries[j])
+                    
+                    expectedRows = min(pageSize[j], summaries[j]['rowCount'] - k*pageSize[j])
+                    expectedToken = str((k+1)*pageSize[j]) if k+1 < pages[j] else None
+                    
+                    if (
+                            summary['rowCount'] != summaries[j]['rowCount'] or
+                            summary['rows'] != expectedRows or
+                            summary['token'] != expectedToken or
+                            (last[j] is not None and summary['first'] is not None and summary['first'] < last[j])
+                        ):
+                        self.logger.warning(f'Page {k} fetched in parallel is inconsistent ({summary}), falling back to sequential paging.')
+                        consistent = False
+                        break
+                    
+                    last[j] = summary['last']
+                
+                if not consistent:
+                    break
+            
+            if not consistent:
+                del reports
+                
+                stillPending = []
+                for j in pending:
+                    if pages[j] > page:
+                        queries[j]['pageToken'] = str(page * pageSize[j])
+                        stillPending.append(j)
+                
+                return stillPending
+            
+            # Decode pages in order
+            for k in wave:
+                for j, r in zip(waveSubreports[k], reports[k]):
+                    nextPageToken, sampled = self.readReportPage(r, decoders[j])
+                    
+                    if self.checkpoint is not None:
+                        self.checkpoint.page(p, positions[j], nextPageToken)
+                    
+                    if sampled and self.adaptivePartitions and self.splitTimePartition(p) is not None:
+                        # Later pages may be sampled even if the first one wasn't
+                        raise GASampledData(p)
+                
+                # Free raw pages as soon as possible
+                reports[k] = None
+            
+            for j in pending:
+                summaries[j]['last'] = last[j]
+            
+            page = wave[-1] + 1
+        
+        return []
+
+
+
+
+    def processTimePartition(self, p, batchFutures):
+        """
+        Wait for all subreport batches of time partition `p` to be fetched, join them,
+        transform data and dispatch the final report to the DB writer queue.
+        
+        Must be called in time partition order.
+        """
+        keys = self.getReportKeys()
+        timePartitionName = self.timePartitionName(p)
+        
+        # Block until all subreports of this time partition were read.
+        # Exceptions raised in fetcher workers will be re-raised here.
+        try:
+            self.subreports = [df for f in batchFutures for df in f.result()]
+        except GASampledData:
+            for f in batchFutures:
+                f.cancel()
+            
+            halves = self.splitTimePartition(p)
+            
+            self.logger.warning(f'GA returned sampled data for {timePartitionName}, splitting it in {self.timePartitionName(halves[0])} and {self.timePartitionName(halves[1])}')
+            
+            # Next time partitions will be no bigger than a half
+            self.partitionSize = min(
+                self.partitionSize,
+                pd.Timestamp(halves[0][1]) + pd.Timedelta(microseconds=1) - pd.Timestamp(halves[0][0])
+            )
+            
+            # Dispatch both halves before joining the first, so fetchers keep busy
+            futures = [self.submitTimePartition(h) for h in halves]
+            for h, f in zip(halves, futures):
+                self.processTimePartition(h, f)
+            
+            return
+        
+        if self.adaptivePartitions:
+            maxRows = max([df.shape[0] for df in self.subreports] + [0])
+            
+            if maxRows < self.mergeRowTarget and self.partitionSize < self.maxPartitionSize:
+                # Few rows, so join next partitions in bigger ones to save API calls
+                self.partitionSize = min(2*self.partitionSize, self.maxPartitionSize)
+                self.logger.debug(f'{timePartitionName} had only {maxRows} rows, increasing next time partitions to {self.partitionSize}')
+
+        # At this point, all pages of all subreports inside a single time partition were read.
+        # Now join and process data and set it ready to store in the database.
+        
+        queued = False
+    
+        if len(self.subreports) > 0:
+            
+            self.logger.debug("Joining {} subreports of {}...".format(len(self.subreports), timePartitionName))
+            
+            with self.runMetrics.timer('join_seconds', processor=self.processor):
+                self.report=self.joinSubreports(self.subreports)
+            
+            # Subreports were consumed by the join
+            self.subreports.clear()
+
+            self.logMemoryProfile('after join')
+
+
+
+            # First Stage data conversion - operate over columns
+
+            self.logger.debug("Optimizing data types on {} dimensions...".format(len(self.dimensions)))
+            for d in self.dimensions:
+                if 'type' in d:
+                    orgname=d['title']
+                    if 'keeporiginal' in d:
+                        # Keep original data in a new column with suffix "__org"
+                        orgname=d['title'] + "__org"
+                        self.report[orgname]=self.report[d['title']]
+
+                    if d['type'] == 'int':
+                        self.report[d['title']]=pd.to_numeric(self.report[orgname],errors='raise')
+                    if d['type'] == 'datetime':
+                        # Convert to date and time in UTC right away
+                        self.report[d['title']]=self.timeToUTC(self.report[orgname], self.timeFormats.get(d['name']))
+
+            self.logMemoryProfile('after data type optimization')
+
+            if self.report.shape[0]>0:
+                # Second Stage data conversion - operate over entire dataframe
+                for d in self.dimensions:
+                    if 'transform' in d:
+                        self.logger.debug(f"Doing more complex data transformations for {d['title']}...")
+
+                        # There is a second stage transformation declared for column.
+                        # Call custom function or compiled built-in with parameters
+                        with self.runMetrics.timer('transform_seconds', dimension=d['title'], processor=self.processor):
+                            self.report = self.transforms[d['title']](self.report,d)
+
+
+                # Sort report by dimension that has synccursor=True
+                for k in self.dimensions:
+                    if 'synccursor' in k and k['synccursor']==True:
+                        break
+                self.report.sort_values(by=k['title'], inplace=True)
+
+
+                # Calculate unique IDs for rows
+                self.logger.debug("Generate wanna-be unique IDs for rows...")
+                with self.runMetrics.timer('hash_seconds', processor=self.processor):
+                    self.report = GAAPItoDB.makePrimaryKey(self.report, self.getFinalReportColumns(onlykeys=True), self.rowIDHash)
+                
+                if self.correctionUntil is not None and p[0] <= self.correctionUntil and self.update:
+                    # Time partition was synced before, so keep only what GA changed since then
+                    self.report = self.correctionDiff(self.report)
+                
+                if self.arrow:
+                    # Only Arrow buffers wait for the DB writer
+                    self.report = self.arrowReport(self.report)
+
+                # At this point we have a complete report for a time partition.
+                # Add it to the database writer queue.
+
+                self.logger.debug(f"Dispatching report of size {self.report.shape[0]}×{self.report.shape[1]} for DB writting...")
+                
+                if self.checkpoint is not None:
+                    self.checkpoint.queued(p, self.report.shape[0])
+                
+                self.queuedPartitions[timePartitionName] = p
+                self.dbWriteQueue.put((timePartitionName, self.report))
+                queued = True
+
+
+            # Clean the way for more data
+            destroyer = self.report
+            self.report = None
+            del destroyer
+            self.subreports.clear()
+        
+        if not queued and self.checkpoint is not None:
+            # Empty time partitions must also be committed in order
+            self.checkpoint.queued(p, 0)
+            self.queuedPartitions[timePartitionName] = p
+            self.dbWriteQueue.put((timePartitionName, pd.DataFrame()))
+
+
+
+
+    def joinSubreports(self, subreports):
+        """
+        Outer join all `subreports` on their row hash index in a single pass.
+
+        The union of all indexes is built once, appending to it the rows of each
+        subreport that were not seen in previous ones. Key columns are then built
+        once, from the subreport that saw each row first, and each other column is
+        placed on the union with a single take() over its subreport's rows. No
+        intermediate joined frames are created.
+
+        Result is the same as joinSubreportsIteratively(), except for row order.
+        Subreports are released as their columns are consumed, so `subreports`
+        becomes a list of None.
+
+        Falls back to joinSubreportsIteratively() if some subreport has repeated
+        row hashes, because then an outer join multiplies rows.
+        """
+        keys = self.getReportKeys()
+
+        if len(subreports) == 1:
+            report = subreports[0]
+            subreports[0] = None
+            return report
+
+        if not all([df.index.is_unique for df in subreports]):
+            self.logger.debug('Some subreports have repeated row IDs, joining them iteratively')
+            return self.joinSubreportsIteratively(subreports)
+
+        # Keep column order of the iterative join
+        columns = []
+        for df in subreports:
+            columns.extend([c for c in df.columns if c not in columns])
+
+        # Union of all row IDs, in order of first appearance, and rows of each
+        # subreport that appear in union for the first time
+        union = subreports[0].index
+        firstRows = [np.arange(subreports[0].shape[0])]
+        for df in subreports[1:]:
+            firstRows.append(np.flatnonzero(union.get_indexer(df.index) < 0))
+            union = union.append(df.index[firstRows[-1]])
+
+        data = {}
+
+        # Key columns are present in all subreports, so build them only once
+        for k in keys:
+            data[k] = pd.concat(
+                [df[k].iloc[rows] for df, rows in zip(subreports, firstRows)],
+                ignore_index=True
+            ).array
+
+        del firstRows
+
+        for i in range(len(subreports)):
+            df = subreports[i]
+
+            # Row of this subreport for each row of union, or -1 if missing
+            indexer = df.index.get_indexer(union)
+
+            for c in df.columns:
+                if c not in data:
+                    # Missing rows become NaN, as in an outer join
+                    data[c] = df[c].array.take(indexer, allow_fill=True)
+
+            # Release subreport as soon as its columns were placed
+            subreports[i] = None
+            del df
+
+        return pd.DataFrame(
+            data,
+            index=union.rename('__row_id'),
+            columns=columns
+        )
+
+
+
+
+    def joinSubreportsIteratively(self, subreports):
+        """
+        Outer join `subreports` on their row hash index one after the other, as
+        GAAPItoDB did up to version 0.6. Each step copies the growing report, so this
+        is quadratic on the number of subreports. Kept for subreports with repeated
+        row IDs and to benchmark joinSubreports() against.
+        """
+        keys = self.getReportKeys()
+        
+        report=subreports[0]
+
+        # Start from second report family
+        for i in range(1, len(subreports)):
+            # Join 2 reports by index, which is calculated as a hash from all reports common columns.
+            report=report.join(
+                        other=subreports[i],
+                        how='outer',
+                        rsuffix=f"__{i}",
+                        sort=False
+            )
+
+            # Coalesce values of key columns so the non-“__{i}” ones will have the data
+            for k in keys:
+                report[k]=report[k].combine_first(report[f'{k}__{i}'])
+            
+            # Delete overlapping columns
+            report.drop(
+                [c for c in report.columns if f"__{i}" in c],
+                axis=1,
+                inplace=True
+            )
+            
+            # Delete dataframe that was already joined and merged into report
+            subreports[i]=None
+        
+        subreports[0]=None
+        
+        return report
+
+
+
+
+    def logMemoryProfile(self, stage):
+        """
+        Log memory usage of report columns, and how much categorical columns save,
+        if debug logging is enabled.
+        """
+        if not self.logger.isEnabledFor(logging.DEBUG):
+            return
+        
+        buffer = io.StringIO()
+        self.report.info(verbose=True, buf=buffer)
+        
+        categoricalBytes, objectBytes = GAAPItoDB.categoricalSavings(self.report)
+        if objectBytes > 0:
+            buffer.write('Categorical columns use {cat:.1f} MiB instead of {obj:.1f} MiB as objects, saving {saved:.1f} MiB\n'.format(
+                cat=categoricalBytes/1024**2,
+                obj=objectBytes/1024**2,
+                saved=(objectBytes-categoricalBytes)/1024**2
+            ))
+        
+        self.logger.debug("Report memory profile {}:\n{}".format(stage, buffer.getvalue()))
+
+
+
+
+    def categoricalSavings(df):
+        """
+        Return bytes used by categorical columns of `df` and bytes they would use
+        as object columns, as pandas' memory_usage(deep=True) would count them.
+        Computed from codes, without building object columns.
+        """
+        categoricalBytes = 0
+        objectBytes = 0
+        
+        for c in df.columns:
+            if isinstance(df[c].dtype, pd.CategoricalDtype):
+                codes = df[c].cat.codes.to_numpy()
+                categories = df[c].cat.categories
+                
+                counts = np.bincount(codes[codes >= 0], minlength=len(categories))
+                sizes = np.array([sys.getsizeof(v) for v in categories], dtype=np.int64)
+                
+                categoricalBytes += df[c].memory_usage(deep=True, index=False)
+                objectBytes += (
+                    8 * len(codes) +                                # pointers
+                    int(counts.dot(sizes)) +                        # values
+                    int((codes < 0).sum()) * sys.getsizeof(np.nan)  # missing values
+                )
+        
+        return categoricalBytes, objectBytes
+
+
+
+
+    def timeToUTC(self, column, format=None):
+        """
+        Parse `column` of local times of GA View with `format` and convert them to
+        naive UTC times, handling daylight saving time transitions as set by
+        `dstAmbiguous` and `dstNonexistent`.
+        
+        Only distinct values are parsed and converted, which are few compared to rows,
+        as a day has at most 1440 minutes, and then spread over all rows.
+        """
+        codes, uniques = pd.factorize(column)
+        
+        times = pd.to_datetime(uniques, format=format).tz_localize(
+            self.gaTimezone,
+            ambiguous=self.dstAmbiguous,
+            nonexistent=self.dstNonexistent
+        ).tz_convert(None)
+        
+        # Missing values have code -1 and become NaT
+        return pd.Series(
+            times.array.take(codes, allow_fill=True),
+            index=column.index,
+            name=column.name
+        )
+
+
+
+
+    def makePrimaryKey(df,listOfKeys,rowIDHash='shake_256'):
+        """
+        Set index of `df` to a hash of its `listOfKeys` columns, named `__row_id`.
+        
+        - 'shake_256': 16 hex chars of a Shake 256 hash of the concatenated text of
+          key columns, bit-for-bit the same IDs of GAAPItoDB up to version 0.6.
+        - 'siphash': 64 bits SipHash computed by pandas straight over the columns,
+          without building any text. Stored as signed int64 to fit SQL BIGINT columns.
+        """
+        subreportPrimaryKeyName = '__row_id'
+        
+        if rowIDHash == 'siphash':
+            ids = pd.util.hash_pandas_object(df[listOfKeys], index=False).to_numpy()
+            
+            df.index = pd.Index(ids.view(np.int64), name=subreportPrimaryKeyName)
+            
+            return df
+        
+        if rowIDHash != 'shake_256':
+            raise ValueError(f"rowIDHash must be 'shake_256' or 'siphash', not {rowIDHash!r}")
+        
+        # Concatenate text of all key columns, column-wise
+        text = GAAPItoDB.keyText(df[listOfKeys[0]])
+        for k in listOfKeys[1:]:
+            text = text + GAAPItoDB.keyText(df[k])
+
+        df.index = pd.Index(
+            [GAAPItoDB.makeID(t) for t in text],
+            dtype=object,
+            name=subreportPrimaryKeyName
+        )
+        
+        return df
+
+
+
+
+    def keyText(column):
+        """
+        Same as column.astype(str), as an object array. Non-text columns are
+        converted only on their unique values, which are a lot less than rows for
+        times truncated to minutes and small integers.
+        """
+        if column.dtype != object and not column.hasnans:
+            codes, uniques = pd.factorize(column)
+            return pd.Series(uniques).astype(str).to_numpy(dtype=object)[codes]
+        
+        return column.astype(str).to_numpy(dtype=object)
+
+
+
+
+    def makeID(text):
+        # Calculate a Shake 256 hash of 8 bytes for the text argument, use its hexdigest (textual) version
+        return hashlib.shake_256(text.encode('UTF-8')).hexdigest(8)
+
+
+    def connectDB(self):
+        # DB Connect
+        self.logger.debug(f"Connecting to DB {self.dbURL}")
+
+        options={}
+        if self.dbWriters > 1:
+            if sqlalchemy.engine.make_url(self.dbURL).get_backend_name() == 'sqlite':
+                # SQLite has a single writer, and chunks waiting for their turn to commit would lock each other
+                self.logger.warning('SQLite allows a single writer; using dbWriters=1')
+                self.dbWriters=1
+            else:
+                # A connection for each writer plus the DB writer thread
+                options['pool_size']=self.dbWriters + 1
+        
+        try:
+            self.db=sqlalchemy.create_engine(self.dbURL, encoding='utf8', **options)
         except sqlalchemy.exc.SQLAlchemyError as error:
             self.logger.error('Can’t connect to DB.', exc_info=True)
             raise error
 
+
+
+
+    def syncCursorColumn(self):
+        # Name of the column of dimension with synccursor=True
+        for d in self.dimensions:
+            if 'synccursor' in d and d['synccursor']:
+                return d['title']
+        
+        return None
+
+
+
+
+    def tableSchema(self, name=None):
+        """
+        Return a SQLAlchemy Table for the layout of managed tables named `name`,
+        defaulting to `targetTable`: `__row_id` primary key, one column per final
+        report column typed after its dimension's `type` and an index on the
+        `synccursor` column.
+        """
+        if name is None:
+            name = self.targetTable
+        
+        if self.rowIDHash == 'siphash':
+            rowIDType = sqlalchemy.BigInteger()
+        else:
+            # 8 bytes of Shake 256, instead of its 16 hex chars
+            rowIDType = sqlalchemy.types.BINARY(8).with_variant(sqlalchemy.LargeBinary(), 'postgresql')
+        
+        columns = [sqlalchemy.Column('__row_id', rowIDType, primary_key=True, autoincrement=False)]
+        
+        for d in self.dimensions:
+            if 'transformspawncolumns' in d and d['transformspawncolumns']:
+                types = d.get('transformspawncolumnstypes', [None] * len(d['transformspawncolumns']))
+                for c, t in zip(d['transformspawncolumns'], types):
+                    columns.append(sqlalchemy.Column(c, self.columnTypes.get(t, sqlalchemy.Text)()))
+            else:
+                columns.append(sqlalchemy.Column(d['title'], self.columnTypes.get(d.get('type'), sqlalchemy.Text)()))
+        
+        table = sqlalchemy.Table(name, sqlalchemy.MetaData(), *columns)
+        
+        timeColName = self.syncCursorColumn()
+        if timeColName:
+            sqlalchemy.Index(f'{name}_{timeColName}_idx', table.c[timeColName])
+        
+        return table
+
+
+
+
+    def makeBulkLoader(self, table=None):
+        """
+        Return the GABulkLoader for `table`, defaulting to `targetTable`: the one
+        passed in `bulkLoader`, by name or class, or else the fastest one for the
+        dialect of `dbURL`.
+        """
+        if table is None:
+            table = self.targetTable
+        
+        if self.bulkLoader is None:
+            loader = GABulkLoaders.loaders.get(self.db.dialect.name, GABulkLoader)
+        elif isinstance(self.bulkLoader, str):
+            if self.bulkLoader not in GABulkLoaders.loaders:
+                raise ValueError(f'Unknown bulk loader «{self.bulkLoader}». Use one of {list(GABulkLoaders.loaders.keys())}.')
+            loader = GABulkLoaders.loaders[self.bulkLoader]
+        else:
+            loader = self.bulkLoader
+        
+        self.logger.debug(f'Writing {table} to {self.db.dialect.name} with {loader.__name__}')
+        
+        return loader(self.db, table)
+
+
+
+
+    def stagingTable(self):
+        """
+        Return a SQLAlchemy Table for `{targetTable}__staging`, a temporary table
+        with the columns of tableSchema() but no keys or indexes, where chunks are
+        bulk loaded before being merged into `targetTable` in upsert mode. Each DB
+        connection has its own, so parallel writers never see each other's rows,
+        and the database drops it when the run ends, even if it crashes.
+        """
+        return sqlalchemy.Table(
+            f'{self.targetTable}__staging',
+            sqlalchemy.MetaData(),
+            *[sqlalchemy.Column(c.name, c.type) for c in self.tableSchema().columns],
+            prefixes=['TEMPORARY']
+        )
+
+
+
+
+    def mergeStatement(self, staging):
+        """
+        Return the statement that copies all rows of `staging` to `targetTable`,
+        replacing rows of same `__row_id`: INSERT … ON CONFLICT DO UPDATE for
+        PostgreSQL and SQLite, INSERT … ON DUPLICATE KEY UPDATE for MySQL and MariaDB.
+        """
+        table = self.tableSchema()
+        columns = [c.name for c in table.columns]
+        updated = [c for c in columns if c != '__row_id']
+        
+        # SQLite needs a WHERE in INSERT … SELECT … ON CONFLICT to parse it
+        select = sqlalchemy.select(*[staging.c[c] for c in columns]).where(sqlalchemy.true())
+        
+        dialect = self.db.dialect.name
+        
+        if dialect in ['postgresql', 'sqlite']:
+            if dialect == 'postgresql':
+                from sqlalchemy.dialects.postgresql import insert
+            else:
+                from sqlalchemy.dialects.sqlite import insert
+            
+            statement = insert(table).from_select(columns, select)
+            
+            return statement.on_conflict_do_update(
+                index_elements=['__row_id'],
+                set_={c: statement.excluded[c] for c in updated}
+            )
+        elif dialect in ['mysql', 'mariadb']:
+            from sqlalchemy.dialects.mysql import insert
+            
+            statement = insert(table).from_select(columns, select)
+            
+            return statement.on_duplicate_key_update(
+                {c: statement.inserted[c] for c in updated}
+            )
+        else:
+            raise ValueError(f'Upsert mode is not supported for {dialect} databases')
+
+
+
+
+    def prepareUpsert(self):
+        """
+        If `upsert` or `correctionWindow` are set, prepare the staging table, its
+        bulk loader and the merge statement used by loadChunk().
+        """
+        if not (self.upsert or self.correctionWindow) or not self.update:
+            return
+        
+        if not self.managedTable:
+            raise ValueError(f'Upsert mode and correctionWindow need a table with __row_id primary key, as created with manageTable=True; {self.targetTable} has none')
+        
+        self.staging = self.stagingTable()
+        self.merge = self.mergeStatement(self.staging)
+        
+        self.stagingLoader = self.makeBulkLoader(self.staging.name)
+        
+        # Created by loadChunk() in each connection
+        self.stagingLoader.tableReady = True
+
+
+
+
+    def hasTable(self, name):
+        with self.db.connect() as connection:
+            return self.db.dialect.has_table(connection, name)
+
+
+
+
+    def prepareTable(self):
+        """
+        If `manageTable` is set, create `targetTable` with the layout of tableSchema(),
+        recreating it if `restart` is set. Anyway, a table that already has a
+        `__row_id` primary key is written as managed, others are left as previous
+        versions created them.
+        
+        Rows of a managed table in the period about to be synced are deleted if
+        `incremental` is False, so they don't collide with the ones fetched again,
+        unless `upsert` is set and they are simply replaced.
+        """
+        if not self.update:
+            return
+        
+        table = self.tableSchema()
+        
+        if self.manageTable:
+            if self.restart and self.hasTable(self.targetTable):
+                self.logger.info(f'Dropping table {self.targetTable} to restart')
+                table.drop(self.db)
+            
+            if not self.hasTable(self.targetTable):
+                self.logger.info(f'Creating table {self.targetTable}')
+                table.create(self.db)
+            
+            # Table was (re)created, so just append from now on
+            self.restart = False
+        elif self.restart or not self.hasTable(self.targetTable):
+            # Table will be created by first writeDB()
+            return
+        
+        primaryKey = sqlalchemy.inspect(self.db).get_pk_constraint(self.targetTable)['constrained_columns']
+        self.managedTable = (primaryKey == ['__row_id'])
+        
+        if not self.managedTable:
+            if self.manageTable:
+                self.logger.warning(f'Table {self.targetTable} has no __row_id primary key, as created by older versions; writing to it as before. Use migrateTable() to convert it.')
+            return
+        
+        timeColName = self.syncCursorColumn()
+        if not self.incremental and not self.upsert and timeColName:
+            # GA filters are exclusive and with minute precision, as in filterTimeStartToEnd()
+            start = pd.Timestamp(self.effectiveStart).floor('min') + pd.Timedelta(minutes=1)
+            end = pd.Timestamp(self.end).floor('min')
+            
+            with self.db.begin() as connection:
+                deleted = connection.execute(
+                    table.delete()
+                    .where(table.c[timeColName] >= start.tz_convert(None).to_pydatetime())
+                    .where(table.c[timeColName] < end.tz_convert(None).to_pydatetime())
+                ).rowcount
+            
+            self.logger.info(f'Deleted {deleted} rows of {self.targetTable} from {start} to {end}, to sync them again')
+
+
+
+
+    def prepareCheckpoint(self):
+        """
+        Create `checkpointTable` and clean up after a crashed run: rows written to
+        `targetTable` after the last committed time partition are deleted, since
+        their partition will be synced again, and so are checkpoints of partitions
+        not committed. Pages spooled for them are kept, to be read again.
+        
+        All checkpoints of this processor are forgotten if `restart` is set.
+        """
+        if self.checkpoint is None:
+            return
+        
+        if not self.update:
+            # Nothing will be written, so nothing to checkpoint
+            self.checkpoint = None
+            return
+        
+        self.checkpoint.create()
+        
+        if self.restart:
+            self.checkpoint.reset()
+            return
+        
+        if len(self.inflight) == 0:
+            return
+        
+        for c in self.inflight:
+            self.logger.warning('Time partition from {start} to {end} was left {status} by last run{rows}{tokens}'.format(
+                    start=c['partition_start'],
+                    end=c['partition_end'],
+                    status=c['status'],
+                    rows=f", with {c['rows']} rows" if c['rows'] is not None else '',
+                    tokens=f", last page tokens {c['page_tokens']}" if c['page_tokens'] not in [None, '{}'] else ''
+                )
+            )
+        
+        resumeFrom = GACheckpoint.utc((self.correctionUntil or self.effectiveStart) + datetime.timedelta(minutes=1))
+        
+        timeColName = self.syncCursorColumn()
+        if not self.upsert and timeColName and self.hasTable(self.targetTable):
+            table = sqlalchemy.Table(self.targetTable, sqlalchemy.MetaData(), sqlalchemy.Column(timeColName, sqlalchemy.DateTime))
+            
+            # Minute precision, as in filterTimeStartToEnd()
+            with self.db.begin() as connection:
+                deleted = connection.execute(
+                    table.delete().where(table.c[timeColName] >= pd.Timestamp(resumeFrom).floor('min').to_pydatetime())
+                ).rowcount
+            
+            self.logger.info(f'Deleted {deleted} rows of {self.targetTable} written by unfinished time partitions')
+        
+        self.checkpoint.reset(after=resumeFrom)
+
+
+
+
+    def migrateTable(self, chunkSize=100000):
+        """
+        Convert `targetTable` as written by GAAPItoDB up to version 0.6, with 16 hex
+        chars text `__row_id` and no primary key, to the layout of tableSchema(),
+        keeping the same row IDs. Only possible with `rowIDHash='shake_256'`.
+        
+        Data is read once, ordered by row ID, and copied in chunks of `chunkSize`
+        rows; repeated rows are dropped. Tables are swapped only if the new one has
+        as many rows as distinct row IDs of the original, which is then kept as
+        `{targetTable}__hex` for you to drop when satisfied.
+        """
+        if self.rowIDHash != 'shake_256':
+            raise ValueError("Tables with hex row IDs can be migrated only with rowIDHash='shake_256', because other IDs can't be calculated back from stored data")
+        
+        if not hasattr(self, 'db'):
+            self.connectDB()
+        
+        quote = self.db.dialect.identifier_preparer.quote
+        
+        migrating = f'{self.targetTable}__migrating'
+        backup = f'{self.targetTable}__hex'
+        
+        table = self.tableSchema(migrating)
+        if self.hasTable(migrating):
+            table.drop(self.db)
+        
+        # Index is created after the swap, with the name of the final table and
+        # without slowing down the copy
+        with self.db.begin() as connection:
+            connection.execute(sqlalchemy.schema.CreateTable(table))
+        
+        dates = [c.name for c in table.columns if isinstance(c.type, sqlalchemy.DateTime)]
+        
+        self.logger.info(f'Migrating {self.targetTable} to new layout in {migrating}...')
+        
+        # Old tables have no index on __row_id, so they are sorted only once, by a
+        # single query streamed in chunks, instead of once per page
+        query = sqlalchemy.text('SELECT * FROM {table} ORDER BY {id}'.format(
+                table=quote(self.targetTable),
+                id=quote('__row_id')
+            )
+        )
+        
+        lastRowID = None
+        migrated = 0
+        with self.db.connect() as reader:
+            # SQLite locks the database while a query is read, so only the same
+            # connection can write; other databases write with another one, since
+            # commits would close the streaming cursor
+            writer = reader if self.db.dialect.name == 'sqlite' else self.db.connect()
+            
+            try:
+                chunks = pd.read_sql(
+                    query,
+                    reader.execution_options(stream_results=True),
+                    parse_dates=dates,
+                    chunksize=chunkSize
+                )
+                
+                for chunk in chunks:
+                    chunk = chunk.drop_duplicates(subset='__row_id')
+                    
+                    # Repeated rows may be split between chunks
+                    chunk = chunk[chunk['__row_id'] != lastRowID]
+                    
+                    if chunk.shape[0] == 0:
+                        continue
+                    
+                    lastRowID = chunk['__row_id'].iloc[-1]
+                    
+                    chunk['__row_id'] = [bytes.fromhex(i) for i in chunk['__row_id']]
+                    
+                    chunk[[c.name for c in table.columns if c.name in chunk.columns]].to_sql(
+                        migrating,
+                        if_exists='append',
+                        index=False,
+                        con=writer
+                    )
+                    
+                    migrated += chunk.shape[0]
+                    self.logger.debug(f'Migrated {migrated} rows so far')
+            finally:
+                if writer is not reader:
+                    writer.close()
+        
+        with self.db.connect() as connection:
+            expected = connection.execute(
+                sqlalchemy.text('SELECT COUNT(DISTINCT {id}) FROM {table}'.format(
+                        table=quote(self.targetTable),
+                        id=quote('__row_id')
+                    )
+                )
+            ).scalar()
+            
+            copied = connection.execute(
+                sqlalchemy.text(f'SELECT COUNT(*) FROM {quote(migrating)}')
+            ).scalar()
+        
+        if copied != expected:
+            raise ValueError(f'{migrating} has {copied} rows but {self.targetTable} has {expected} distinct row IDs; {self.targetTable} was left untouched')
+        
+        with self.db.begin() as connection:
+            connection.execute(sqlalchemy.text(f'ALTER TABLE {quote(self.targetTable)} RENAME TO {quote(backup)}'))
+            connection.execute(sqlalchemy.text(f'ALTER TABLE {quote(migrating)} RENAME TO {quote(self.targetTable)}'))
+            
+            for index in self.tableSchema().indexes:
+                index.create(connection)
+        
+        self.logger.info(f'Migrated {migrated} rows of {self.targetTable}; original table is now {backup}')
+
     
     def effectiveStartDate(self):
         """
@@ -784,12 +2194,33 @@ class GAAPItoDB(object):
         If `incremental` is True, use start date as the last date and time that appears in the `targetTable`, column of dimension set with `synccursor`.
         
         If `restart` is True, ignore `incremental` and use `start` date.
+        
+        If checkpoints are kept in `checkpointTable`, the end of the last committed
+        time partition is used instead, found with a single indexed lookup, and
+        partitions left unfinished by a crashed run are in `self.inflight`.
+        
+        If `correctionWindow` is set, start that much earlier, and keep in
+        `self.correctionUntil` where data not yet synced begins.
         """
         self.effectiveStart = self.start
         
+        resumeFrom = None
+        if not self.restart and self.incremental and self.checkpoint is not None:
+            resumeFrom, self.inflight = self.checkpoint.resumePoint()
+        
         if self.restart:
             # Ignore lastest data in database and start over
             self.lastSync = None
+        elif resumeFrom is not None:
+            # Filters exclude the minute of effectiveStart, so the minute before next
+            # time partition makes the same query the crashed run made
+            self.effectiveStart = (
+                pd.Timestamp(resumeFrom).tz_localize('UTC').tz_convert(self.gaTimezone) +
+                pd.Timedelta(microseconds=1) -
+                pd.Timedelta(minutes=1)
+            ).to_pydatetime()
+            
+            self.logger.info(f'Resuming from checkpoint after {self.effectiveStart}')
         else:
             if self.incremental:
                 # Effective start date is the last date of the `synccursor` column in DB, so find its value.
@@ -802,25 +2233,249 @@ class GAAPItoDB(object):
                         break
 
                 # Check if table exists and get the top date value
-                if self.db.dialect.has_table(self.db, self.targetTable):
-                    lastSyncUTC = pd.read_sql(f"SELECT max(`{timeColName}`) as `{timeColName}` FROM {self.targetTable};", self.db)
+                if self.hasTable(self.targetTable):
+                    quote = self.db.dialect.identifier_preparer.quote
+                    lastSyncUTC = pd.read_sql(f"SELECT max({quote(timeColName)}) as {quote(timeColName)} FROM {quote(self.targetTable)}", self.db)
                     if lastSyncUTC[timeColName][0] is not None:
                         # Time on DB is always UTC, so declare it as UTC, then convert to GA View's timezone and use it as time of last record.
-                        self.effectiveStart = lastSyncUTC[timeColName][0].tz_localize('UTC').tz_convert(self.gaTimezone).to_pydatetime()
+                        # Some DBs, as SQLite, return it as text.
+                        self.effectiveStart = pd.Timestamp(lastSyncUTC[timeColName][0]).tz_localize('UTC').tz_convert(self.gaTimezone).to_pydatetime()
+        
+        self.correctionUntil = None
+        if self.correctionWindow and self.incremental and not self.restart and self.effectiveStart > self.start:
+            # GA is still processing hits of last synced hours, so get them again
+            self.correctionUntil = self.effectiveStart
+            self.effectiveStart = max(self.start, self.effectiveStart - self.correctionWindow)
+            
+            self.logger.info(f'Fetching again data from {self.effectiveStart} to {self.correctionUntil} to correct it')
 
         return self.effectiveStart
 
     
     
-    def writeDB(self, rawReport):
+    def reportForDB(self, rawReport):
+        """
+        Return only the columns of `rawReport` that go to DB, without rows repeated
+        by transformations and with `__row_id` as stored in managed tables.
+        """
         report=rawReport[self.getFinalReportColumns()]
-        timeColName=None
+        
+        if self.managedTable:
+            # Rows repeated by transformations are the same row, and the primary key takes it only once
+            duplicated = report.index.duplicated()
+            if duplicated.any():
+                self.logger.debug(f'Dropping {duplicated.sum()} repeated rows')
+                report = report[~duplicated]
+            
+            if self.rowIDHash == 'shake_256':
+                report.index = pd.Index([bytes.fromhex(i) for i in report.index], name='__row_id')
+        
+        return report
+    
+    
+    
+    def correctionDiff(self, report):
+        """
+        Return rows of final `report`, indexed by `__row_id` as made by
+        makePrimaryKey(), that are not in `targetTable` or are there with other
+        values. Rows stored in the time range of `report` are read back and both
+        sides are compared as the text GATextLoader would write for them, so
+        differences of types returned by the database don't count as changes.
+        
+        Fresh values are first typed as the columns of tableSchema() they are
+        written to, as spawn columns that are text in memory and BIGINT in the
+        table, where “0516” is stored as 516.
+        """
+        timeColName = self.syncCursorColumn()
+        columns = self.getFinalReportColumns()
+        
+        if report.shape[0] == 0:
+            return report
+        
+        fresh = report[columns]
+        fresh = fresh[~fresh.index.duplicated()]
+        
+        table = self.tableSchema()
+        
+        stored = pd.read_sql(
+            sqlalchemy.select(table)
+            .where(table.c[timeColName] >= fresh[timeColName].min().to_pydatetime())
+            .where(table.c[timeColName] <= fresh[timeColName].max().to_pydatetime()),
+            self.db,
+            parse_dates=[c.name for c in table.columns if isinstance(c.type, sqlalchemy.DateTime)]
+        )
+        
+        # Stored IDs as in report
+        if self.rowIDHash == 'shake_256':
+            stored.index = pd.Index([bytes(i).hex() for i in stored['__row_id']])
+        else:
+            stored.index = pd.Index(stored['__row_id'].astype(np.int64))
+        
+        common = fresh.index.intersection(stored.index)
+        
+        text = GABulkLoaders.GATextLoader(self.db, self.targetTable)
+        
+        changed = np.zeros(len(common), dtype=bool)
+        for c in columns:
+            freshColumn = fresh[c].loc[common].reset_index(drop=True)
+            
+            if isinstance(table.c[c].type, sqlalchemy.Integer) and not pd.api.types.is_numeric_dtype(freshColumn.dtype):
+                freshColumn = pd.to_numeric(freshColumn, errors='raise')
+            elif isinstance(table.c[c].type, sqlalchemy.DateTime) and not pd.api.types.is_datetime64_any_dtype(freshColumn.dtype):
+                freshColumn = pd.to_datetime(freshColumn)
+            
+            changed |= (
+                text.textColumn(freshColumn) !=
+                text.textColumn(stored[c].loc[common].reset_index(drop=True))
+            )
+        
+        inserted = ~report.index.isin(stored.index)
+        keep = inserted | report.index.isin(common[changed])
+        
+        counts = {
+            'inserted':  int((~fresh.index.isin(stored.index)).sum()),
+            'changed':   int(changed.sum()),
+            'unchanged': int(len(common) - changed.sum())
+        }
+        
+        for kind, rows in counts.items():
+            self.runMetrics.inc('correction_rows', rows, kind=kind, processor=self.processor)
+        
+        self.logger.info('Correction of {start}➔{end}: {inserted} new rows, {changed} changed, {unchanged} unchanged'.format(
+                start=fresh[timeColName].min(),
+                end=fresh[timeColName].max(),
+                **counts
+            )
+        )
+        
+        return report[keep]
+    
+    
+    
+    def arrowReport(self, rawReport):
+        """
+        Convert final `rawReport` to an Arrow table with `__row_id` as its first
+        column, ready to be queued for writeArrowDB(). Strings are copied once to
+        Arrow buffers, usually a lot smaller than pandas' Python objects, and the
+        DataFrame can be freed right away.
+        """
+        return pyarrow.Table.from_pandas(
+            self.reportForDB(rawReport).reset_index(),
+            preserve_index=False
+        )
+    
+    
+    
+    def chunkBounds(self, report, size=None):
+        """
+        Return (start, stop) row positions of contiguous chunks of `report`, a
+        DataFrame or Arrow table sorted by the `synccursor` column, to be written
+        to DB in one transaction each.
+        
+        Chunks have `dbWriteChunkRows` rows, or about `dbWriteChunkBytes` bytes of
+        the `size` of `report`, or else they are `dbWritePartitions` chunks of the
+        same number of rows. Cuts are moved back with searchsorted() to the first
+        row of their time, so rows of the same time never span 2 chunks.
+        """
+        rows = len(report)
+        
+        if self.dbWriteChunkRows:
+            chunkRows = self.dbWriteChunkRows
+        elif self.dbWriteChunkBytes:
+            if size is None:
+                size = GAWriteQueue.reportSize(report)
+            chunkRows = int(self.dbWriteChunkBytes * rows // max(1, size))
+        elif self.dbWritePartitions:
+            chunkRows = -(-rows // self.dbWritePartitions)  # ceil
+        else:
+            chunkRows = rows
+        
+        chunkRows = max(1, chunkRows)
+        
+        timeColName = self.syncCursorColumn()
+        times = report[timeColName].to_numpy() if timeColName else None
+        
+        bounds = [0]
+        while bounds[-1] < rows:
+            cut = bounds[-1] + chunkRows
+            
+            if cut < rows and times is not None:
+                aligned = np.searchsorted(times, times[cut], side='left')
+                if aligned <= bounds[-1]:
+                    # A single time has more rows than a chunk, so take all of them
+                    aligned = np.searchsorted(times, times[cut], side='right')
+                cut = int(aligned)
+            
+            bounds.append(min(cut, rows))
+        
+        return list(zip(bounds[:-1], bounds[1:]))
+    
+    
+    
+    def writeArrowDB(self, table, size=None):
+        """
+        Write an Arrow `table` made by arrowReport() to DB in the chunks of
+        chunkBounds(). Slices share memory with `table`, so only the slice being
+        written is converted to pandas.
+        """
+        timeColName=self.syncCursorColumn()
+        
+        if table.num_rows==0:
+            self.logger.debug('Report has no data, nothing to write.')
+            return
+        
+        if self.restart:
+            ifexists='replace'
+            self.restart = False # Switch to false so we keep appending in next time partition
+        elif self.correcting:
+            # Only new and changed rows, some already in table
+            ifexists='upsert'
+        else:
+            ifexists='append'
+        
+        if not self.update:
+            self.logger.warning('Didn’t write ({}) {} datapoints of {} columns'.format(
+                    ifexists,
+                    table.num_rows,
+                    table.num_columns
+                )
+            )
+            return
+        
+        for start, stop in self.chunkBounds(table, size):
+            chunk = table.slice(start, stop - start)
+            
+            self.writeChunk(chunk, ifexists, 'rows {}→{}'.format(start, stop))
+            
+            # Following slices must not replace this one
+            if ifexists=='replace':
+                ifexists='append'
+            
+            if self.logger.isEnabledFor(logging.DEBUG) and timeColName:
+                self.logger.debug('Dispatched {} datapoints of {} columns, ranging from {} to {}'.format(
+                        chunk.num_rows,
+                        chunk.num_columns,
+                        chunk[timeColName][0],
+                        chunk[timeColName][-1]
+                    )
+                )
+    
+    
+    
+    def writeDB(self, rawReport, size=None):
+        """
+        Write final `rawReport`, of `size` bytes in RAM, to DB in the chunks of
+        chunkBounds(). Each chunk is a slice of rows, copied only once to get its
+        `__row_id` index as a column.
+        """
+        if self.arrow:
+            # Already converted by arrowReport()
+            return self.writeArrowDB(rawReport, size)
+        
+        report=self.reportForDB(rawReport)
         
         # Get name of column used as sync parameter
-        for d in self.dimensions:
-            if 'synccursor' in d and d['synccursor']:
-                timeColName=d['title']
-                break
+        timeColName=self.syncCursorColumn()
 
         if report.shape[0]==0:
             self.logger.debug('Report has no data, nothing to write.')
@@ -831,70 +2486,32 @@ class GAAPItoDB(object):
         if self.restart:
             ifexists='replace'
             self.restart = False # Switch to false so we keep appending in next time partition
+        elif self.correcting:
+            # Only new and changed rows, some already in table
+            ifexists='upsert'
         else:
             ifexists='append'
         
         if self.update:
-            if self.dbWritePartitions and timeColName:
-                partitions=list(report[timeColName].value_counts(bins=self.dbWritePartitions).index.sort_values())
-                for interval in partitions:
-                    if interval.closed_left:
-                        filter = report[timeColName] >= interval.left
-                    else:
-                        filter = report[timeColName] > interval.left
-
-                    if interval.closed_right:
-                        filter &= report[timeColName] <= interval.right
-                    else:
-                        filter &= report[timeColName] < interval.right
-                    
-                    try:
-                        report[filter].reset_index().to_sql(
-                            self.targetTable,
-                            if_exists=ifexists,
-                            index=False,
-                            con=self.db
-                        )
-                    except sqlalchemy.exc.OperationalError as e:
-                        targetFile='bad file for interval {}→{}.csv'.format(interval.left,interval.right)
-                        self.logger.error('Failed to write data partition to DB. Dumping data to CSV for you to check')
-                        report[filter].reset_index().to_csv(targetFile)
-                        self.logger.exception(e)
-                        os._exit(os.EX_DATAERR)
-                    
-                    self.logger.debug('Wrote ({}) {} datapoints of {} columns, ranging from {} to {}'.format(
-                            ifexists,
-                            report[filter].shape[0],
-                            report[filter].shape[1],
-                            report[filter][timeColName].min(),
-                            report[filter][timeColName].max()
-                        )
-                    )
-
-                    
-            else:
-                # Writing in one block, no partitioning (dangerous, may be too much information to your DB)
-                # Use pandas.to_sql() to add final report lines to the database table
-                try:
-                    report.reset_index().to_sql(
-                        self.targetTable,
-                        if_exists=ifexists,
-                        index=False,
-                        con=self.db
-                    )
-                except sqlalchemy.exc.OperationalError as e:
-                    targetFile='bad file for interval {}→{}.csv'.format(report[timeColName].min(),report[timeColName].max())
-                    self.logger.error('Failed to write data to DB. Dumping data to CSV for you to check')
-                    report.reset_index().to_csv(targetFile)
-                    self.logger.exception(e)
-                    os._exit(os.EX_DATAERR)
-            
-                self.logger.debug('Wrote ({}) {} datapoints of {} columns, ranging from {} to {}'.format(
+            for start, stop in self.chunkBounds(report, size):
+                chunk = report.iloc[start:stop]
+                
+                if timeColName:
+                    description = 'interval {}→{}'.format(chunk[timeColName].iloc[0], chunk[timeColName].iloc[-1])
+                else:
+                    description = 'rows {}→{}'.format(start, stop)
+                
+                self.writeChunk(chunk.reset_index(), ifexists, description)
+                
+                # Following chunks must not replace this one
+                if ifexists=='replace':
+                    ifexists='append'
+                
+                self.logger.debug('Dispatched ({}) {} datapoints of {} columns, {}'.format(
                         ifexists,
-                        report.shape[0],
-                        report.shape[1],
-                        report[timeColName].min(),
-                        report[timeColName].max()
+                        chunk.shape[0],
+                        chunk.shape[1],
+                        description
                     )
                 )
         else:
@@ -909,33 +2526,257 @@ class GAAPItoDB(object):
 
 
             
+    def writeChunk(self, chunk, ifexists, description, partition=None):
+        """
+        Write `chunk`, a DataFrame or an Arrow slice, to DB right away or by the pool
+        of `dbWriters` threads. Chunks are committed in the order they are passed.
+        
+        If `partition` is a (time partition, rows) tuple, it is checkpointed as
+        committed in the same transaction. `chunk` may be None to only do that.
+        """
+        sequence = self.chunkSequence
+        self.chunkSequence += 1
+        
+        if chunk is not None:
+            self.partitionRows += len(chunk)
+        
+        if self.chunkWriter is None or (chunk is not None and self.loader.creates(ifexists)):
+            # Nothing else can be written while the table is created
+            self.waitChunks()
+            self.commitChunk(sequence, chunk, ifexists, description, partition)
+        else:
+            self.chunkFutures.append(
+                self.chunkWriter.submit(self.commitChunk, sequence, chunk, ifexists, description, partition)
+            )
+    
+    
+    
+    def commitChunk(self, sequence, chunk, ifexists, description, partition=None):
+        """
+        Write `chunk` in a transaction of its own, but commit it only after the
+        chunk passed before it. Chunks are sorted by the `synccursor` column, so a
+        crash never leaves rows committed past others that weren't, and
+        effectiveStartDate() always resumes from the right place.
+        """
+        if chunk is None or isinstance(chunk, pd.DataFrame):
+            df = chunk
+        else:
+            df = chunk.to_pandas()
+        
+        try:
+            with self.runMetrics.timer('db_write_seconds', processor=self.processor):
+                with self.db.connect() as connection:
+                    transaction = connection.begin()
+                    
+                    if df is not None:
+                        self.loadChunk(df, ifexists, connection)
+                    
+                    with self.commitCondition:
+                        self.commitCondition.wait_for(lambda: self.commitTurn == sequence)
+                        
+                        if partition is not None:
+                            self.checkpoint.committed(*partition, connection)
+                        
+                        transaction.commit()
+                        self.commitTurn += 1
+                        self.commitCondition.notify_all()
+        except sqlalchemy.exc.OperationalError as e:
+            self.logger.error('Failed to write data partition to DB. Dumping data to CSV for you to check')
+            if df is not None:
+                df.to_csv('bad file for {}.csv'.format(description))
+            self.logger.exception(e)
+            os._exit(os.EX_DATAERR)
+        except Exception as e:
+            # Following chunks would wait forever for this one to be committed
+            self.logger.exception(f'Failed to write {description} to DB: {e}')
+            os._exit(os.EX_DATAERR)
+        
+        if partition is not None:
+            # Its pages won't be needed anymore
+            self.checkpoint.discardSpool(partition[0])
+        
+        if df is None:
+            return
+        
+        self.runMetrics.inc('db_write_rows', df.shape[0], processor=self.processor)
+        
+        self.logger.debug(f'Committed {df.shape[0]} datapoints of {description}')
+    
+    
+    
+    def loadChunk(self, df, ifexists, connection):
+        """
+        Write `df` in the transaction of `connection`: straight to `targetTable`, or
+        to the staging table and then merged into `targetTable` if `upsert` is set
+        or `ifexists` is 'upsert'.
+        """
+        if not self.upsert and ifexists != 'upsert':
+            return self.loader.load(df, ifexists, connection)
+        
+        connection.execute(sqlalchemy.schema.CreateTable(self.staging, if_not_exists=True))
+        
+        self.stagingLoader.load(df, 'append', connection)
+        
+        merged = connection.execute(self.merge).rowcount
+        
+        connection.execute(self.staging.delete())
+        
+        self.logger.debug(f'Merged {df.shape[0]} rows into {self.targetTable} ({merged} affected)')
+    
+    
+    
+    def waitChunks(self):
+        """
+        Block until all chunks dispatched to the pool of DB writers were committed.
+        """
+        for f in self.chunkFutures:
+            f.result()
+        
+        self.chunkFutures = []
+    
+    
+    
     def databaseWriter(self):
+        # Chunks of the report being written, to be committed by chunkWriter threads
+        self.chunkFutures = []
+        self.chunkSequence = 0
+        self.commitTurn = 0
+        self.commitCondition = threading.Condition()
+        
+        # Chunk futures of reports not yet committed
+        inflight = collections.deque()
+        
+        self.chunkWriter = None
+        if self.dbWriters > 1:
+            self.chunkWriter = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.dbWriters,
+                thread_name_prefix=f'{self.processor}-dbwriter'
+            )
+        
         while True:
             dataToWrite = self.dbWriteQueue.get()
             
             if dataToWrite is None:
                 self.logger.debug('End of DB writing thread from a None item.')
+                
+                while len(inflight) > 0:
+                    self.waitReport(inflight.popleft())
+                
                 self.dbWriteQueue.task_done()
                 break
                 
             timePartitionName = dataToWrite[0]
             rawReport = dataToWrite[1]
+            size = dataToWrite[2]
+            del dataToWrite
             
             self.logger.debug('Thread that writes data for {}'.format(timePartitionName))
             
-            self.writeDB(rawReport)
+            p = self.queuedPartitions.pop(timePartitionName, None)
+            self.partitionRows = 0
+            
+            self.correcting = (
+                p is not None and
+                self.correctionUntil is not None and
+                p[0] <= self.correctionUntil
+            )
+            
+            if len(rawReport) > 0:
+                self.writeDB(rawReport, size)
+            
+            if self.checkpoint is not None and p is not None:
+                # Last partition ends with the sync, so next run resumes there and
+                # not after the end of its day, which may have more data by then.
+                # A partition starting right at the end is empty and ends where it starts.
+                p = [p[0], max(p[0], min(p[1], self.end - datetime.timedelta(microseconds=1)))]
+                self.writeChunk(None, 'append', f'checkpoint of {timePartitionName}', partition=(p, self.partitionRows))
+            
+            # Its bytes are released as soon as its last chunk is committed, not when
+            # the next report is taken, which may be waiting for these very bytes
+            self.releaseReport(self.chunkFutures, size)
+            
+            inflight.append(self.chunkFutures)
+            self.chunkFutures = []
             
             # Free some memory
             del rawReport
             
-            self.dbWriteQueue.task_done()
+            # Start writing next report while last chunks of this one are written,
+            # but not more than that, since reports are held in RAM until committed
+            while len(inflight) > 1:
+                self.waitReport(inflight.popleft())
+        
+        if self.chunkWriter is not None:
+            self.chunkWriter.shutdown()
             
         self.logger.debug('End of DB writing thread.')
+    
+    
+    
+    def releaseReport(self, futures, size):
+        """
+        Release memory of a report from the DB write queue as soon as all its chunks,
+        committed by `futures`, are, without waiting for them. Chunks written right
+        away have no futures, so the report is released now.
+        """
+        pending = [len(futures)]
+        lock = threading.Lock()
+        
+        def committed(future=None):
+            with lock:
+                pending[0] -= 1
+                last = pending[0] <= 0
+            
+            if not last:
+                return
+            
+            self.runMetrics.inc('db_write_bytes', size, processor=self.processor)
+            
+            # Let getReportData() queue more reports
+            self.dbWriteQueue.release(size)
+            
+            self.dbWriteQueue.task_done()
+        
+        if len(futures) == 0:
+            return committed()
+        
+        for f in futures:
+            # Called right away if already done
+            f.add_done_callback(committed)
+    
+    
+    
+    def waitReport(self, futures):
+        """
+        Block until all chunks of a report, as `futures`, were committed.
+        """
+        for f in futures:
+            f.result()
 
                 
     def sync(self):
         self.connectDB()
+        
+        if self.checkpointTable:
+            self.checkpoint = GACheckpoint(
+                self.db,
+                self.checkpointTable,
+                self.processor,
+                self.gaView,
+                self.targetTable,
+                spoolDirectory=self.checkpointSpool
+            )
+        
         self.effectiveStartDate()   # Sets self.effectiveStart
+        self.prepareCheckpoint()
+        self.prepareTable()
+        self.loader = self.makeBulkLoader()
+        self.prepareUpsert()
+        
+        if self.dimensionStats == 'measure':
+            self.measureDimensionStats()
+        
+        self.planReport()
         
         # Create thread to write DataFrames to DB
         self.writer = threading.Thread(target=self.databaseWriter)
@@ -945,25 +2786,87 @@ class GAAPItoDB(object):
             # Start talking to GA and get report data
             self.getReportData()
         except Exception as e:
-            self.logger.exception('GA affairs failed.' + e)
+            self.logRetryStats()
+            self.logger.exception(f'GA affairs failed: {e}')
             os._exit(1)
+        
+        self.logRetryStats()
 
-        # Block until there is nothing on the queue
-        if not self.dbWriteQueue.empty():
-            self.dbWriteQueue.join()
+        # getReportData() queued the end of work signal, so wait for the DB writer
+        # to commit everything before reporting on it
+        self.writer.join()
+        
+        self.logWriteQueueStats()
+        
+        self.runMetrics.export()
 
 
-    def TransformRegexReplace(self,df,dimension):
-        if 'keeporiginal' in dimension:
-            # Keep original data in a new column with suffix "__org"
-            orgname = dimension['title'] + "__org"
-            df[orgname] = df[dimension['title']]
+    def logWriteQueueStats(self):
+        q=self.dbWriteQueue
+        
+        if q.budget is not None:
+            self.logger.info('DB write queue: peak of {peak:.1f} MiB of {budget:.1f} MiB budget, {blocked:.1f}s waiting for DB writer, {spilled} reports spilled to disk'.format(
+                    peak=q.peakBytes/1024**2,
+                    budget=q.budget/1024**2,
+                    blocked=q.blockedTime,
+                    spilled=q.spilled
+                )
+            )
+
+
+
+    def logRetryStats(self):
+        if self.cache is not None:
+            self.logger.info(f'GA response cache: {self.cache.hits} hits, {self.cache.misses} misses')
+        
+        stats=self.retryPolicy.stats.get(self.processor)
+        
+        if stats:
+            self.logger.info('GA API: {calls} successful calls, {retries} retries, {wait:.1f}s waiting for retries, errors: {errors}'.format(
+                    calls=stats['calls'],
+                    retries=stats['retries'],
+                    wait=stats['wait'],
+                    errors=stats['errors']
+                )
+            )
 
+
+    def compileTransforms(self):
+        """
+        Prepare `self.transforms`, the transformation of each dimension that has
+        one, by title. Built-in transformations named in `transform`, as
+        'regexreplace' and 'explodeandsplit' of GATransforms, are compiled here,
+        once per sync. Custom functions are used as they are.
+        """
+        self.transforms = {}
+        
+        for d in self.dimensions:
+            if 'transform' not in d:
+                continue
+            
+            if isinstance(d['transform'], str):
+                if d['transform'] not in GATransforms.transforms:
+                    raise ValueError(f"Unknown transform '{d['transform']}' for {d['title']}; built-in ones are {list(GATransforms.transforms.keys())}")
+                
+                self.transforms[d['title']] = GATransforms.transforms[d['transform']](d, self)
+            elif d['transform'] == self.TransformRegexReplace:
+                # Same as 'regexreplace', kept for older dimension structures
+                self.transforms[d['title']] = GARegexReplace(d, self)
+            else:
+                self.transforms[d['title']] = d['transform']
+
+
+
+
+    def TransformRegexReplace(self,df,dimension):
+        """
+        Same as `'transform': 'regexreplace'`, which compiles patterns only once per sync.
+        """
         self.logger.debug(f"TransformRegexReplace: transforming {dimension['title']}")
         try:
-            df[dimension['title']]=df[[dimension['title']]].replace(regex=dimension['transformparams'])
+            df = GARegexReplace(dimension, self)(df)
         except Exception as e:
-            self.logger.exception("TransformRegexReplace: unrecoverable error in custom transformation: " + e)
+            self.logger.exception(f"TransformRegexReplace: unrecoverable error in custom transformation: {e}")
             os._exit(os.EX_DATAERR)
 
         self.logger.debug(f"TransformRegexReplace: end of custom transformation.")
@@ -47,7 +47,34 @@ class GABradescoSegurosToDB(GAAPItoDB):
                         targetTable=None,
                         update=True,
                         processorName=None,
-                        restart=False
+                        restart=False,
+                        fetchWorkers=1,
+                        rateLimiter=None,
+                        subreportsPerCall=5,
+                        dimensionStats=None,
+                        retryPolicy=None,
+                        adaptivePartitions=False,
+                        mergeRowTarget=None,
+                        cache=None,
+                        pageWorkers=1,
+                        gaServiceFactory=None,
+                        rowIDHash='shake_256',
+                        manageTable=True,
+                        dstAmbiguous=False,
+                        dstNonexistent='shift_forward',
+                        categoricalRatio=None,
+                        dbWriteQueueBudget=1024**3,
+                        dbWriteQueueSpill=None,
+                        runMetrics=None,
+                        arrow=False,
+                        bulkLoader=None,
+                        dbWriters=1,
+                        upsert=False,
+                        checkpointTable='gaapitodb_checkpoints',
+                        checkpointSpool=None,
+                        dbWriteChunkRows=None,
+                        dbWriteChunkBytes=None,
+                        correctionWindow=None
         ):
         super().__init__(
             gaView=gaView,
@@ -69,74 +96,41 @@ class GABradescoSegurosToDB(GAAPItoDB):
             targetTable=targetTable,
             update=update,
             processorName=processorName,
-            restart=restart
+            restart=restart,
+            fetchWorkers=fetchWorkers,
+            rateLimiter=rateLimiter,
+            subreportsPerCall=subreportsPerCall,
+            dimensionStats=dimensionStats,
+            retryPolicy=retryPolicy,
+            adaptivePartitions=adaptivePartitions,
+            mergeRowTarget=mergeRowTarget,
+            cache=cache,
+            pageWorkers=pageWorkers,
+            gaServiceFactory=gaServiceFactory,
+            rowIDHash=rowIDHash,
+            manageTable=manageTable,
+            dstAmbiguous=dstAmbiguous,
+            dstNonexistent=dstNonexistent,
+            categoricalRatio=categoricalRatio,
+            dbWriteQueueBudget=dbWriteQueueBudget,
+            dbWriteQueueSpill=dbWriteQueueSpill,
+            runMetrics=runMetrics,
+            arrow=arrow,
+            bulkLoader=bulkLoader,
+            dbWriters=dbWriters,
+            upsert=upsert,
+            checkpointTable=checkpointTable,
+            checkpointSpool=checkpointSpool,
+            dbWriteChunkRows=dbWriteChunkRows,
+            dbWriteChunkBytes=dbWriteChunkBytes,
+            correctionWindow=correctionWindow
         )
 
 
 
-    # Define custom transformation methods specific to Bradesco Seguros's case
-
-
-    def BSExplodeAndSplit(self, df, dimension):
-        if 'keeporiginal' in dimension:
-            # Keep original data in a new column with suffix "__org"
-            orgname = dimension['title'] + "__org"
-            df[orgname] = df[dimension['title']]
-
-        for s in dimension['transformparams']['explodeseparators']:    
-    
-            self.logger.debug(f"BSExplodeAndSplit: exploding {dimension['title']} on {s}")
-        
-            try:
-                # convert values of 'column' as "a-1,b-2,c-3" -> ["a-1","b-2","c-3"]
-                df[dimension['title']] = df[dimension['title']].str.split(pat = s)
-        
-                # convert ["a-1","b-2","c-3"] into multiple rows duplicating values of other columns
-                df = df.explode(dimension['title'])
-            except Exception as e:
-                self.logger.error("BSExplodeAndSplit: unrecoverable error in custom transformation: " + e)
-                os._exit(1)    
-
-
-
-        # Last separator will split into multiple columns
-        try:
-            self.logger.debug(f"BSExplodeAndSplit: splitting {dimension['title']} on {dimension['transformparams']['splitseparators'][0]}")    
-            df[dimension['transformspawncolumns']] = df[dimension['title']].str.split(dimension['transformparams']['splitseparators'][0], expand=True)
-        except Exception as e:
-            self.logger.error("BSExplodeAndSplit: unrecoverable error in custom transformation: " + e)
-            os._exit(1)    
-    
-        # Now convert types
-    
-        if 'transformspawncolumnstype' in dimension and 'transformspawncolumns' in dimension:
-            for i in range(len(dimension['transformspawncolumns'])):
-                self.logger.debug(f"BSExplodeAndSplit: log something 2")
-                if dimension['transformspawncolumnstype'][i]:
-                    if dimension['transformspawncolumnstype'][i] == 'int':
-                        df[dimension['transformspawncolumns'][i]] = pd.to_numeric(df[dimension['transformspawncolumns'][i]],errors='raise')
-                    if dimension['transformspawncolumnstype'][i] == 'datetime':
-                        df[dimension['transformspawncolumns'][i]] = pd.to_datetime(df[dimension['transformspawncolumns'][i]])
-
-                        # Add GA View's time zone just to convert time to UTC right away
-                        df[dimension['transformspawncolumns'][i]]=df[dimension['transformspawncolumns'][i]].apply(
-                            lambda x: x.tz_localize(self.gaTimezone).tz_convert(None)
-                        )
-
-
-                        
-                        
-        self.logger.debug(f"BSExplodeAndSplit: end of custom transformation.")
-        return df
-
-
-
-
-
-
-
-
-
+    # Custom transformation methods specific to Bradesco Seguros's case would be defined
+    # here. Splitting of “sucursal-apólice” lists and cleanup of texts are done by
+    # GAAPItoDB's built-in 'explodeandsplit' and 'regexreplace' transformations.
 
 
 
@@ -165,7 +159,34 @@ class GABradescoSegurosParcelasAtrasadasClicadasToDB(GABradescoSegurosToDB):
                         targetTable=None,
                         update=True,
                         processorName=None,
-                        restart=False
+                        restart=False,
+                        fetchWorkers=1,
+                        rateLimiter=None,
+                        subreportsPerCall=5,
+                        dimensionStats=None,
+                        retryPolicy=None,
+                        adaptivePartitions=False,
+                        mergeRowTarget=None,
+                        cache=None,
+                        pageWorkers=1,
+                        gaServiceFactory=None,
+                        rowIDHash='shake_256',
+                        manageTable=True,
+                        dstAmbiguous=False,
+                        dstNonexistent='shift_forward',
+                        categoricalRatio=None,
+                        dbWriteQueueBudget=1024**3,
+                        dbWriteQueueSpill=None,
+                        runMetrics=None,
+                        arrow=False,
+                        bulkLoader=None,
+                        dbWriters=1,
+                        upsert=False,
+                        checkpointTable='gaapitodb_checkpoints',
+                        checkpointSpool=None,
+                        dbWriteChunkRows=None,
+                        dbWriteChunkBytes=None,
+                        correctionWindow=None
         ):
         
         
@@ -219,7 +240,7 @@ class GABradescoSegurosParcelasAtrasadasClicadasToDB(GABradescoSegurosToDB):
                 'name': 'ga:dimension7',
                 'key': True,
                 'keeporiginal': True,
-                'transform': self.BSExplodeAndSplit, # (report, this_dimension)
+                'transform': 'explodeandsplit',
                 'transformspawncolumns': ['sucursal','apolice'],
                 'transformspawncolumnstypes': ['int','int'],
                 'transformparams': {
@@ -263,7 +284,7 @@ class GABradescoSegurosParcelasAtrasadasClicadasToDB(GABradescoSegurosToDB):
             {
                 'title': 'corretor_cpfcnpj_session_zeropad_sha256',
                 'name': 'ga:dimension20',
-                'transform': self.TransformRegexReplace, # (report, this_dimension)
+                'transform': 'regexreplace',
                 'transformparams': {
                 	# Get rid of useless strings, replace text by NULL
                     'Cookie não definido': None
@@ -272,7 +293,7 @@ class GABradescoSegurosParcelasAtrasadasClicadasToDB(GABradescoSegurosToDB):
             {
                 'title': 'corretor_cpfcnpj_session_sha256',
                 'name': 'ga:dimension17',
-                'transform': self.TransformRegexReplace, # (report, this_dimension)
+                'transform': 'regexreplace',
                 'transformparams': {
                 	# Get rid of useless strings, replace text by NULL
                     'Cookie não definido': None
@@ -281,7 +302,7 @@ class GABradescoSegurosParcelasAtrasadasClicadasToDB(GABradescoSegurosToDB):
             {
                 'title': 'corretor_cpfcnpj_hit_zeropad_sha256',
                 'name': 'ga:dimension19',
-                'transform': self.TransformRegexReplace, # (report, this_dimension)
+                'transform': 'regexreplace',
                 'transformparams': {
                 	# Get rid of useless strings, replace text by NULL
                     'Cookie não definido': None
@@ -290,7 +311,7 @@ class GABradescoSegurosParcelasAtrasadasClicadasToDB(GABradescoSegurosToDB):
             {
                 'title': 'corretor_cpfcnpj_hit_sha256',
                 'name': 'ga:dimension15',
-                'transform': self.TransformRegexReplace, # (report, this_dimension)
+                'transform': 'regexreplace',
                 'transformparams': {
                 	# Get rid of useless strings, replace text by NULL
                     'Cookie não definido': None
@@ -304,21 +325,25 @@ class GABradescoSegurosParcelasAtrasadasClicadasToDB(GABradescoSegurosToDB):
             {
                 'title': 'ramo',
                 'name': 'ga:dimension3',
+                'categorical': True,
             },
 
             {
                 'title': 'channel1',
                 'name': 'ga:dimension4',
+                'categorical': True,
             },
 
             {
                 'title': 'channel2',
                 'name': 'ga:dimension5',
+                'categorical': True,
             },
             
             {
                 'title': 'product',
                 'name': 'ga:dimension14',
+                'categorical': True,
             },
             
             {
@@ -329,16 +354,18 @@ class GABradescoSegurosParcelasAtrasadasClicadasToDB(GABradescoSegurosToDB):
             {
                 'title': 'event_category',
                 'name': 'ga:eventCategory',
+                'categorical': True,
             },
             
             {
                 'title': 'event_action',
                 'name': 'ga:eventAction',
+                'categorical': True,
             },
 			{
                 'title': 'event',
                 'name': 'ga:eventLabel',
-                'transform': self.TransformRegexReplace, # (report, this_dimension)
+                'transform': 'regexreplace',
                 'transformparams': {
                 	# Fix a wrong char that prevents data to be written on DB
                     r'Pesquise por Ano e n.mero do Pedido': 'Pesquise por Ano e número do Pedido',
@@ -369,7 +396,34 @@ class GABradescoSegurosParcelasAtrasadasClicadasToDB(GABradescoSegurosToDB):
             targetTable=targetTable,
             update=update,
             processorName=processorName,
-            restart=restart
+            restart=restart,
+            fetchWorkers=fetchWorkers,
+            rateLimiter=rateLimiter,
+            subreportsPerCall=subreportsPerCall,
+            dimensionStats=dimensionStats,
+            retryPolicy=retryPolicy,
+            adaptivePartitions=adaptivePartitions,
+            mergeRowTarget=mergeRowTarget,
+            cache=cache,
+            pageWorkers=pageWorkers,
+            gaServiceFactory=gaServiceFactory,
+            rowIDHash=rowIDHash,
+            manageTable=manageTable,
+            dstAmbiguous=dstAmbiguous,
+            dstNonexistent=dstNonexistent,
+            categoricalRatio=categoricalRatio,
+            dbWriteQueueBudget=dbWriteQueueBudget,
+            dbWriteQueueSpill=dbWriteQueueSpill,
+            runMetrics=runMetrics,
+            arrow=arrow,
+            bulkLoader=bulkLoader,
+            dbWriters=dbWriters,
+            upsert=upsert,
+            checkpointTable=checkpointTable,
+            checkpointSpool=checkpointSpool,
+            dbWriteChunkRows=dbWriteChunkRows,
+            dbWriteChunkBytes=dbWriteChunkBytes,
+            correctionWindow=correctionWindow
         )
 
 
@@ -401,7 +455,34 @@ class GABradescoSegurosCorretorVisitanteToDB(GABradescoSegurosToDB):
                         targetTable=None,
                         update=True,
                         processorName=None,
-                        restart=False
+                        restart=False,
+                        fetchWorkers=1,
+                        rateLimiter=None,
+                        subreportsPerCall=5,
+                        dimensionStats=None,
+                        retryPolicy=None,
+                        adaptivePartitions=False,
+                        mergeRowTarget=None,
+                        cache=None,
+                        pageWorkers=1,
+                        gaServiceFactory=None,
+                        rowIDHash='shake_256',
+                        manageTable=True,
+                        dstAmbiguous=False,
+                        dstNonexistent='shift_forward',
+                        categoricalRatio=None,
+                        dbWriteQueueBudget=1024**3,
+                        dbWriteQueueSpill=None,
+                        runMetrics=None,
+                        arrow=False,
+                        bulkLoader=None,
+                        dbWriters=1,
+                        upsert=False,
+                        checkpointTable='gaapitodb_checkpoints',
+                        checkpointSpool=None,
+                        dbWriteChunkRows=None,
+                        dbWriteChunkBytes=None,
+                        correctionWindow=None
         ):
         
         dimensions = [
@@ -460,7 +541,7 @@ class GABradescoSegurosCorretorVisitanteToDB(GABradescoSegurosToDB):
             {
                 'title': 'corretor_cpfcnpj_session_zeropad_sha256',
                 'name': 'ga:dimension20',
-                'transform': self.TransformRegexReplace, # (report, this_dimension)
+                'transform': 'regexreplace',
                 'transformparams': {
                 	# Get rid of useless strings, replace text by NULL
                     'Cookie não definido': None
@@ -469,7 +550,7 @@ class GABradescoSegurosCorretorVisitanteToDB(GABradescoSegurosToDB):
             {
                 'title': 'corretor_cpfcnpj_session_sha256',
                 'name': 'ga:dimension17',
-                'transform': self.TransformRegexReplace, # (report, this_dimension)
+                'transform': 'regexreplace',
                 'transformparams': {
                 	# Get rid of useless strings, replace text by NULL
                     'Cookie não definido': None
@@ -478,7 +559,7 @@ class GABradescoSegurosCorretorVisitanteToDB(GABradescoSegurosToDB):
             {
                 'title': 'corretor_cpfcnpj_hit_zeropad_sha256',
                 'name': 'ga:dimension19',
-                'transform': self.TransformRegexReplace, # (report, this_dimension)
+                'transform': 'regexreplace',
                 'transformparams': {
                 	# Get rid of useless strings, replace text by NULL
                     'Cookie não definido': None
@@ -487,7 +568,7 @@ class GABradescoSegurosCorretorVisitanteToDB(GABradescoSegurosToDB):
             {
                 'title': 'corretor_cpfcnpj_hit_sha256',
                 'name': 'ga:dimension15',
-                'transform': self.TransformRegexReplace, # (report, this_dimension)
+                'transform': 'regexreplace',
                 'transformparams': {
                 	# Get rid of useless strings, replace text by NULL
                     'Cookie não definido': None
@@ -497,6 +578,7 @@ class GABradescoSegurosCorretorVisitanteToDB(GABradescoSegurosToDB):
             {
                 'title': 'corretor_perfil',
                 'name': 'ga:dimension6',
+                'categorical': True,
             },
             
     
@@ -510,7 +592,7 @@ class GABradescoSegurosCorretorVisitanteToDB(GABradescoSegurosToDB):
             {
                 'title': 'referer',
                 'name': 'ga:fullReferrer',
-                'transform': self.TransformRegexReplace, # (report, this_dimension)
+                'transform': 'regexreplace',
                 'transformparams': {
                 	# Get rid of useless strings, replace text by NULL
                     '(direct)': None
@@ -530,21 +612,25 @@ class GABradescoSegurosCorretorVisitanteToDB(GABradescoSegurosToDB):
             {
                 'title': 'ramo',
                 'name': 'ga:dimension3',
+                'categorical': True,
             },
 
             {
                 'title': 'channel1',
                 'name': 'ga:dimension4',
+                'categorical': True,
             },
 
             {
                 'title': 'channel2',
                 'name': 'ga:dimension5',
+                'categorical': True,
             },
             
             {
                 'title': 'product',
                 'name': 'ga:dimension14',
+                'categorical': True,
             },
             
             {
@@ -555,17 +641,19 @@ class GABradescoSegurosCorretorVisitanteToDB(GABradescoSegurosToDB):
             {
                 'title': 'event_category',
                 'name': 'ga:eventCategory',
+                'categorical': True,
             },
             
             {
                 'title': 'event_action',
                 'name': 'ga:eventAction',
+                'categorical': True,
             },
             
             {
                 'title': 'event_label',
                 'name': 'ga:eventLabel',
-                'transform': self.TransformRegexReplace, # (report, this_dimension)
+                'transform': 'regexreplace',
                 'transformparams': {
                 	# Fix a wrong char that prevents data to be written on DB
                     r'Pesquise por Ano e n.mero do Pedido': 'Pesquise por Ano e número do Pedido',
@@ -621,7 +709,34 @@ class GABradescoSegurosCorretorVisitanteToDB(GABradescoSegurosToDB):
             targetTable=targetTable,
             update=update,
             processorName=processorName,
-            restart=restart
+            restart=restart,
+            fetchWorkers=fetchWorkers,
+            rateLimiter=rateLimiter,
+            subreportsPerCall=subreportsPerCall,
+            dimensionStats=dimensionStats,
+            retryPolicy=retryPolicy,
+            adaptivePartitions=adaptivePartitions,
+            mergeRowTarget=mergeRowTarget,
+            cache=cache,
+            pageWorkers=pageWorkers,
+            gaServiceFactory=gaServiceFactory,
+            rowIDHash=rowIDHash,
+            manageTable=manageTable,
+            dstAmbiguous=dstAmbiguous,
+            dstNonexistent=dstNonexistent,
+            categoricalRatio=categoricalRatio,
+            dbWriteQueueBudget=dbWriteQueueBudget,
+            dbWriteQueueSpill=dbWriteQueueSpill,
+            runMetrics=runMetrics,
+            arrow=arrow,
+            bulkLoader=bulkLoader,
+            dbWriters=dbWriters,
+            upsert=upsert,
+            checkpointTable=checkpointTable,
+            checkpointSpool=checkpointSpool,
+            dbWriteChunkRows=dbWriteChunkRows,
+            dbWriteChunkBytes=dbWriteChunkBytes,
+            correctionWindow=correctionWindow
         )
 
 
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+#######################################
+##
+## Measure throughput and memory of a GAAPItoDB processor offline, without talking
+## to Google. GA is replaced by GAFakeAPI serving synthetic data, and data is
+## written to a local SQLite database.
+##
+## Run it from this folder, as:
+##
+##   ./benchmark.py --days 2 --hits 200000 --fetchWorkers 4
+##
+
+
+import logging
+import argparse
+import datetime
+import resource
+import time
+import os
+import GABradescoSegurosToDB
+from GAAPItoDB import GAFakeAPI, GASyntheticData
+
+
+
+def prepareArgs():
+    parser = argparse.ArgumentParser(description='Benchmark GAAPItoDB against a local fake of GA APIs')
+
+    parser.add_argument('--days', dest='days', type=int, default=2,
+        help='Number of days of data to sync')
+    parser.add_argument('--hits', dest='hits', type=int, default=100000,
+        help='Average number of hits per day')
+    parser.add_argument('--seed', dest='seed', type=int, default=0,
+        help='Seed of synthetic data')
+    parser.add_argument('--latency', dest='latency', type=float, default=0.5,
+        help='Seconds each fake GA call takes')
+    parser.add_argument('--samplingThreshold', dest='samplingThreshold', type=int, default=None,
+        help='Fake GA returns sampled data for reports with more hits than this')
+    parser.add_argument('--fetchWorkers', dest='fetchWorkers', type=int, default=1)
+    parser.add_argument('--pageWorkers', dest='pageWorkers', type=int, default=1)
+    parser.add_argument('--dateRangePartitionSize', dest='dateRangePartitionSize', type=int, default=1)
+    parser.add_argument('--adaptivePartitions', dest='adaptivePartitions', action='store_true')
+    parser.add_argument('--dbWritePartitions', dest='dbWritePartitions', type=int, default=12)
+    parser.add_argument('--dbWriteChunkRows', dest='dbWriteChunkRows', type=int, default=None,
+        help='Write chunks of this many rows instead of dbWritePartitions chunks')
+    parser.add_argument('--arrow', dest='arrow', action='store_true',
+        help='Queue and write final reports as Arrow tables; run with and without it to compare')
+    parser.add_argument('--db', dest='db', default='benchmark.db',
+        help='SQLite database file; will be overwritten')
+    parser.add_argument('--dbURL', dest='dbURL', default=None,
+        help='Write to this database instead of --db; target table is recreated')
+    parser.add_argument('--bulkLoader', dest='bulkLoader', default=None,
+        help='Bulk loader name, as to_sql, sqlite, postgresql or mysql; default is by dialect')
+    parser.add_argument('--debug', dest='debug', action='store_true')
+
+    return parser.parse_args()
+
+
+
+args=prepareArgs()
+
+logging.getLogger().setLevel(logging.DEBUG if args.debug else logging.INFO)
+logging.getLogger().addHandler(logging.StreamHandler())
+
+if args.dbURL is None and os.path.exists(args.db):
+    os.remove(args.db)
+
+start=datetime.datetime(2020,6,1)
+
+# Synthetic data depends on the dimensions of the processor, so it is set right after
+fake=GAFakeAPI(
+    data=None,
+    timezone='America/Sao_Paulo',
+    latency=args.latency,
+    samplingThreshold=args.samplingThreshold
+)
+
+processor=GABradescoSegurosToDB.GABradescoSegurosCorretorVisitanteToDB(
+    gaView=199999996,
+    gaAccount=79999999,
+    gaProperty='UA-79999999-17',
+    credentialsFile=None,
+    gaServiceFactory=fake,
+    start=start,
+    end=start + datetime.timedelta(days=args.days),
+    endLag=datetime.timedelta(minutes=0),
+    dateRangePartitionSize=args.dateRangePartitionSize,
+    adaptivePartitions=args.adaptivePartitions,
+    dbWritePartitions=args.dbWritePartitions,
+    dbWriteChunkRows=args.dbWriteChunkRows,
+    arrow=args.arrow,
+    fetchWorkers=args.fetchWorkers,
+    pageWorkers=args.pageWorkers,
+    dbURL=args.dbURL or f'sqlite:///{args.db}',
+    targetTable='ga_corretor_visitante',
+    restart=True,
+    bulkLoader=args.bulkLoader
+)
+
+fake.data=GASyntheticData(processor.dimensions, seed=args.seed, hitsPerDay=args.hits)
+
+began=time.monotonic()
+processor.sync()
+elapsed=time.monotonic() - began
+
+# ru_maxrss is in KiB on Linux
+peak=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+print(f'Synced {args.days} days of ~{args.hits} hits in {elapsed:.1f}s')
+print(f'GA calls: {fake.calls}, GA rows: {fake.rows} ({fake.rows/elapsed:.0f} rows/s), GA errors: {fake.errors}')
+print(f'Peak RSS: {peak:.0f} MiB')
+print(f'Peak of reports waiting for DB writer: {processor.dbWriteQueue.peakBytes/1024**2:.1f} MiB')
+
+writes=processor.runMetrics.summary()['metrics'].get('db_write_seconds', [{'sum': 0}])[0]['sum']
+print(f'DB writes with {type(processor.loader).__name__}: {writes:.1f}s')
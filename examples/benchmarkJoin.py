@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+#######################################
+##
+## Compare the single-pass multi-way join of subreports with the iterative outer
+## joins used up to GAAPItoDB 0.6, on subreports fetched from GAFakeAPI.
+##
+## Run it from this folder, as:
+##
+##   ./benchmarkJoin.py --days 7 --hits 200000
+##
+
+
+import logging
+import argparse
+import datetime
+import tracemalloc
+import time
+import pandas as pd
+import GABradescoSegurosToDB
+from GAAPItoDB import GAFakeAPI, GASyntheticData
+
+
+
+def prepareArgs():
+    parser = argparse.ArgumentParser(description='Benchmark joins of GAAPItoDB subreports')
+
+    parser.add_argument('--days', dest='days', type=int, default=2,
+        help='Number of days of data in the single time partition joined')
+    parser.add_argument('--hits', dest='hits', type=int, default=100000,
+        help='Average number of hits per day')
+    parser.add_argument('--seed', dest='seed', type=int, default=0,
+        help='Seed of synthetic data')
+    parser.add_argument('--repeat', dest='repeat', type=int, default=3,
+        help='Number of times each join is measured; best time is reported')
+    parser.add_argument('--debug', dest='debug', action='store_true')
+
+    return parser.parse_args()
+
+
+
+def measure(join, subreports, repeat):
+    """
+    Run `join` on copies of `subreports` `repeat` times. Returns result, best time
+    and peak memory allocated during the join.
+    """
+    best=None
+
+    for r in range(repeat):
+        copies=[df.copy() for df in subreports]
+
+        tracemalloc.start()
+        began=time.perf_counter()
+        report=join(copies)
+        elapsed=time.perf_counter() - began
+        current, peak=tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        if best is None or elapsed < best:
+            best=elapsed
+
+    return report, best, peak
+
+
+
+args=prepareArgs()
+
+logging.getLogger().setLevel(logging.DEBUG if args.debug else logging.WARNING)
+logging.getLogger().addHandler(logging.StreamHandler())
+
+start=datetime.datetime(2020,6,1)
+
+fake=GAFakeAPI(data=None, timezone='America/Sao_Paulo')
+
+processor=GABradescoSegurosToDB.GABradescoSegurosCorretorVisitanteToDB(
+    gaView=199999996,
+    gaAccount=79999999,
+    gaProperty='UA-79999999-17',
+    credentialsFile=None,
+    gaServiceFactory=fake,
+    start=start,
+    end=start + datetime.timedelta(days=args.days),
+    endLag=datetime.timedelta(minutes=0),
+    dateRangePartitionSize=args.days,
+    dbURL='sqlite://',
+    targetTable='ga_corretor_visitante'
+)
+
+fake.data=GASyntheticData(processor.dimensions, seed=args.seed, hitsPerDay=args.hits)
+
+# Fetch all subreports of a single time partition, as the fetcher workers would do
+processor.effectiveStart=processor.start
+p=processor.getDateRangePartitions()[0]
+dimensions=processor.subreportDimensions()
+
+subreports=[]
+for b in processor.subreportBatches(dimensions):
+    subreports.extend(processor.getSubreports(p, dimensions, b, len(dimensions)))
+
+print('Joining {n} subreports with {rows} rows in total'.format(
+    n=len(subreports),
+    rows=sum([df.shape[0] for df in subreports])
+))
+
+iterative, iterativeTime, iterativePeak=measure(processor.joinSubreportsIteratively, subreports, args.repeat)
+single, singleTime, singlePeak=measure(processor.joinSubreports, subreports, args.repeat)
+
+# Both must produce the same report, except for row order
+pd.testing.assert_frame_equal(iterative.sort_index(), single.sort_index())
+
+print(f'Report: {single.shape[0]}×{single.shape[1]}')
+print(f'Iterative join:   {iterativeTime:.3f}s, peak {iterativePeak/1024**2:.0f} MiB')
+print(f'Single-pass join: {singleTime:.3f}s, peak {singlePeak/1024**2:.0f} MiB ({iterativeTime/singleTime:.1f}× faster)')
@@ -17,6 +17,7 @@ import argparse
 import pprint
 import datetime
 import GABradescoSegurosToDB
+from GAAPItoDB import GARateLimiter
 
 
 # Prepare logging
@@ -40,6 +41,13 @@ credentials='Google credentials file-abc123.json'
 
 
 
+# All processors below use the same GA project, so they must share its API quota.
+# Calls will be spread evenly along time instead of fired in bursts.
+
+rateLimiter=GARateLimiter(projectQuota=100)
+
+
+
 
 # Instantiate our specialized classes.
 # We have 2 views:
@@ -66,6 +74,13 @@ credentials='Google credentials file-abc123.json'
 # - credentialsFile: JSON file with GA credentials and API keys as provided Google
 # - apiQuota: Number of API calls per 100 seconds that Google allows your credentials
 #   to make. ETL logic will pause for a while if this quota is achieved, to avoid an API error.
+# - rateLimiter: A GARateLimiter object shared by all processors, threads and processes
+#   that use the same GA project. Overrides apiQuota.
+# - retryPolicy: A GARetryPolicy object that defines how failed GA calls are retried
+#   (exponential backoff, maximum elapsed time, circuit breaker). Share it among
+#   processors so all of them back off when GA is failing.
+# - cache: A GAResponseCache object that keeps pages of historic GA data on local disk,
+#   so backfills and re-runs don't download them again.
 # - star, end: Python datetime objects that defines date boundaries which has the desired dimensions.
 #   If end is not specified, grab data until now. The start parameter can't be omitted.
 # - endLag: Grab GA data produced until end time minus endLag period. This is useful when
@@ -75,7 +90,59 @@ credentials='Google credentials file-abc123.json'
 #   faster and require less API calls, but increase your chance of getting
 #   sampled (incomplete) data. Less days ensures complete data but makes more API calls
 #   and takes longer times to run.
-# - dbWritePartitions: Number of chunks to break data to write to DB.
+# - adaptivePartitions: If True, dateRangePartitionSize is just the initial number of
+#   days. Time partitions that GA returns sampled are split in halves, down to 1 hour, and
+#   refetched. Partitions with less than mergeRowTarget rows make next ones twice as big.
+# - dbWritePartitions: Number of chunks of the same number of rows to break data of
+#   each time partition to write to DB, if dbWriteChunkRows and dbWriteChunkBytes are
+#   not set.
+# - fetchWorkers: Number of threads fetching subreports and time partitions from GA in
+#   parallel. All of them share the same apiQuota. Default is 1.
+# - subreportsPerCall: Number of subreports of same time partition requested to GA in a
+#   single API call. Default and maximum allowed by GA is 5.
+# - pageWorkers: Number of threads per fetcher that get pages of same subreports in
+#   parallel, once the first page tells how many rows there are. Default is 1.
+# - dimensionStats: Cardinality statistics of dimensions as returned by
+#   measureDimensionStats(), or 'measure' to measure them before sync. Used to pack
+#   dimensions that always have a value in less subreports.
+# - rowIDHash: 'shake_256' (default) makes the same 16 hex chars __row_id as previous
+#   versions. 'siphash' makes 64 bits integer IDs a lot faster, for new tables.
+# - manageTable: If True (default), create targetTable with __row_id primary key, typed
+#   columns and an index on the synccursor column. Tables created by older versions are
+#   used as they are until converted with migrateTable().
+# - dstAmbiguous, dstNonexistent: How to convert to UTC local times that happen twice
+#   or never when daylight saving time ends or starts, as in pandas' tz_localize().
+#   Defaults are False (take as standard time) and 'shift_forward'.
+# - categoricalRatio: Non-key dimensions without type or transform that have less
+#   distinct values than this fraction of rows are kept as compact pandas categoricals,
+#   as dimensions with 'categorical': True always are. Default is None.
+# - dbWriteQueueBudget: Bytes of RAM that reports waiting to be written to DB can use.
+#   When reached, GA fetching waits for the DB. Default is 1 GiB; None is unbounded.
+# - dbWriteQueueSpill: Directory where reports over dbWriteQueueBudget are written as
+#   Parquet files instead of waiting, so long backfills don't stall on a slow DB.
+# - runMetrics: A GAMetrics object that collects timings and throughput of GA calls,
+#   joins, transformations and DB writes, and writes them to a Prometheus textfile, a
+#   JSON run summary or serves them over HTTP. Share it among all processors.
+# - arrow: If True, final reports wait for the DB writer as compact Arrow tables and
+#   are written in zero-copy slices. Requires pyarrow. Default is False.
+# - bulkLoader: How data is written to DB. Default picks by dialect: COPY FROM STDIN for
+#   PostgreSQL, LOAD DATA LOCAL INFILE for MySQL (add ?local_infile=1 to dbURL), a
+#   single executemany() for SQLite. 'to_sql' uses multi-row INSERTs.
+# - dbWriters: Threads writing chunks of dbWritePartitions to DB in parallel, each in
+#   its own transaction, committed in time order. Ignored for SQLite. Default is 1.
+# - upsert: If True, chunks are loaded into a temporary staging table and merged into
+#   targetTable on __row_id, so periods synced again replace their rows instead of
+#   colliding with them. PostgreSQL, MySQL, MariaDB and SQLite. Default is False.
+# - checkpointTable: Table where committed time partitions, their row counts and last
+#   GA page tokens are recorded, so incremental runs resume from the last committed
+#   partition. Default is 'gaapitodb_checkpoints'; None disables checkpoints.
+# - checkpointSpool: Directory to keep GA pages of partitions not yet committed, so a
+#   crashed run doesn't fetch them again. Default is None.
+# - dbWriteChunkRows: Rows written to DB per transaction. Default is None.
+# - dbWriteChunkBytes: Bytes of RAM of rows written to DB per transaction, as an
+#   alternative to dbWriteChunkRows. Default is None.
+# - correctionWindow: timedelta of already synced data that incremental runs fetch
+#   again to merge rows GA processed late, so endLag can be small. Default is None.
 # - dbURL: A SQLAlchemy-supported URL including user, password, host and database name.
 # - targetTable: SQL table name that will be updated.
 # - incremental: If True (default) get data from GA and update SQL table starting from
@@ -91,6 +158,7 @@ gaParcelasClicadasTZ = GABradescoSegurosToDB.GABradescoSegurosParcelasAtrasadasC
     gaProperty='UA-79999999-17',    
     credentialsFile=credentials,
     apiQuota=100,
+    rateLimiter=rateLimiter,
     start=datetime.datetime(2019,7,9),
     end=datetime.datetime(2020,5,30),
     endLag=datetime.timedelta(minutes=0),
@@ -106,6 +174,7 @@ gaParcelasClicadasUTC = GABradescoSegurosToDB.GABradescoSegurosParcelasAtrasadas
     gaProperty='UA-79999999-17',    
     credentialsFile=credentials,
     apiQuota=100,
+    rateLimiter=rateLimiter,
     start=datetime.datetime(2020,5,31),
     endLag=datetime.timedelta(minutes=120),
     dateRangePartitionSize=7,
@@ -130,6 +199,7 @@ gaCorretorVisitanteTZ=GABradescoSegurosToDB.GABradescoSegurosCorretorVisitanteTo
     gaProperty='UA-79999999-17',    
     credentialsFile=credentials,
     apiQuota=100,
+    rateLimiter=rateLimiter,
     start=datetime.datetime(2020,3,1),
     end=datetime.datetime(2020,5,30),
     endLag=datetime.timedelta(minutes=0),
@@ -147,6 +217,7 @@ gaCorretorVisitanteUTC=GABradescoSegurosToDB.GABradescoSegurosCorretorVisitanteT
     gaProperty='UA-79999999-17',    
     credentialsFile=credentials,
     apiQuota=100,
+    rateLimiter=rateLimiter,
     start=datetime.datetime(2020,5,31),
     endLag=datetime.timedelta(minutes=120),
     dateRangePartitionSize=1,
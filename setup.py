@@ -14,7 +14,7 @@ setuptools.setup(
     long_description_content_type="text/markdown",
     url="https://github.com/avibrazil/GoogleAnalytics-ETL",
     install_requires=['sqlalchemy','pandas','oauth2client','google-api-python-client','python-dateutil'],
-    data_files=[('share/GoogleAnalyticsETL/examples',['examples/GABradescoSegurosToDB.py', 'examples/etl-by-email.py','examples/etl.py','examples/sources.conf.example'])],
+    data_files=[('share/GoogleAnalyticsETL/examples',['examples/GABradescoSegurosToDB.py', 'examples/etl-by-email.py','examples/etl.py','examples/benchmark.py','examples/benchmarkJoin.py','examples/sources.conf.example'])],
     packages=setuptools.find_packages(),
     classifiers=[
         "Programming Language :: Python :: 3",
@@ -0,0 +1,114 @@
+#######################################
+##
+## GACheckpoint: where a run resumes after another one crashed in the middle of
+## a partition, and what it finds of partitions that were not committed.
+##
+
+
+
+import datetime
+import sqlalchemy
+import pytest
+
+from GAAPItoDB.GACheckpoint import GACheckpoint
+
+
+
+utc = datetime.timezone.utc
+
+
+
+def partition(day):
+    return [
+        datetime.datetime(2020, 6, day, tzinfo=utc),
+        datetime.datetime(2020, 6, day, 23, 59, 59, 999999, tzinfo=utc)
+    ]
+
+
+
+@pytest.fixture
+def engine(tmp_path):
+    return sqlalchemy.create_engine('sqlite:///{}'.format(tmp_path / 'checkpoint.db'))
+
+
+
+@pytest.fixture
+def checkpoint(engine, tmp_path):
+    c = GACheckpoint(engine, 'checkpoints', 'test', '1', 'ga', spoolDirectory=str(tmp_path / 'spool'))
+    c.create()
+    return c
+
+
+
+def commit(checkpoint, p, rows):
+    checkpoint.begin(p)
+    checkpoint.queued(p, rows)
+
+    with checkpoint.engine.begin() as connection:
+        checkpoint.committed(p, rows, connection)
+
+
+
+def test_nothing_synced(engine):
+    # Not even the table exists
+    assert GACheckpoint(engine, 'checkpoints', 'test', '1', 'ga').resumePoint() == (None, [])
+
+
+
+def test_crash_between_queued_and_committed(checkpoint):
+    commit(checkpoint, partition(1), 100)
+    commit(checkpoint, partition(2), 200)
+
+    # Run crashes after partition 3 was read but before it was written
+    checkpoint.begin(partition(3))
+    checkpoint.page(partition(3), 0, 'token-1')
+    checkpoint.queued(partition(3), 300)
+
+    # And partition 4 was being fetched
+    checkpoint.begin(partition(4))
+    checkpoint.page(partition(4), 1, 'token-2')
+
+    end, inflight = checkpoint.resumePoint()
+
+    assert end == datetime.datetime(2020, 6, 2, 23, 59, 59, 999999)
+    assert [(i['partition_start'].day, i['status'], i['rows']) for i in inflight] == [
+        (3, 'queued', 300),
+        (4, 'fetching', None)
+    ]
+    assert inflight[1]['page_tokens'] == '{"1": "token-2"}'
+
+
+
+def test_resumed_partitions_replace_inflight_ones(checkpoint):
+    commit(checkpoint, partition(1), 100)
+    checkpoint.queued(partition(2), 200)
+
+    # Next run discards what the crashed one left and commits it again
+    checkpoint.reset(after=datetime.datetime(2020, 6, 2))
+    assert checkpoint.resumePoint() == (datetime.datetime(2020, 6, 1, 23, 59, 59, 999999), [])
+
+    commit(checkpoint, partition(2), 200)
+
+    assert checkpoint.resumePoint() == (datetime.datetime(2020, 6, 2, 23, 59, 59, 999999), [])
+
+
+
+def test_processors_do_not_share_checkpoints(engine, checkpoint):
+    commit(checkpoint, partition(1), 100)
+
+    other = GACheckpoint(engine, 'checkpoints', 'other', '1', 'ga')
+
+    assert other.resumePoint() == (None, [])
+
+
+
+def test_spool_is_kept_until_reset(checkpoint):
+    spool = checkpoint.spool(partition(3))
+    spool.put({'page': 1}, {'rows': [1]})
+
+    # A new run finds pages of the crashed one
+    assert checkpoint.spool(partition(3)).get({'page': 1}) == {'rows': [1]}
+
+    checkpoint.reset()
+
+    assert checkpoint.spool(partition(3)).get({'page': 1}) is None
@@ -0,0 +1,67 @@
+#######################################
+##
+## GAPageDecoder must build, page by page, the same DataFrame as decoding all
+## rows of all pages at once.
+##
+
+
+
+import pandas as pd
+
+from GAAPItoDB.GAPageDecoder import GAPageDecoder
+
+
+
+columns = ['hit', 'channel', 'product']
+
+
+
+def page(start, count):
+    return [
+        {
+            'dimensions': [f'h{i}', ['direct', 'email', 'ads'][i % 3], f'p{i % 7}'],
+            'metrics': [{'values': ['1']}]
+        }
+        for i in range(start, start + count)
+    ]
+
+
+
+def test_pages_decode_as_one():
+    pages = [page(0, 100), page(100, 100), page(200, 37)]
+
+    decoder = GAPageDecoder(columns)
+    for p in pages:
+        decoder.addPage(p)
+
+    assert decoder.rowCount == 237
+
+    expected = pd.DataFrame(
+        [r['dimensions'] for p in pages for r in p],
+        columns=columns
+    )
+
+    pd.testing.assert_frame_equal(decoder.dataFrame(), expected)
+
+
+
+def test_repeated_values_share_strings():
+    decoder = GAPageDecoder(columns)
+    decoder.addPage(page(0, 10))
+    decoder.addPage(page(10, 10))
+
+    channel = decoder.dataFrame()['channel']
+
+    # Same value in different pages is the same object
+    assert channel[0] is channel[3] is channel[18]
+
+
+
+def test_no_rows():
+    decoder = GAPageDecoder(columns)
+    decoder.addPage([])
+
+    df = decoder.dataFrame()
+
+    assert df.shape == (0, 3)
+    assert list(df.columns) == columns
@@ -0,0 +1,103 @@
+#######################################
+##
+## Token buckets of GARateLimiter: smooth refill, debt that queues callers in
+## arrival order, and buckets shared by objects, views and forked processes.
+##
+
+
+
+import multiprocessing
+import pytest
+
+from GAAPItoDB.GARateLimiter import TokenBucket, GARateLimiter
+
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    A fake time.monotonic() that only moves when told to, and a sleep() that
+    records waits instead of waiting.
+    """
+    class Clock(object):
+        now = 1000.0
+        slept = []
+
+    monkeypatch.setattr('time.monotonic', lambda: Clock.now)
+    monkeypatch.setattr('time.sleep', lambda s: Clock.slept.append(s))
+
+    return Clock
+
+
+
+def test_burst_then_debt(clock):
+    # 10 tokens per second, 2 at once
+    bucket = TokenBucket(10, period=1, burst=2)
+
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+
+    # Each caller in debt waits its turn
+    assert bucket.reserve() == pytest.approx(0.1)
+    assert bucket.reserve() == pytest.approx(0.2)
+
+
+
+def test_refill_is_smooth_and_capped(clock):
+    bucket = TokenBucket(10, period=1, burst=2)
+
+    bucket.reserve(2)
+
+    clock.now += 0.1
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == pytest.approx(0.1)
+
+    # A long idle time never fills more than the capacity
+    clock.now += 3600
+    assert bucket.reserve(2) == 0
+    assert bucket.reserve() == pytest.approx(0.1)
+
+
+
+def test_default_burst_is_one_second_of_tokens(clock):
+    bucket = TokenBucket(2000, period=100)
+
+    assert bucket.capacity == 20
+
+
+
+def test_project_bucket_is_shared_by_views(clock):
+    limiter = GARateLimiter(projectQuota=10, viewQuota=100, period=1, burst=1)
+
+    assert limiter.acquire(view=1) == 0
+
+    # Another view has its own bucket, but shares the project one
+    assert limiter.acquire(view=2) == pytest.approx(0.1)
+    assert clock.slept == [pytest.approx(0.1)]
+
+
+
+def test_view_bucket_limits_its_view_only(clock):
+    limiter = GARateLimiter(projectQuota=None, viewQuota=10, period=1, burst=1)
+
+    assert limiter.acquire(view='1') == 0
+    assert limiter.acquire(view=1) == pytest.approx(0.1)
+    assert limiter.acquire(view=2) == 0
+
+
+
+def take(limiter):
+    limiter.acquire(view=1)
+
+
+
+def test_shared_across_forked_processes():
+    # Real clock: 1 token per 100 seconds, so nothing is refilled during the test
+    limiter = GARateLimiter(projectQuota=1, period=100, burst=1)
+
+    child = multiprocessing.get_context('fork').Process(target=take, args=(limiter,))
+    child.start()
+    child.join()
+
+    # The child took the only token, so this call would have to wait
+    assert limiter.project.reserve() > 90
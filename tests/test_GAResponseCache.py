@@ -0,0 +1,98 @@
+#######################################
+##
+## GAResponseCache: hits and misses by canonical request, files surviving a new
+## cache object, and eviction of least recently used pages over the size limit.
+##
+
+
+
+import os
+import pytest
+
+from GAAPItoDB.GAResponseCache import GAResponseCache
+
+
+
+def request(n, **extra):
+    body = {
+        'reportRequests': [{'viewId': '1', 'dateRanges': [{'startDate': f'2020-06-{n:02d}', 'endDate': f'2020-06-{n:02d}'}]}]
+    }
+    body.update(extra)
+    return body
+
+
+
+def response(n, rows=50):
+    return {'reports': [{'data': {'rows': [{'dimensions': [f'{n}', f'{i}']} for i in range(rows)]}}]}
+
+
+
+def test_hit_and_miss(tmp_path):
+    cache = GAResponseCache(str(tmp_path))
+
+    assert cache.get(request(1)) is None
+
+    cache.put(request(1), response(1))
+
+    assert cache.get(request(1)) == response(1)
+    assert cache.get(request(2)) is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+
+def test_volatile_fields_and_key_order_are_ignored(tmp_path):
+    cache = GAResponseCache(str(tmp_path))
+
+    cache.put(request(1), response(1))
+
+    reordered = dict(reversed(list(request(1, useResourceQuotas=True).items())))
+
+    assert cache.get(reordered) == response(1)
+
+
+
+def test_entries_survive_a_new_cache_object(tmp_path):
+    GAResponseCache(str(tmp_path)).put(request(1), response(1))
+
+    cache = GAResponseCache(str(tmp_path))
+
+    assert cache.size > 0
+    assert cache.get(request(1)) == response(1)
+
+
+
+def test_least_recently_used_are_evicted(tmp_path):
+    cache = GAResponseCache(str(tmp_path))
+
+    for n in range(1, 5):
+        cache.put(request(n), response(n))
+
+        # Make order of use explicit, file times may have coarse resolution
+        os.utime(cache.path(cache.key(request(n))), (n*1000, n*1000))
+
+    # Page 1 is used again, so page 2 is now the oldest one
+    os.utime(cache.path(cache.key(request(1))), (9000, 9000))
+
+    pageSize = os.path.getsize(cache.path(cache.key(request(1))))
+
+    # Room for about 3 pages, so one must go when the 5th arrives
+    cache.maxSize = 3.5*pageSize
+    cache.put(request(5), response(5))
+
+    assert cache.get(request(2)) is None
+    for n in [1, 5]:
+        assert cache.get(request(n)) == response(n)
+
+    assert cache.size <= cache.maxSize
+    assert cache.size == sum([e[1] for e in cache.entries()])
+
+
+
+def test_writing_a_key_again_replaces_its_size(tmp_path):
+    cache = GAResponseCache(str(tmp_path))
+
+    for rows in range(50):
+        cache.put(request(1), response(1, rows=rows))
+
+    assert cache.size == sum([e[1] for e in cache.entries()])
+    assert cache.get(request(1)) == response(1, rows=49)
@@ -0,0 +1,125 @@
+#######################################
+##
+## Classification of GA errors and the waits of GARetryPolicy: backoff, quota
+## waits, maximum elapsed time and the circuit breaker shared by threads.
+##
+
+
+
+from apiclient.errors import HttpError
+import httplib2
+import socket
+import json
+import time
+import pytest
+
+from GAAPItoDB.GARetryPolicy import GARetryPolicy, GARetryExhausted
+
+
+
+def httpError(status, reason):
+    content = json.dumps({
+        'error': {
+            'code': status,
+            'status': reason,
+            'errors': [{'reason': reason}]
+        }
+    }).encode('UTF-8')
+
+    return HttpError(httplib2.Response({'status': status}), content)
+
+
+
+@pytest.mark.parametrize('error, kind', [
+    (httpError(500, 'backendError'),              GARetryPolicy.RETRYABLE),
+    (httpError(503, 'backendError'),              GARetryPolicy.RETRYABLE),
+    (httpError(429, 'RESOURCE_EXHAUSTED'),        GARetryPolicy.QUOTA),
+    (httpError(403, 'userRateLimitExceeded'),     GARetryPolicy.QUOTA),
+    (httpError(403, 'insufficientPermissions'),   GARetryPolicy.FATAL),
+    (httpError(400, 'badRequest'),                GARetryPolicy.FATAL),
+    (socket.timeout(),                            GARetryPolicy.RETRYABLE),
+    (ConnectionResetError(),                      GARetryPolicy.RETRYABLE),
+    (BrokenPipeError(),                           GARetryPolicy.RETRYABLE),
+    (KeyError('rows'),                            GARetryPolicy.FATAL)
+], ids=lambda v: type(v).__name__ if isinstance(v, Exception) else v)
+def test_classify(error, kind):
+    assert GARetryPolicy().classify(error) == kind
+
+
+
+def test_fatal_errors_are_raised():
+    policy = GARetryPolicy()
+    error = httpError(400, 'badRequest')
+
+    with pytest.raises(HttpError):
+        policy.failure(error, 0, time.monotonic())
+
+    assert policy.stats[None]['errors'][GARetryPolicy.FATAL] == 1
+
+
+
+def test_backoff_is_bounded():
+    policy = GARetryPolicy(baseWait=1, maxWait=8)
+
+    for attempt in range(10):
+        wait = policy.failure(httpError(503, 'backendError'), attempt, time.monotonic())
+        assert 0 <= wait <= min(8, 2**attempt)
+
+
+
+def test_quota_waits_a_quota_period():
+    policy = GARetryPolicy(quotaWait=100)
+
+    wait = policy.failure(httpError(429, 'RESOURCE_EXHAUSTED'), 0, time.monotonic())
+
+    assert 100 <= wait <= 110
+
+    # Other threads sharing the policy wait too
+    assert policy.openUntil >= time.monotonic() + 99
+
+
+
+def test_gives_up_after_max_elapsed():
+    policy = GARetryPolicy(maxElapsed=60)
+
+    with pytest.raises(GARetryExhausted):
+        policy.failure(httpError(503, 'backendError'), 3, time.monotonic() - 61)
+
+
+
+def test_circuit_breaker_opens_after_consecutive_failures():
+    policy = GARetryPolicy(breakerThreshold=3, breakerCooldown=60)
+
+    for attempt in range(2):
+        policy.failure(httpError(503, 'backendError'), attempt, time.monotonic())
+
+    assert policy.openUntil < time.monotonic()
+
+    policy.failure(httpError(503, 'backendError'), 2, time.monotonic())
+
+    assert policy.openUntil >= time.monotonic() + 59
+
+
+
+def test_success_resets_consecutive_failures():
+    policy = GARetryPolicy(breakerThreshold=3)
+
+    for attempt in range(2):
+        policy.failure(httpError(503, 'backendError'), attempt, time.monotonic())
+
+    policy.success('P')
+    policy.failure(httpError(503, 'backendError'), 0, time.monotonic())
+
+    assert policy.consecutiveFailures == 1
+    assert policy.openUntil < time.monotonic()
+    assert policy.stats['P']['calls'] == 1
+
+
+
+@pytest.mark.parametrize('error', [
+    FileNotFoundError('credentials.json'),
+    PermissionError('credentials.json'),
+    OSError('disk full')
+], ids=lambda e: type(e).__name__)
+def test_local_os_errors_are_fatal(error):
+    assert GARetryPolicy().classify(error) == GARetryPolicy.FATAL
@@ -0,0 +1,118 @@
+#######################################
+##
+## Built-in transformations must give the same results of the custom functions
+## examples used before: BSExplodeAndSplit() and TransformRegexReplace().
+##
+
+
+
+import pandas as pd
+import pytest
+
+from GAAPItoDB import GATransforms
+
+
+
+def previousExplodeAndSplit(df, dimension):
+    # BSExplodeAndSplit() of examples/GABradescoSegurosToDB.py, without logging
+    if 'keeporiginal' in dimension:
+        df[dimension['title'] + "__org"] = df[dimension['title']]
+
+    for s in dimension['transformparams']['explodeseparators']:
+        df[dimension['title']] = df[dimension['title']].str.split(pat = s)
+        df = df.explode(dimension['title'])
+
+    df[dimension['transformspawncolumns']] = df[dimension['title']].str.split(dimension['transformparams']['splitseparators'][0], expand=True)
+
+    if 'transformspawncolumnstype' in dimension:
+        for i in range(len(dimension['transformspawncolumns'])):
+            if dimension['transformspawncolumnstype'][i] == 'int':
+                df[dimension['transformspawncolumns'][i]] = pd.to_numeric(df[dimension['transformspawncolumns'][i]],errors='raise')
+
+    return df
+
+
+
+def previousRegexReplace(df, dimension):
+    df[dimension['title']]=df[[dimension['title']]].replace(regex=dimension['transformparams'])
+    return df
+
+
+
+@pytest.fixture
+def df():
+    return pd.DataFrame({
+        'hit':     ['h1', 'h2', 'h3', 'h4', 'h5'],
+        'apolice': ['0516-123,0517-456', '0516-789', '0001-1;0002-2,0003-3', '0516-123,0517-456', '0900-9']
+    })
+
+
+
+explodeAndSplit = {
+    'title': 'apolice',
+    'transform': 'explodeandsplit',
+    'transformparams': {
+        'explodeseparators': [',', ';'],
+        'splitseparators': ['-']
+    },
+    'transformspawncolumns': ['sucursal', 'apolice_num']
+}
+
+
+
+@pytest.mark.parametrize('extra', [
+    {},
+    {'transformspawncolumnstype': ['int', 'int']},
+    {'transformspawncolumnstype': [None, 'int'], 'keeporiginal': True}
+], ids=['text', 'int', 'keeporiginal'])
+def test_explodeandsplit_as_before(df, extra):
+    dimension = dict(explodeAndSplit, **extra)
+
+    expected = previousExplodeAndSplit(df.copy(), dimension)
+    result = GATransforms.transforms['explodeandsplit'](dimension, None)(df.copy())
+
+    pd.testing.assert_frame_equal(result, expected)
+
+
+
+def test_regexreplace_as_before(df):
+    dimension = {
+        'title': 'apolice',
+        'transform': 'regexreplace',
+        'transformparams': {
+            '^0516-': 'X-',
+            '[;,]': '|',
+            '^0900': None
+        }
+    }
+
+    expected = previousRegexReplace(df.copy(), dimension)
+    result = GATransforms.transforms['regexreplace'](dimension, None)(df.copy())
+
+    pd.testing.assert_frame_equal(result, expected)
+
+
+
+def test_transforms_must_implement_transform():
+    with pytest.raises(TypeError):
+        GATransforms.GATransform(explodeAndSplit, None)
+
+    class Upper(GATransforms.GATransform):
+        def transform(self, df, title):
+            df[title] = df[title].str.upper()
+            return df
+
+    df = pd.DataFrame({'apolice': ['a-1']})
+
+    assert Upper(explodeAndSplit, None)(df)['apolice'].to_list() == ['A-1']
+
+
+
+def test_missing_values_stay_missing():
+    df = pd.DataFrame({'apolice': ['0516-1', None, '0517-2,0518-3']})
+
+    result = GATransforms.transforms['explodeandsplit'](explodeAndSplit, None)(df)
+
+    assert result['apolice'].isna().to_list() == [False, True, False, False]
+    assert result['sucursal'].isna().to_list() == [False, True, False, False]
+    assert result['apolice_num'].to_list()[2:] == ['2', '3']
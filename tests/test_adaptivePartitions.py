@@ -0,0 +1,120 @@
+#######################################
+##
+## Adaptive time partitions: hour-aligned splits of partitions that GA returned
+## sampled, and growth of next partitions while they bring few rows.
+##
+
+
+
+import concurrent.futures
+import datetime
+import logging
+
+from GAAPItoDB import GAAPItoDB, GASampledData
+
+
+
+hour = datetime.timedelta(hours=1)
+day = datetime.timedelta(days=1)
+
+
+
+def processor(**attributes):
+    # Without the constructor, that would connect to GA
+    p = GAAPItoDB.__new__(GAAPItoDB)
+
+    p.logger = logging.getLogger('test')
+    p.dimensions = [{'title': 'utc_datetime', 'key': True}]
+    p.adaptivePartitions = True
+    p.partitionSize = day
+    p.minPartitionSize = hour
+    p.maxPartitionSize = 31*day
+    p.mergeRowTarget = 1000
+    p.checkpoint = None
+
+    for a in attributes:
+        setattr(p, a, attributes[a])
+
+    return p
+
+
+
+def partition(start, size):
+    return [start, start + size - datetime.timedelta(microseconds=1)]
+
+
+
+def future(result=None, exception=None):
+    f = concurrent.futures.Future()
+
+    if exception is not None:
+        f.set_exception(exception)
+    else:
+        f.set_result(result)
+
+    return f
+
+
+
+def test_partitions_follow_partition_size():
+    p = processor(
+        effectiveStart=datetime.datetime(2020, 6, 1),
+        end=datetime.datetime(2020, 6, 4, 12),
+    )
+
+    partitions = p.adaptiveDateRangePartitions()
+
+    assert next(partitions) == partition(datetime.datetime(2020, 6, 1), day)
+
+    # Size changes take effect on the next partition
+    p.partitionSize = 2*day
+
+    assert next(partitions) == partition(datetime.datetime(2020, 6, 2), 2*day)
+    assert next(partitions) == partition(datetime.datetime(2020, 6, 4), 12*hour)
+    assert list(partitions) == []
+
+
+
+def test_split_in_hour_aligned_halves():
+    p = processor()
+
+    halves = p.splitTimePartition(partition(datetime.datetime(2020, 6, 1), 5*hour))
+
+    assert halves == [
+        partition(datetime.datetime(2020, 6, 1), 2*hour),
+        partition(datetime.datetime(2020, 6, 1, 2), 3*hour)
+    ]
+
+    # Already as small as it can be
+    assert p.splitTimePartition(partition(datetime.datetime(2020, 6, 1), hour)) is None
+
+
+
+def test_sampled_partition_is_split_and_refetched():
+    p = processor(adaptivePartitions=False)
+
+    submitted = []
+    p.submitTimePartition = lambda h: submitted.append(h) or []
+
+    p.processTimePartition(
+        partition(datetime.datetime(2020, 6, 1), day),
+        [future(exception=GASampledData('sampled'))]
+    )
+
+    assert submitted == [
+        partition(datetime.datetime(2020, 6, 1), 12*hour),
+        partition(datetime.datetime(2020, 6, 1, 12), 12*hour)
+    ]
+
+    # Next partitions are no bigger than a half
+    assert p.partitionSize == 12*hour
+
+
+
+def test_partition_size_doubles_while_rows_are_few():
+    p = processor()
+
+    for size in [2*day, 4*day, 8*day, 16*day, 31*day, 31*day]:
+        p.processTimePartition(partition(datetime.datetime(2020, 6, 1), day), [])
+        assert p.partitionSize == size
+
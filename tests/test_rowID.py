@@ -0,0 +1,75 @@
+#######################################
+##
+## Row IDs made by makePrimaryKey() must stay the same IDs of GAAPItoDB up to
+## version 0.6, so tables written before keep joining with new rows.
+##
+
+
+
+import hashlib
+import numpy as np
+import pandas as pd
+import pytest
+
+from GAAPItoDB import GAAPItoDB
+
+
+
+keys = ['utc_datetime', 'hit_id', 'branch', 'sequence']
+
+
+
+@pytest.fixture
+def df():
+    rows = 500
+    return pd.DataFrame({
+        'utc_datetime': pd.date_range('2020-06-01', periods=rows, freq='7min', tz='UTC'),
+        'hit_id':       [f'h{i % 97}' for i in range(rows)],
+        'branch':       np.arange(rows) % 13,
+        'sequence':     pd.array([i if i % 10 else None for i in range(rows)], dtype=object),
+        'channel':      'direct'
+    })
+
+
+
+def previousRowIDs(df, listOfKeys):
+    # How version 0.6 made row IDs
+    df = df.copy()
+    df['__row_id'] = ''
+
+    for k in listOfKeys:
+        df['__row_id'] += df[k].astype(str)
+
+    def makeID(text):
+        idCalc = hashlib.new('shake_256')
+        idCalc.update(text.encode('UTF-8'))
+        return idCalc.hexdigest(8)
+
+    return df['__row_id'].apply(makeID).to_list()
+
+
+
+def test_shake_256_ids_are_unchanged(df):
+    expected = previousRowIDs(df, keys)
+
+    ids = GAAPItoDB.makePrimaryKey(df.copy(), keys).index
+
+    assert ids.name == '__row_id'
+    assert ids.to_list() == expected
+
+
+
+def test_siphash_ids(df):
+    ids = GAAPItoDB.makePrimaryKey(df.copy(), keys, 'siphash').index
+
+    assert ids.dtype == np.int64
+    assert ids.is_unique
+
+    # Same keys, same IDs
+    assert (GAAPItoDB.makePrimaryKey(df.copy(), keys, 'siphash').index == ids).all()
+
+
+
+def test_unknown_hash():
+    with pytest.raises(ValueError):
+        GAAPItoDB.makePrimaryKey(pd.DataFrame({'a': [1]}), ['a'], 'md5')
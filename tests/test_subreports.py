@@ -0,0 +1,93 @@
+#######################################
+##
+## How dimensions are laid out in subreports and how subreports are grouped in
+## batchGet() calls.
+##
+
+
+
+import logging
+
+from GAAPItoDB import GAAPItoDB
+
+
+
+def processor(**attributes):
+    # Without the constructor, that would connect to GA
+    p = GAAPItoDB.__new__(GAAPItoDB)
+
+    p.logger = logging.getLogger('test')
+
+    for a in attributes:
+        setattr(p, a, attributes[a])
+
+    return p
+
+
+
+def test_batches_of_subreports_per_call():
+    p = processor(subreportsPerCall=5)
+
+    assert p.subreportBatches(list(range(12))) == [[0,1,2,3,4], [5,6,7,8,9], [10,11]]
+    assert p.subreportBatches(list(range(5))) == [[0,1,2,3,4]]
+
+
+
+def test_one_subreport_per_call():
+    p = processor(subreportsPerCall=1)
+
+    assert p.subreportBatches(list(range(3))) == [[0], [1], [2]]
+
+
+
+def dimensions(packable):
+    return (
+        [{'title': f'k{i}', 'key': True} for i in range(2)] +
+        [{'title': f'd{i}', 'packable': i in packable} for i in range(10)]
+    )
+
+
+
+def test_non_packable_dimensions_go_alone_with_keys():
+    p = processor(dimensions=dimensions(packable=[]), dimensionStats=None)
+
+    assert p.subreportDimensions() == [[0, 1, i] for i in range(2, 12)]
+
+
+
+def test_packable_dimensions_share_subreports():
+    p = processor(dimensions=dimensions(packable=range(8)), dimensionStats=None)
+
+    assert p.subreportDimensions() == [
+        # Up to 9 dimensions, keys included
+        [0, 1,   2, 3, 4, 5, 6, 7, 8],
+        [0, 1,   9],
+        [0, 1,   10],
+        [0, 1,   11]
+    ]
+
+
+
+def test_only_keys():
+    p = processor(dimensions=dimensions(packable=[])[:2], dimensionStats=None)
+
+    assert p.subreportDimensions() == [[0, 1]]
+
+
+
+def test_packable_by_stats():
+    p = processor(
+        dimensionStats={
+            'full':    {'rows': 100, 'keyRows': 100, 'distinct': 3},
+            'partial': {'rows': 90,  'keyRows': 100, 'distinct': 40},
+            'empty':   {'rows': 0,   'keyRows': 0,   'distinct': 0}
+        }
+    )
+
+    assert p.isPackable({'title': 'full'})
+    assert not p.isPackable({'title': 'partial'})
+    assert not p.isPackable({'title': 'empty'})
+    assert not p.isPackable({'title': 'unknown'})
+
+    # Explicit declaration wins over stats
+    assert not p.isPackable({'title': 'full', 'packable': False})
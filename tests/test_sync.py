@@ -0,0 +1,193 @@
+#######################################
+##
+## Offline regression tests of GAAPItoDB.sync(): a small processor syncs synthetic
+## data served by GAFakeAPI into SQLite, in each of the ways data can be written,
+## and must end up with the same rows as a plain sync.
+##
+## Run from the root of the repository as:
+##
+##   python -m pytest tests
+##
+## With SQLite, dbWriters is always 1. Set GAAPITODB_TEST_DBURL to a PostgreSQL or
+## MySQL URL to exercise parallel DB writers too.
+##
+
+
+
+import datetime
+import os
+import pytest
+import sqlalchemy
+import pandas as pd
+
+from GAAPItoDB import GAAPItoDB, GAFakeAPI, GASyntheticData, GAMetrics
+
+
+
+start = datetime.datetime(2020, 6, 1)
+end = datetime.datetime(2020, 6, 3)
+hitsPerDay = 800
+
+
+
+dimensions = [
+    {
+        'title': 'utc_datetime',
+        'name': 'ga:dateHourMinute',
+        'type': 'datetime',
+        'synccursor': True,
+        'key': True,
+        'sort': True
+    },
+    {'title': 'hit_id',      'name': 'ga:dimension1', 'key': True},
+    {'title': 'session_id',  'name': 'ga:dimension2', 'key': True},
+    {'title': 'client_id',   'name': 'ga:dimension3', 'key': True},
+    {'title': 'sequence_id', 'name': 'ga:dimension4', 'key': True},
+    {'title': 'channel',     'name': 'ga:dimension5'},
+    {'title': 'product',     'name': 'ga:dimension6'},
+    {'title': 'agency',      'name': 'ga:dimension7'},
+    {'title': 'category',    'name': 'ga:dimension8'},
+    {'title': 'action',      'name': 'ga:dimension9'},
+    {'title': 'label',       'name': 'ga:dimension10'},
+    {'title': 'branch',      'name': 'ga:dimension11', 'type': 'int'}
+]
+
+
+
+# Items as "012-0001234" exploded in rows and split in int columns of the table,
+# while still text in memory
+spawnDimensions = dimensions + [
+    {
+        'title': 'sucursal_apolice',
+        'name': 'ga:dimension12',
+        'key': True,
+        'transform': 'explodeandsplit',
+        'transformspawncolumns': ['sucursal', 'apolice'],
+        'transformspawncolumnstypes': ['int', 'int'],
+        'transformparams': {
+            'explodeseparators': [','],
+            'splitseparators': ['-']
+        }
+    }
+]
+
+
+
+@pytest.fixture
+def dbURL(tmp_path):
+    return os.environ.get('GAAPITODB_TEST_DBURL', 'sqlite:///{}'.format(tmp_path / 'ga.db'))
+
+
+
+def sync(dbURL, syncEnd=end, hide=None, dimensions=dimensions, **params):
+    """
+    Sync synthetic data of `dimensions` from `start` to `syncEnd` into table 'ga' and return it,
+    sorted by __row_id. Rows of hits for which `hide` returns True are not served,
+    as if GA hadn't processed them yet.
+    """
+    fake = GAFakeAPI(None, timezone='America/Sao_Paulo')
+
+    processor = GAAPItoDB(
+        gaView=1,
+        gaAccount=2,
+        gaProperty='UA-2',
+        dimensions=dimensions,
+        start=start,
+        end=syncEnd,
+        endLag=datetime.timedelta(0),
+        credentialsFile=None,
+        dateRangePartitionSize=1,
+        dbWritePartitions=3,
+        dbURL=dbURL,
+        targetTable='ga',
+        processorName='test',
+        gaServiceFactory=fake,
+        **params
+    )
+
+    fake.data = GASyntheticData(dimensions, seed=1, hitsPerDay=hitsPerDay)
+
+    if hide is not None:
+        generateDay = fake.data.generateDay
+        fake.data.day = lambda date: (lambda day: day[~hide(day)])(generateDay(date))
+
+    processor.sync()
+
+    table = pd.read_sql('SELECT * FROM ga', sqlalchemy.create_engine(dbURL))
+    table['__row_id'] = table['__row_id'].map(bytes)
+
+    return table.sort_values('__row_id').reset_index(drop=True)
+
+
+
+@pytest.fixture
+def reference(dbURL):
+    return sync(dbURL, restart=True)
+
+
+
+def test_plain_sync(reference):
+    assert reference.shape[0] > 0
+    assert reference['__row_id'].is_unique
+    assert reference['utc_datetime'].notna().all()
+
+
+
+@pytest.mark.parametrize('params', [
+    {'dbWriters': 3},
+    {'dbWriteQueueBudget': 64*1024},
+    {'dbWriteChunkRows': 100},
+    {'upsert': True},
+    {'arrow': True}
+], ids=lambda params: ','.join(params.keys()))
+def test_write_modes(dbURL, reference, params):
+    table = sync(dbURL, restart=True, **params)
+
+    assert table.shape[0] == reference.shape[0]
+    assert set(table['__row_id']) == set(reference['__row_id'])
+
+
+
+def test_incremental_sync(dbURL, reference):
+    sync(dbURL, syncEnd=end - datetime.timedelta(hours=30), restart=True)
+    table = sync(dbURL)
+
+    assert table.equals(reference)
+
+
+
+def test_upsert_sync_again(dbURL, reference):
+    sync(dbURL, restart=True, upsert=True)
+    table = sync(dbURL, incremental=False, upsert=True)
+
+    assert table.equals(reference)
+
+
+
+@pytest.mark.parametrize('dimensions', [dimensions, spawnDimensions], ids=['text', 'int spawn columns'])
+def test_correction_window(dbURL, dimensions):
+    reference = sync(dbURL, restart=True, dimensions=dimensions)
+
+    def late(day):
+        # Some hits of the last evening synced reach GA only later
+        return day['ga:dateHourMinute'].str.slice(0, 10).isin(['2020060218', '2020060219']) & (day.index % 5 == 0)
+
+    before = sync(dbURL, hide=late, restart=True, dimensions=dimensions)
+
+    # Nothing new after the end, so only the correction window brings rows in
+    metrics = GAMetrics()
+    table = sync(dbURL, correctionWindow=datetime.timedelta(days=1), runMetrics=metrics, dimensions=dimensions)
+
+    assert table.equals(reference)
+
+    counts = {m['labels']['kind']: m['total'] for m in metrics.summary()['metrics']['correction_rows']}
+
+    # Rows are fetched again from the minute after the last one synced, a day before
+    synced = pd.to_datetime(before['utc_datetime'])
+    window = synced > synced.max() - datetime.timedelta(days=1)
+
+    assert counts == {
+        'inserted':  reference.shape[0] - before.shape[0],
+        'changed':   0,
+        'unchanged': window.sum()
+    }